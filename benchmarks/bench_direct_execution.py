@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Compares per command latency of commands executed with /bin/sh and executed directly without shell
+
+Usage: python benchmarks/bench_direct_execution.py [number of commands]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import core
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for command in ('date +%s', 'ls /'):
+        shell_time = timeit.timeit(lambda: core.exe(command, ''), number=number)
+        direct_time = timeit.timeit(lambda: core.exe(command, 'd'), number=number)
+
+        print('{cmd!r}: shell {shell:.3f} ms, direct {direct:.3f} ms, saved {saved:.3f} ms per command'.format(
+            cmd=command, shell=shell_time / number * 1000, direct=direct_time / number * 1000,
+            saved=(shell_time - direct_time) / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Measures the time of import of one submodule of shellpy packages of different size, both with empty cache of
+processed files and with filled one, to show that it does not grow with the size of the package
+
+Every import is made in a new python process with its own temp directory, so the cache is empty on the first import
+
+Usage: python benchmarks/bench_import.py [number of submodules ...]
+"""
+from __future__ import print_function
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import timeit
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+SUBMODULE = '''def run():
+    return `echo {index}`
+'''
+
+IMPORT_CODE = 'import shellpython; shellpython.init(); import spypackage.submodule0'
+
+
+def create_package(path, submodule_count):
+    package_path = os.path.join(path, 'spypackage')
+    os.makedirs(package_path)
+
+    with open(os.path.join(package_path, '__init__.spy'), 'w') as f:
+        f.write('')
+
+    for i in range(submodule_count):
+        with open(os.path.join(package_path, 'submodule{0}.spy'.format(i)), 'w') as f:
+            f.write(SUBMODULE.format(index=i))
+
+
+def main():
+    submodule_counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+
+    for submodule_count in submodule_counts:
+        work_dir = tempfile.mkdtemp()
+        try:
+            create_package(work_dir, submodule_count)
+
+            env = os.environ.copy()
+            env['PYTHONPATH'] = os.pathsep.join([REPO_ROOT, work_dir])
+            env['TMPDIR'] = work_dir
+
+            run_import = lambda: subprocess.check_call([sys.executable, '-c', IMPORT_CODE], env=env)
+            cold = timeit.timeit(run_import, number=1)
+            warm = min(timeit.repeat(run_import, number=1, repeat=5))
+
+            print('{count} submodules: first import {cold:.3f} s, cached import {warm:.3f} s'.format(
+                count=submodule_count, cold=cold, warm=warm))
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Measures the time of import of shellpython and of the start of a python process that imports it, and shows the
+modules that take most of the time with -X importtime of python 3.7 and above
+
+Usage: python benchmarks/bench_import_time.py [number of modules to show]
+"""
+from __future__ import print_function
+import os
+import sys
+import subprocess
+import timeit
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+IMPORTS = {
+    'script': 'import shellpython, shellpython.core',
+    'shellpy command': 'import shellpython.shellpy',
+}
+
+
+def run_python(args):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    process = subprocess.Popen([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return stderr.decode('utf-8')
+
+
+def show_import_profile(code, module_count):
+    # the lines are: import time: self [us] | cumulative | imported package
+    lines = [line for line in run_python(['-X', 'importtime', '-c', code]).splitlines()
+             if line.startswith('import time:') and not line.endswith('imported package')]
+    timings = []
+    for line in lines:
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative_time), int(self_time), name.rstrip()))
+
+    for cumulative_time, self_time, name in sorted(timings, reverse=True)[:module_count]:
+        print('    {cumulative:8.1f} ms {self:8.1f} ms {name}'.format(
+            cumulative=cumulative_time / 1000.0, self=self_time / 1000.0, name=name))
+
+
+def main():
+    module_count = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+
+    run_python(['-c', '; '.join(IMPORTS.values())])  # writes bytecode
+    baseline = min(timeit.repeat(lambda: run_python(['-c', 'pass']), number=1, repeat=10))
+    print('python start: {time:.1f} ms'.format(time=baseline * 1000))
+
+    for name, code in sorted(IMPORTS.items()):
+        elapsed = min(timeit.repeat(lambda: run_python(['-c', code]), number=1, repeat=10))
+        print('{name}: {time:.1f} ms ({code}), {extra:.1f} ms more than python start'.format(
+            name=name, time=elapsed * 1000, code=code, extra=(elapsed - baseline) * 1000))
+
+        if sys.version_info >= (3, 7):
+            print('  slowest imports, cumulative and self time:')
+            show_import_profile(code, module_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""Compares the cost of formatting a command with all local and global variables, as it was done before,
+with formatting it with only the variables that the command uses
+
+Usage: python benchmarks/bench_interpolation.py [number of global variables]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import preprocessor
+
+NUMBER = 100000
+
+
+def main():
+    global_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    namespace = dict(('variable_{0}'.format(i), i) for i in range(global_count))
+    namespace['exe'] = lambda cmd, params: cmd
+    code = '''
+def run(number):
+    path = '/tmp'
+    for i in range(number):
+        {expression}
+'''
+    for title, expression in (
+            ('all variables', "exe('ls -l {path}'.format(**dict(locals(), **globals())),'')"),
+            ('used variables', preprocessor._intermediate_to_final('both_shexe(ls -l {path})shexe()shexe'))):
+        exec(code.format(expression=expression), namespace)
+        elapsed = timeit.timeit(lambda: namespace['run'](NUMBER), number=1)
+
+        print('{title}: {time:.3f} us per command with {count} global variables'.format(
+            title=title, time=elapsed / NUMBER * 1000000, count=global_count))
+
+
+if __name__ == '__main__':
+    main()
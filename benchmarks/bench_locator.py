@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Measures the time the import hook of shellpy spends on lookups of modules that are not shellpy modules, which is
+what happens on every usual import once the hook is installed. Lookups of new names and repeated lookups answered
+by the cache of not found names are measured separately
+
+Usage: python benchmarks/bench_locator.py [number of extra sys.path entries]
+"""
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import locator
+from shellpython.importer import PreprocessorImporter
+
+
+def main():
+    extra_path_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        for i in range(extra_path_count):
+            path = os.path.join(work_dir, str(i))
+            os.mkdir(path)
+            sys.path.append(path)
+
+        importer = PreprocessorImporter()
+
+        # every real import looks up a name once, so names are distinct and no lookup is answered by the cache
+        number = 5000
+        names = ['missing_module_{0}'.format(i) for i in range(number)]
+
+        def find_distinct_names():
+            for name in names:
+                importer.find_spec(name, None)
+
+        elapsed = min(timeit.repeat(find_distinct_names, setup=locator.invalidate_caches, number=1, repeat=3))
+        print('{paths} sys.path entries: {time:.2f} us per lookup of a new name'.format(
+            paths=len(sys.path), time=elapsed / number * 1000000))
+
+        number = 10000
+        elapsed = min(timeit.repeat(lambda: importer.find_spec('json', None), number=number, repeat=3))
+        print('{paths} sys.path entries: {time:.2f} us per repeated lookup'.format(
+            paths=len(sys.path), time=elapsed / number * 1000000))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
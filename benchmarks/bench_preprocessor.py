@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""Measures the time of preprocessing of synthetic shellpy scripts of different size to show that it grows
+linearly with the size of the script
+
+Usage: python benchmarks/bench_preprocessor.py [number of lines ...]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import preprocessor
+
+BLOCK = '''# block {index}
+x = `echo 1
+y = p`echo {{x}}` == `echo 2`
+text = 'a string with ` symbol'
+z = `echo Long \\
+    line
+for line in `
+echo line 1
+echo line 2
+`:
+    print(line)
+
+'''
+
+
+def main():
+    line_counts = [int(arg) for arg in sys.argv[1:]] or [10000, 20000, 50000, 100000]
+    block_lines = BLOCK.count('\n')
+
+    for line_count in line_counts:
+        code = ''.join(BLOCK.format(index=i) for i in range(line_count // block_lines))
+        elapsed = min(timeit.repeat(lambda: preprocessor._preprocess_code(code), number=1, repeat=3))
+
+        print('{lines} lines: {time:.3f} s, {per_line:.2f} us per line'.format(
+            lines=line_count, time=elapsed, per_line=elapsed / line_count * 1000000))
+
+
+if __name__ == '__main__':
+    main()
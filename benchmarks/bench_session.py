@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""Compares per command latency of commands executed with a new /bin/sh for every command and executed in
+a long-lived bash session, see config.SESSION_EXECUTION
+
+Usage: python benchmarks/bench_session.py [number of commands]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import config, core
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for command in ('echo 1', 'date +%s', 'ls / | wc -l'):
+        config.SESSION_EXECUTION = False
+        popen_time = timeit.timeit(lambda: core.exe(command, ''), number=number)
+
+        config.SESSION_EXECUTION = True
+        session_time = timeit.timeit(lambda: core.exe(command, ''), number=number)
+
+        print('{cmd!r}: popen {popen:.3f} ms, session {session:.3f} ms, {speedup:.1f}x faster'.format(
+            cmd=command, popen=popen_time / number * 1000, session=session_time / number * 1000,
+            speedup=popen_time / session_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Compares peak memory of a python process that captures a big output of a command in memory and with the output
+spilled to a temporary file, see config.OUTPUT_SPILL_THRESHOLD. Every measurement is made in a new process.
+Peak rss of the spilled output includes pages of the mapped file that were read, they are clean and the kernel
+may drop them at any time
+
+Usage: python benchmarks/bench_spill.py [size of output in megabytes]
+"""
+from __future__ import print_function
+import os
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+MEASUREMENT = '''
+import resource, sys, time
+from shellpython import config, core
+config.OUTPUT_SPILL_THRESHOLD = {threshold}
+start = time.time()
+result = core.exe('head -c {size} /dev/zero | tr "\\\\\\\\0" "x" | fold -w 99', '')
+count = sum(1 for line in result)
+print(count, time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def measure(size, threshold):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output([sys.executable, '-c', MEASUREMENT.format(size=size, threshold=threshold)],
+                                     env=env)
+    count, seconds, max_rss = output.split()
+    return int(count), float(seconds), int(max_rss)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    for name, threshold in (('memory', None), ('spilled', 8 * 1024 * 1024)):
+        count, seconds, max_rss = measure(size * 1024 * 1024, threshold)
+        print('{name}: {count} lines in {seconds:.2f} s, peak rss {rss:.0f} MB'.format(
+            name=name, count=count, seconds=seconds, rss=max_rss / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Measures the time shellpy needs to execute a trivial script, when the script is executed in the process of shellpy
+and when it is executed in a new python process
+
+Usage: python benchmarks/bench_startup.py [number of runs]
+"""
+from __future__ import print_function
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import timeit
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+SCRIPT = '''x = `echo 1`
+'''
+
+IN_PROCESS_CODE = 'import sys; sys.argv = sys.argv[1:]; from shellpython import shellpy; shellpy.main({version})'
+
+NEW_PROCESS_CODE = 'import sys; from shellpython import shellpy; sys.exit(shellpy._execute(sys.argv[2], [], {version}))'
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        script = os.path.join(work_dir, 'script.spy')
+        with open(script, 'w') as f:
+            f.write(SCRIPT)
+
+        env = os.environ.copy()
+        env['PYTHONPATH'] = REPO_ROOT
+        env['SHELLPY_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+
+        for name, code in (('in process', IN_PROCESS_CODE), ('new process', NEW_PROCESS_CODE)):
+            code = code.format(version=sys.version_info[0])
+            run = lambda: subprocess.check_call([sys.executable, '-c', code, 'shellpy', script], env=env)
+            run()  # fills the cache
+
+            elapsed = min(timeit.repeat(run, number=number, repeat=3))
+            print('{name}: {time:.1f} ms per script'.format(name=name, time=elapsed / number * 1000))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""Compares ways to feed many lines to stdin of a command: line by line with swriteline of interactive mode, with
+a generator passed as stdin of exe and with a pipe from another command that python does not read at all
+
+Usage: python benchmarks/bench_stdin.py [number of lines]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from shellpython import core
+
+
+def interactive(number):
+    result = core.exe('sort -u | wc -l', 'i')
+    for i in range(number):
+        result.swriteline(str(i % 100000))
+    result.stdin.close()
+    return result.sreadline()
+
+
+def generator(number):
+    return core.exe('sort -u | wc -l', '', stdin=(str(i % 100000) for i in range(number))).stdout
+
+
+def pipeline(number):
+    return core.exe('sort -u | wc -l', '', stdin=core.exe('seq {0}'.format(number), 's')).stdout
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    for function in (interactive, generator, pipeline):
+        seconds = timeit.timeit(lambda: function(number), number=1)
+        print('{name}: {seconds:.2f} s for {number} lines'.format(name=function.__name__, seconds=seconds,
+                                                                 number=number))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,10 @@ try:
         'console_scripts': {
             'shellpy = shellpython.shellpy:main2',
             'shellpy2 = shellpython.shellpy:main2',
-            'shellpy3 = shellpython.shellpy:main3'
+            'shellpy3 = shellpython.shellpy:main3',
+            'shellpy-client = shellpython.client:main2',
+            'shellpy2-client = shellpython.client:main2',
+            'shellpy3-client = shellpython.client:main3'
         }
     }}
 
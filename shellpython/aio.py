@@ -0,0 +1,188 @@
+"""Asynchronous execution of shell commands with asyncio. Available only in python 3.5 and above
+
+Commands with the 'a' parameter are converted to aexe calls that return awaitables, so many commands may run
+concurrently in one event loop:
+
+    async def check(hosts):
+        return await asyncio.gather(*[a`ping -c 1 {host}` for host in hosts])
+"""
+import asyncio
+import os
+import sys
+from asyncio.subprocess import PIPE
+from shellpython import config
+from shellpython import core
+from shellpython.core import Result, _is_param_set
+
+
+async def aexe(cmd, params, timeout=None, rlimits=None):
+    """Asynchronous counterpart of core.exe. It executes commands with asyncio subprocesses
+
+    :param cmd: command to be executed
+    :param params: parameters passed before ` character, i.e. ap`echo 1 which means print result of execution
+    :param timeout: time in seconds the command may run, config.COMMAND_TIMEOUT if None, see core.exe. The command
+        is also killed with its process group if the awaiting task is cancelled
+    :param rlimits: resource limits of the command, config.COMMAND_RLIMITS if None, see config.COMMAND_RLIMITS
+    :return: result of execution. It may be either Result or AsyncInteractiveResult
+    """
+    core._print_command(cmd)
+
+    if timeout is None:
+        timeout = config.COMMAND_TIMEOUT
+    if rlimits is None:
+        rlimits = config.COMMAND_RLIMITS
+
+    if _is_param_set(params, core._PARAM_INTERACTIVE):
+        return await _create_interactive_result(cmd, params, timeout, rlimits)
+    else:
+        return await _create_result(cmd, params, timeout, rlimits)
+
+
+class AsyncStream:
+    """Asynchronous version of core.Stream. It wraps a stream of asyncio subprocess
+
+    You can iterate over lines of it like this: async for line in AsyncStream:
+    Lines of a stream without encoding are not decoded and they are bytes, see the raw parameter
+    """
+    def __init__(self, stream, encoding, print_out_stream=False, color=None):
+        self._stream = stream
+        self._encoding = encoding
+        self._print_out_stream = print_out_stream
+        self._color = color
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.sreadline()
+
+    async def sreadline(self):
+        """Reads one line from the stream
+
+        :return: the line without line separator
+        :raises StopAsyncIteration: if the end of the stream is reached
+        """
+        line = await self._stream.readline()
+        if not line:
+            raise StopAsyncIteration
+
+        if self._encoding is None:
+            line = line[:-1] if line.endswith(b'\n') else line
+        else:
+            line = line.decode(self._encoding).rstrip(os.linesep)
+
+        if self._print_out_stream:
+            if self._color is None:
+                core._print_stdout(core._printable(line))
+            else:
+                core._print_stdout(self._color + core._printable(line) + core._colorama.Style.RESET_ALL)
+
+        return line
+
+    async def swriteline(self, text):
+        """Writes one line to the stream and waits until it is sent to the process
+
+        :param text: the line to write without line separator
+        """
+        self._stream.write((text + os.linesep).encode(self._encoding))
+        await self._stream.drain()
+
+
+class AsyncInteractiveResult:
+    """Result of a shell command executed asynchronously in interactive mode, e.g. with ai`cmd`
+
+    It works as core.InteractiveResult but all the reads and writes must be awaited. The return code
+    is available after the command is finished, to wait for it use: await AsyncInteractiveResult.wait()
+    """
+    def __init__(self, process, params, deadline):
+        self._process = process
+        self._params = params
+        self._deadline = deadline
+        self.stdin = AsyncStream(process.stdin, core._get_encoding(sys.stdin))
+
+        stdout_encoding, stderr_encoding = core._get_output_encodings(params)
+
+        print_stdout = _is_param_set(params, core._PARAM_PRINT_STDOUT) or config.PRINT_STDOUT_ALWAYS
+        self.stdout = AsyncStream(process.stdout, stdout_encoding, print_stdout)
+
+        print_stderr = _is_param_set(params, core._PARAM_PRINT_STDERR) or config.PRINT_STDERR_ALWAYS
+        color = None if not core._is_colorama_enabled() else core._colorama.Fore.RED
+        self.stderr = AsyncStream(process.stderr, stderr_encoding, print_stderr, color)
+
+    async def sreadline(self):
+        return await self.stdout.sreadline()
+
+    async def swriteline(self, text):
+        await self.stdin.swriteline(text)
+
+    async def wait(self):
+        """Waits for the command to finish
+
+        :return: the return code of the command
+        """
+        try:
+            return await self._process.wait()
+        except BaseException:
+            core._kill_process_group(self._process)
+            raise
+        finally:
+            self._deadline.cancel()
+
+    @property
+    def timed_out(self):
+        """Shows whether the command was killed because its timeout passed
+        """
+        return self._deadline.expired
+
+    @property
+    def returncode(self):
+        """Return code of the command or None if it is still running
+        """
+        return self._process.returncode
+
+    def __aiter__(self):
+        return self.stdout
+
+
+async def _create_process(cmd, timeout, rlimits, **kwargs):
+    """Starts the command with shell the same way as core._popen does
+
+    :param cmd: the command to start
+    :param timeout: timeout of the command, if set the command is started in its own process group
+    :param rlimits: resource limits of the command
+    :param kwargs: arguments passed to asyncio.create_subprocess_shell
+    :return: the started process and its deadline
+    """
+    new_process_group = timeout is not None and sys.platform != 'win32'
+    kwargs.update(core._get_process_kwargs(new_process_group, rlimits))
+
+    process = await asyncio.create_subprocess_shell(cmd, env=os.environ, **kwargs)
+    if new_process_group:
+        core._register_process_group(process)
+
+    # the timer of the deadline runs in its own thread, so the command is killed even if the event loop is busy
+    return process, core._Deadline(process, timeout)
+
+
+async def _create_result(cmd, params, timeout=None, rlimits=None):
+    process, deadline = await _create_process(cmd, timeout, rlimits, stdout=PIPE, stderr=PIPE)
+
+    try:
+        stdout_data, stderr_data = await process.communicate()
+    except BaseException:
+        # e.g. the task is cancelled
+        core._kill_process_group(process)
+        raise
+    finally:
+        deadline.cancel()
+
+    result = Result(stdout_data, stderr_data, *core._get_output_encodings(params))
+    result.returncode = process.returncode
+
+    return core._finish_result(cmd, params, result, deadline)
+
+
+async def _create_interactive_result(cmd, params, timeout=None, rlimits=None):
+    process, deadline = await _create_process(cmd, timeout, rlimits, stdout=PIPE, stderr=PIPE, stdin=PIPE)
+
+    return AsyncInteractiveResult(process, params, deadline)
@@ -0,0 +1,29 @@
+"""Thin client of shellpy server, see server module. It has the same command line as shellpy and executes the script
+with the server if it is running, otherwise the script is executed as usual
+"""
+import sys
+from shellpython import server
+from shellpython import shellpy
+
+
+def main2():
+    main(python_version=2)
+
+
+def main3():
+    main(python_version=3)
+
+
+def main(python_version):
+    shellpy_args, filename, script_args = shellpy._parse_arguments(sys.argv)
+
+    if filename is None:
+        exit('No *.spy file was specified. Only *.spy files are supported by the tool.')
+
+    shellpy._apply_arguments(shellpy_args)
+
+    exit_code = server.run_script(filename, script_args, python_version, shellpy_args.socket)
+    if exit_code is None:
+        exit_code = shellpy._execute_script(filename, script_args, python_version)
+
+    exit(exit_code)
@@ -1,5 +1,3 @@
-import pickle
-import base64
 import sys
 
 # TODO: subject for further refactoring. Config should be serialized in nicer way. Now we cannot do it unless we break
@@ -17,9 +15,44 @@ PRINT_STDERR_ALWAYS = False
 # colorama is a plugin that makes output colored, this flag controls whether it is enabled
 COLORAMA_ENABLED = True
 
+# executes simple commands that do not use any shell syntax directly without /bin/sh, which saves start of shell
+# for every command. Commands that need shell are still executed with it
+DIRECT_EXECUTION = False
+
+# encoding of output of commands and of text sent to them. None means the encoding of stdout, stderr or stdin of
+# python and if it is not known, e.g. when stdout is redirected in python 2, the preferred encoding of the locale
+ENCODING = None
+
+# executes commands in a long-lived bash process of the current thread instead of starting a new shell for every
+# command, see shellpython.session. cd and export then persist between commands. Commands in interactive, streaming
+# and background modes and commands with a timeout or resource limits are still executed in new processes
+SESSION_EXECUTION = False
+
+# size in bytes of stdout or stderr of a command above which the output is written to an unlinked temporary file
+# instead of memory. The file is mapped with mmap and lines of the result are read from it only when they are
+# accessed, so memory used by the result does not depend on the size of the output. None means no limit
+OUTPUT_SPILL_THRESHOLD = None
+
+# default timeout of every command in seconds, None means no timeout. A command that does not finish in time is killed
+# together with all the processes it started and CommandTimeoutError is thrown, see core.exe
+COMMAND_TIMEOUT = None
+
+# default resource limits of every command as a dict of resource names of the resource module without RLIMIT_ prefix
+# and their values, e.g. {'cpu': 60, 'as': 1024 ** 3} for one minute of cpu time and 1GB of address space. A value
+# may also be a tuple of soft and hard limit. None means no limits. Available only on unix
+COMMAND_RLIMITS = None
+
+# names of the settings above that are passed to the processed script with dumps and loads
+_SERIALIZED_SETTINGS = ('PRINT_ALL_COMMANDS', 'PRINT_STDOUT_ALWAYS', 'PRINT_STDERR_ALWAYS', 'COLORAMA_ENABLED',
+                        'DIRECT_EXECUTION', 'COMMAND_TIMEOUT', 'COMMAND_RLIMITS', 'SESSION_EXECUTION',
+                        'OUTPUT_SPILL_THRESHOLD', 'ENCODING')
+
 
 def dumps():
-    config_tuple = (PRINT_ALL_COMMANDS, PRINT_STDOUT_ALWAYS, PRINT_STDERR_ALWAYS, COLORAMA_ENABLED)
+    import pickle
+    import base64
+
+    config_tuple = tuple(globals()[name] for name in _SERIALIZED_SETTINGS)
     serialized_config = pickle.dumps(config_tuple)
 
     if sys.version_info[0] == 2:
@@ -29,7 +62,8 @@ def dumps():
 
 
 def loads(data):
-    global PRINT_ALL_COMMANDS, PRINT_STDOUT_ALWAYS, PRINT_STDERR_ALWAYS, COLORAMA_ENABLED
+    import pickle
+    import base64
 
     if sys.version_info[0] == 2:
         serialized_config = base64.b64decode(data)
@@ -38,4 +72,5 @@ def loads(data):
 
     config_tuple = pickle.loads(serialized_config)
 
-    PRINT_ALL_COMMANDS, PRINT_STDOUT_ALWAYS, PRINT_STDERR_ALWAYS, COLORAMA_ENABLED = config_tuple
+    for name, value in zip(_SERIALIZED_SETTINGS, config_tuple):
+        globals()[name] = value
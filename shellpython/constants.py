@@ -1 +1,3 @@
 SHELLPY_PARAMS = 'SHELLPY_PARAMS'
+SHELLPY_VERSION = '0.5.1'
+SHELLPY_CACHE_DIR = 'SHELLPY_CACHE_DIR'
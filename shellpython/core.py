@@ -1,21 +1,46 @@
 from __future__ import print_function
 import os
+import re
 import sys
+import errno
+import signal
+import time
 import subprocess
+import threading
+import weakref
 from os import environ as env
 from shellpython import config
 
-_colorama_intialized = False
-_colorama_available = True
 try:
-    import colorama
-    from colorama import Fore, Style
+    import selectors as _selectors
 except ImportError:
-    _colorama_available = False
+    # python 2 has only select module, see Stream._wait_readable
+    _selectors = None
+
+# colorama module, it is imported and initialized only when colored output is needed, see _get_colorama.
+# False means that colorama is not available
+_colorama = None
+
+
+def _get_colorama():
+    """Imports and initializes colorama when colored output is needed for the first time
+
+    :return: colorama module or None if it is not available
+    """
+    global _colorama
+    if _colorama is None:
+        try:
+            import colorama
+            colorama.init()
+            _colorama = colorama
+        except ImportError:
+            _colorama = False
+
+    return _colorama or None
 
 
 def _is_colorama_enabled():
-    return _colorama_available and config.COLORAMA_ENABLED
+    return config.COLORAMA_ENABLED and _get_colorama() is not None
 
 
 def _print_stdout(text):
@@ -38,31 +63,115 @@ _PARAM_INTERACTIVE = 'i'
 # specific command. It may be useful if for some reason this command does not return 0 even for successful run
 _PARAM_NO_THROW = 'n'
 
+# streaming mode. Lines of stdout are returned one by one while the command is still running, so the output
+# is never kept in memory as a whole. Useful to process big outputs like this: for line in s`zcat huge.gz`:
+_PARAM_STREAM = 's'
+
+# asynchronous mode. The command is executed with asyncio and an awaitable is returned, see aexe
+_PARAM_ASYNC = 'a'
+
+# background mode. The command is started and a Job is returned at once without waiting for the command to finish
+_PARAM_BACKGROUND = 'b'
+
+# direct mode. The command is split to arguments with shlex and executed without /bin/sh, so shell syntax like
+# pipes or variables is not interpreted. Simple commands may be executed directly always, see config.DIRECT_EXECUTION
+_PARAM_DIRECT = 'd'
+
+# raw mode. Stdout of the command is not decoded, so binary output may be captured, e.g. r`tar -cz dir`. Result.stdout
+# is bytes exactly as the command printed them and lines of stdout are bytes as well. Stderr is decoded as usual
+_PARAM_RAW = 'r'
+
+# size of a single read from stdout or stderr pipe of an executed command
+_PIPE_CHUNK_SIZE = 64 * 1024
+
+# a command that contains any of these characters needs shell to be executed
+_SHELL_SYNTAX_PATTERN = re.compile(r'[|&;<>()$`\\*?\[\]{}~#!\n]')
+
+# builtins and keywords of shell that either do not exist as programs or work differently than programs
+_SHELL_BUILTINS = frozenset([
+    '.', ':', 'alias', 'bg', 'break', 'case', 'cd', 'command', 'continue', 'do', 'done', 'echo', 'elif', 'else',
+    'esac', 'eval', 'exec', 'exit', 'export', 'fg', 'fi', 'for', 'function', 'getopts', 'hash', 'if', 'jobs',
+    'local', 'read', 'readonly', 'return', 'select', 'set', 'shift', 'source', 'then', 'time', 'times', 'trap',
+    'type', 'ulimit', 'umask', 'unalias', 'unset', 'until', 'wait', 'while'
+])
 
-def exe(cmd, params):
+# only this amount of the last bytes of stderr is kept for commands run in streaming mode
+_STREAM_STDERR_LIMIT = 64 * 1024
+
+# seconds a command terminated with SIGTERM has to finish before it is killed with SIGKILL
+_TERMINATE_GRACE_PERIOD = 1
+
+# processes of commands started in their own process group, their groups are killed if they are still running
+# when python exits, so that interrupted commands are not left behind. See _popen
+_process_group_leaders = weakref.WeakSet()
+
+# type of items of the array of line offsets of output spilled to disk, 64 bit integers where it is available
+_OFFSET_TYPECODE = 'q' if sys.version_info >= (3, 3) else 'l'
+
+
+def exe(cmd, params, timeout=None, rlimits=None, stdin=None):
     """This function runs after preprocessing of code. It actually executes commands with subprocess
 
     :param cmd: command to be executed with subprocess
     :param params: parameters passed before ` character, i.e. p`echo 1 which means print result of execution
-    :return: result of execution. It may be either Result or InteractiveResult
+    :param timeout: time in seconds the command may run, config.COMMAND_TIMEOUT if None. The command is started in
+        its own process group and the whole group is killed when the time is over, so that no processes started
+        by the command are left behind. CommandTimeoutError is thrown then, see it for details
+    :param rlimits: resource limits of the command, config.COMMAND_RLIMITS if None, see config.COMMAND_RLIMITS
+    :param stdin: source of stdin of the command. It may be a StreamingResult whose lines are not read yet, then its
+        stdout is connected to stdin of the command with a pipe of the operating system and the data is not read by
+        python at all, e.g. exe('sort -u', '', stdin=s`zcat huge.gz`). Return codes of all the commands of such
+        pipeline are in Result.pipestatus and the return code of the result is the one of the last failed command
+        as with pipefail option of bash. A file object or a file descriptor is given to the command as it is, so
+        the command reads the file itself from its current position. Bytes, text, Result, file-like objects without
+        a descriptor and iterables of lines are written to the command by a background thread in big chunks while
+        its output is read. A line separator is added to every line of an iterable. Text is encoded with the
+        encoding of stdin, see config.ENCODING
+    :return: result of execution. It may be either Result, InteractiveResult, StreamingResult or Job
+    """
+    _print_command(cmd)
+
+    if timeout is None:
+        timeout = config.COMMAND_TIMEOUT
+    if rlimits is None:
+        rlimits = config.COMMAND_RLIMITS
+
+    if _is_param_set(params, _PARAM_INTERACTIVE):
+        if stdin is not None:
+            raise ShellpyError('Stdin of commands executed in interactive mode is written with swriteline')
+        return _create_interactive_result(cmd, params, timeout, rlimits)
+
+    stdin = _get_stdin(stdin)
+
+    if _is_param_set(params, _PARAM_STREAM):
+        return _create_streaming_result(cmd, params, timeout, rlimits, stdin)
+    elif _is_param_set(params, _PARAM_BACKGROUND):
+        return _create_job(cmd, params, timeout, rlimits, stdin)
+    else:
+        return _create_result(cmd, params, timeout, rlimits, stdin)
+
+
+def aexe(cmd, params, timeout=None, rlimits=None):
+    """Asynchronous version of exe that is used for commands with the 'a' parameter. It returns an awaitable,
+    see shellpython.aio.aexe for details. Available only in python 3.5 and above
+
+    :param cmd: command to be executed
+    :param params: parameters passed before ` character, i.e. a`echo 1
+    :param timeout: time in seconds the command may run, config.COMMAND_TIMEOUT if None, see exe
+    :param rlimits: resource limits of the command, config.COMMAND_RLIMITS if None, see config.COMMAND_RLIMITS
+    :return: awaitable that returns result of execution
     """
+    from shellpython import aio
+    return aio.aexe(cmd, params, timeout, rlimits)
 
-    global _colorama_intialized
-    if _is_colorama_enabled() and not _colorama_intialized:
-        _colorama_intialized = True
-        colorama.init()
 
+def _print_command(cmd):
     if config.PRINT_ALL_COMMANDS:
         if _is_colorama_enabled():
-            _print_stdout(Fore.GREEN + '>>> ' + cmd + Style.RESET_ALL)
+            _print_stdout(_colorama.Fore.GREEN + '>>> ' + cmd + _colorama.Style.RESET_ALL)
         else:
             _print_stdout('>>> ' + cmd)
 
-    if _is_param_set(params, _PARAM_INTERACTIVE):
-        return _create_interactive_result(cmd, params)
-    else:
-        return _create_result(cmd, params)
-
 
 def _is_param_set(params, param):
     return True if params.find(param) != -1 else False
@@ -84,19 +193,77 @@ class NonZeroReturnCodeError(ShellpyError):
     def __str__(self):
         if _is_colorama_enabled():
             return 'Command {red}\'{cmd}\'{end} failed with error code {code}, stderr output is {red}{stderr}{end}'\
-                .format(red=Fore.RED, end=Style.RESET_ALL, cmd=self.cmd, code=self.result.returncode,
-                        stderr=self.result.stderr)
+                .format(red=_colorama.Fore.RED, end=_colorama.Style.RESET_ALL, cmd=self.cmd,
+                        code=self.result.returncode, stderr=self.result.stderr)
         else:
             return 'Command \'{cmd}\' failed with error code {code}, stderr output is {stderr}'.format(
                     cmd=self.cmd, code=self.result.returncode, stderr=self.result.stderr)
 
 
+class CommandTimeoutError(ShellpyError):
+    """This is thrown when the executed command does not finish in time. The command and all the processes started
+    by it are killed by then. The result contains the output the command printed before it was killed, in streaming
+    mode only the end of stderr. The error is thrown regardless of the no throw parameter
+    """
+    def __init__(self, cmd, timeout, result):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.result = result
+
+    def __str__(self):
+        if _is_colorama_enabled():
+            return 'Command {red}\'{cmd}\'{end} timed out after {timeout} seconds, stderr output is {red}{stderr}{end}'\
+                .format(red=_colorama.Fore.RED, end=_colorama.Style.RESET_ALL, cmd=self.cmd,
+                        timeout=self.timeout, stderr=self.result.stderr)
+        else:
+            return 'Command \'{cmd}\' timed out after {timeout} seconds, stderr output is {stderr}'.format(
+                    cmd=self.cmd, timeout=self.timeout, stderr=self.result.stderr)
+
+
+class StreamTimeoutError(ShellpyError):
+    """This is thrown when a stream of a command in interactive mode does not print the expected output in time.
+    The command keeps running and the output read so far stays in the stream, it is also available as data
+    """
+    def __init__(self, timeout, data):
+        self.timeout = timeout
+        self.data = data
+
+    def __str__(self):
+        return 'Expected output was not read in {timeout} seconds, the output read so far is {data}'.format(
+            timeout=self.timeout, data=self.data)
+
+
 class Stream:
+    """A pipe of a command executed in interactive mode. Output is read in chunks as soon as the command prints it and
+    every chunk is decoded at once with an incremental decoder, which handles characters split between chunks.
+    Lines of a stream without encoding are not decoded and they are bytes, see the raw parameter
+
+    Besides reading line by line, the output can be read with a timeout, read without waiting with read_available
+    or matched against regular expressions with expect, e.g. to answer a prompt that does not end with a newline.
+    Reads with a timeout work only on unix
+    """
     def __init__(self, file, encoding, print_out_stream=False, color=None):
         self._file = file
         self._encoding = encoding
         self._print_out_stream = print_out_stream
         self._color = color
+        self._decoder = None
+        if encoding is not None and sys.version_info[0] == 3:
+            import codecs
+            self._decoder = codecs.getincrementaldecoder(encoding)()
+
+        # lines that are read from the pipe and the index of the next line to return. The end of the output that
+        # does not have line separator yet is kept as a list of pieces
+        self._newline = '\n' if self._decoder is not None else b'\n'
+        self._lines = []
+        self._line_index = 0
+        self._partial_line = []
+        self._eof = False
+        self._selector = None
+
+        # the output before the last match of expect and the match object
+        self.before = None
+        self.match = None
 
     def __iter__(self):
         return self
@@ -106,22 +273,186 @@ class Stream:
 
     __next__ = next
 
-    def sreadline(self):
-        line = self._file.readline()
-        if sys.version_info[0] == 3:
-            line = line.decode(self._encoding)
+    def sreadline(self, timeout=None):
+        """Reads one line from the stream, it waits until the whole line is printed by the command
 
-        if line == '':
+        :param timeout: the maximum time to wait for the line in seconds, if None it waits until the line is printed
+        :return: the line without line separator
+        :raises StopIteration: if the end of the stream is reached
+        :raises StreamTimeoutError: if the line is not printed in time, the output read so far is kept in the stream
+        """
+        line = self._read_line(timeout)
+        if line is None:
             raise StopIteration
-        else:
+
+        if os.linesep != '\n' and (self._decoder is not None or sys.version_info[0] == 2):
             line = line.rstrip(os.linesep)
-            if self._print_out_stream:
-                if self._color is None:
-                    _print_stdout(line)
-                else:
-                    _print_stdout(self._color + line + Style.RESET_ALL)
 
-            return line
+        if self._print_out_stream:
+            if self._color is None:
+                _print_stdout(_printable(line))
+            else:
+                _print_stdout(self._color + _printable(line) + _colorama.Style.RESET_ALL)
+
+        return line
+
+    def read_available(self):
+        """Reads all the output the command has printed so far without waiting for more, e.g. a prompt that does not
+        end with a line separator. The output is not printed even if the stream is printed
+
+        :return: the output with line separators, empty if nothing is printed yet or the end of the stream is reached
+        """
+        while not self._eof and self._read_chunk(0):
+            pass
+
+        return self._take_unread()
+
+    def expect(self, patterns, timeout=None):
+        """Reads the stream until one of the patterns is found in the output, e.g. stream.expect('[Pp]assword: ?$')
+        Only the output up to the end of the match is consumed. The output before the match is stored in
+        Stream.before and the match object in Stream.match. The output is not printed even if the stream is printed
+
+        :param patterns: a regular expression or a list of them, either strings or compiled patterns. Patterns of
+            streams in raw mode must be bytes
+        :param timeout: the maximum time to wait for the match in seconds, if None it waits until the match is found
+        :return: index of the pattern that matched, the pattern that matches earliest in the output wins
+        :raises EOFError: if the end of the stream is reached without a match
+        :raises StreamTimeoutError: if no pattern matches in time, the output read so far is kept in the stream
+        """
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        patterns = [re.compile(pattern) if isinstance(pattern, (type(u''), bytes)) else pattern
+                    for pattern in patterns]
+        deadline = _get_deadline(timeout)
+
+        while True:
+            text = self._take_unread()
+
+            found = None
+            for index, pattern in enumerate(patterns):
+                match = pattern.search(text)
+                if match is not None and (found is None or match.start() < found[1].start()):
+                    found = (index, match)
+
+            if found is not None:
+                index, self.match = found
+                self.before = text[:self.match.start()]
+                self._put_back(text[self.match.end():])
+                return index
+
+            self._put_back(text)
+
+            if self._eof:
+                raise EOFError('The end of the stream is reached, but no pattern matched')
+
+            if not self._read_chunk(_get_remaining_time(deadline)):
+                raise StreamTimeoutError(timeout, text)
+
+    @property
+    def eof(self):
+        """Shows whether the command closed the stream and all of its output is read
+        """
+        return self._eof and self._line_index == len(self._lines) and not self._partial_line
+
+    def _read_line(self, timeout=None):
+        """Returns the next line and reads the pipe until the line is complete
+
+        :param timeout: the maximum time to wait for the line in seconds, if None it waits until the line is printed
+        :return: the line without the line separator or None at the end of the stream
+        :raises StreamTimeoutError: if the line is not printed in time
+        """
+        deadline = _get_deadline(timeout)
+
+        while self._line_index == len(self._lines):
+            if self._eof:
+                if not self._partial_line:
+                    return None
+
+                line = self._newline[:0].join(self._partial_line)
+                self._partial_line = []
+                return line
+
+            if not self._read_chunk(_get_remaining_time(deadline)):
+                raise StreamTimeoutError(timeout, self._newline[:0].join(self._partial_line))
+
+        line = self._lines[self._line_index]
+        self._line_index += 1
+        return line
+
+    def _read_chunk(self, timeout=None):
+        """Reads the next chunk from the pipe and splits it to lines, the lines are added to the lines that are not
+        returned yet
+
+        :param timeout: the maximum time to wait for the output in seconds, if None it waits until the command prints
+            something or closes the pipe
+        :return: False if nothing was printed in time, True otherwise
+        """
+        if timeout is not None and not self._wait_readable(timeout):
+            return False
+
+        data = os.read(self._file.fileno(), _PIPE_CHUNK_SIZE)
+        if not data:
+            self._eof = True
+
+        if self._decoder is not None:
+            data = self._decoder.decode(data, final=self._eof)
+
+        if self._newline not in data:
+            if data:
+                self._partial_line.append(data)
+            return True
+
+        self._partial_line.append(data)
+        lines = self._newline[:0].join(self._partial_line).split(self._newline)
+        last_line = lines.pop()
+        self._partial_line = [last_line] if last_line else []
+
+        if self._line_index < len(self._lines):
+            lines = self._lines[self._line_index:] + lines
+        self._lines = lines
+        self._line_index = 0
+        return True
+
+    def _wait_readable(self, timeout):
+        """Waits until the pipe has output to read or it is closed. Works only on unix, where pipes can be selected
+
+        :param timeout: the maximum time to wait in seconds
+        :return: True if the pipe is ready to be read
+        """
+        if _selectors is None:
+            import select
+            return bool(select.select([self._file], [], [], timeout)[0])
+
+        if self._selector is None:
+            self._selector = _selectors.DefaultSelector()
+            self._selector.register(self._file, _selectors.EVENT_READ)
+
+        return bool(self._selector.select(timeout))
+
+    def _take_unread(self):
+        """Removes all the output that is read from the pipe but not returned yet from the stream
+
+        :return: the output with line separators
+        """
+        empty = self._newline[:0]
+        text = empty.join(line + self._newline for line in self._lines[self._line_index:]) + \
+            empty.join(self._partial_line)
+
+        self._lines = []
+        self._line_index = 0
+        self._partial_line = []
+        return text
+
+    def _put_back(self, text):
+        """Returns the output taken with _take_unread to the stream, so that it is read again
+
+        :param text: the output with line separators
+        """
+        lines = text.split(self._newline)
+        last_line = lines.pop()
+        self._lines = lines
+        self._line_index = 0
+        self._partial_line = [last_line] if last_line else []
 
     def swriteline(self, text):
         text_with_linesep = text + os.linesep
@@ -131,6 +462,25 @@ class Stream:
         self._file.write(text_with_linesep)
         self._file.flush()
 
+    def swritelines(self, lines):
+        """Writes many lines to the stream at once, the stream is flushed only at the end
+
+        :param lines: iterable of lines without line separators
+        """
+        linesep = os.linesep if sys.version_info[0] == 2 else os.linesep.encode(self._encoding)
+        for batch in _join_to_batches(_encode_lines(lines, self._encoding, linesep)):
+            self._file.write(batch)
+
+        self._file.flush()
+
+    def close(self):
+        """Closes the stream, e.g. to let the command know that there is no more input
+        """
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        self._file.close()
+
 
 class InteractiveResult:
     """Result of a shell command execution.
@@ -140,29 +490,60 @@ class InteractiveResult:
     You can also iterate over lines of result like this: for line in Result:
     You can compare two results that will mean compare of result strings
     """
-    def __init__(self, process, params):
+    def __init__(self, process, params, deadline):
         self._process = process
         self._params = params
-        self.stdin = Stream(process.stdin, sys.stdin.encoding)
+        self._deadline = deadline
+        self.stdin = Stream(process.stdin, _get_encoding(sys.stdin))
+
+        stdout_encoding, stderr_encoding = _get_output_encodings(params)
 
         print_stdout = _is_param_set(params, _PARAM_PRINT_STDOUT) or config.PRINT_STDOUT_ALWAYS
-        self.stdout = Stream(process.stdout, sys.stdout.encoding, print_stdout)
+        self.stdout = Stream(process.stdout, stdout_encoding, print_stdout)
 
         print_stderr = _is_param_set(params, _PARAM_PRINT_STDERR) or config.PRINT_STDERR_ALWAYS
-        color = None if not _is_colorama_enabled() else Fore.RED
-        self.stderr = Stream(process.stderr, sys.stderr.encoding, print_stderr, color)
+        color = None if not _is_colorama_enabled() else _colorama.Fore.RED
+        self.stderr = Stream(process.stderr, stderr_encoding, print_stderr, color)
+
+    def sreadline(self, timeout=None):
+        return self.stdout.sreadline(timeout)
+
+    def read_available(self):
+        return self.stdout.read_available()
+
+    def expect(self, patterns, timeout=None):
+        """Reads stdout until one of the patterns is found, see Stream.expect
 
-    def sreadline(self):
-        return self.stdout.sreadline()
+        :param patterns: a regular expression or a list of them
+        :param timeout: the maximum time to wait for the match in seconds, if None it waits until the match is found
+        :return: index of the pattern that matched
+        """
+        return self.stdout.expect(patterns, timeout)
 
     def swriteline(self, text):
         self.stdin.swriteline(text)
 
+    def swritelines(self, lines):
+        self.stdin.swritelines(lines)
+
     @property
     def returncode(self):
-        self._process.wait()
+        try:
+            self._process.wait()
+        except BaseException:
+            _kill_process_group(self._process)
+            raise
+        finally:
+            self._deadline.cancel()
+
         return self._process.returncode
 
+    @property
+    def timed_out(self):
+        """Shows whether the command was killed because its timeout passed. Its streams are closed then
+        """
+        return self._deadline.expired
+
     def __iter__(self):
         return iter(self.stdout)
 
@@ -172,7 +553,7 @@ class InteractiveResult:
     __nonzero__ = __bool__
 
 
-class Result:
+class Result(object):
     """Result of a shell command execution.
 
     To get the result stdout as string use str(Result) or Result.stdout or print Result
@@ -184,49 +565,86 @@ class Result:
     E.g. line_two = Result.stdout_lines[2]
 
     You can also compare two results that will mean compare of result stdouts
+
+    Output of the command exactly as it was printed is available as Result.stdout_bytes and Result.stderr_bytes.
+    In raw mode, e.g. r`gzip -c file`, stdout is not decoded at all and Result.stdout and its lines are bytes
+
+    The output is kept as it was captured from the process and it is decoded and split into lines only when it is
+    accessed for the first time. Output bigger than config.OUTPUT_SPILL_THRESHOLD is kept in a mapped temporary file,
+    then stdout_lines and stderr_lines are sequences that read lines from the file when they are accessed, so
+    iteration, indexing and slicing of lines do not load the whole output. Result.stdout still returns the whole text
     """
-    def __init__(self):
-        self._stdout_lines = []
-        self._stderr_lines = []
+    __slots__ = ('returncode', '_stdout_data', '_stderr_data', '_stdout_encoding', '_stderr_encoding',
+                 '_stdout_lines', '_stderr_lines', '_stdout_text', '_stderr_text', '_pipestatus')
+
+    def __init__(self, stdout_data=b'', stderr_data=b'', stdout_encoding=None, stderr_encoding=None):
+        self._stdout_data = stdout_data
+        self._stderr_data = stderr_data
+        self._stdout_encoding = stdout_encoding
+        self._stderr_encoding = stderr_encoding
+        self._stdout_lines = None
+        self._stderr_lines = None
+        self._stdout_text = None
+        self._stderr_text = None
+        self._pipestatus = None
         self.returncode = None
 
     @property
     def stdout(self):
         """Stdout of Result as text
         """
-        return os.linesep.join(self._stdout_lines)
+        if self._stdout_text is None:
+            self._stdout_text = _join_lines(self._stdout_data, self._stdout_encoding, lambda: self.stdout_lines)
+        return self._stdout_text
 
     @property
     def stderr(self):
         """Stderr of Result as text
         """
-        return os.linesep.join(self._stderr_lines)
+        if self._stderr_text is None:
+            self._stderr_text = _join_lines(self._stderr_data, self._stderr_encoding, lambda: self.stderr_lines)
+        return self._stderr_text
+
+    @property
+    def pipestatus(self):
+        """Return codes of all the commands of the pipeline if stdin of the command was connected to stdout of another
+        command, see exe. Otherwise it contains only the return code of the command
+        """
+        return self._pipestatus if self._pipestatus is not None else [self.returncode]
+
+    @property
+    def stdout_bytes(self):
+        """Stdout of Result as bytes, a memoryview if the output was spilled to disk
+        """
+        return _get_bytes(self._stdout_data)
+
+    @property
+    def stderr_bytes(self):
+        """Stderr of Result as bytes, a memoryview if the output was spilled to disk
+        """
+        return _get_bytes(self._stderr_data)
 
     @property
     def stdout_lines(self):
         """List of all lines from stdout
         """
+        if self._stdout_lines is None:
+            self._stdout_lines = _split_lines(self._stdout_data, self._stdout_encoding)
         return self._stdout_lines
 
     @property
     def stderr_lines(self):
         """List of all lines from stderr
         """
+        if self._stderr_lines is None:
+            self._stderr_lines = _split_lines(self._stderr_data, self._stderr_encoding)
         return self._stderr_lines
 
-    def _add_stdout_line(self, line):
-        line = line.rstrip(os.linesep)
-        self._stdout_lines.append(line)
-
-    def _add_stderr_line(self, line):
-        line = line.rstrip(os.linesep)
-        self._stderr_lines.append(line)
-
     def __str__(self):
         return self.stdout
 
     def __iter__(self):
-        return iter(self._stdout_lines)
+        return iter(self.stdout_lines)
 
     def __eq__(self, other):
         return self.__str__() == other.__str__()
@@ -237,49 +655,1092 @@ class Result:
     __nonzero__ = __bool__
 
 
-def _create_result(cmd, params):
-    p = subprocess.Popen(cmd,
-                         shell=True,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         env=os.environ)
+class StreamingResult(object):
+    """Result of a shell command execution in streaming mode.
 
-    result = Result()
+    Iterate over it to get lines of stdout as soon as the command prints them: for line in s`zcat huge.gz`:
+    The lines are not stored, so the memory used does not depend on the size of the output. Only the end
+    of stderr is kept to be shown in NonZeroReturnCodeError.
 
-    for line in p.stdout.readlines():
-        if sys.version_info[0] == 3:
-            line = line.decode(sys.stdout.encoding)
+    The return code is checked when all the lines are read. If the iteration is stopped earlier,
+    e.g. with break, the command is terminated together with all the processes it started, as it runs in its own
+    process group. Processes that do not finish within a second after SIGTERM are killed. The command may also be
+    terminated explicitly with close()
 
-        result._add_stdout_line(line)
+    Instead of iteration the result may be passed as stdin to exe, then its output goes directly to the next command
+    """
+    def __init__(self, cmd, process, params, deadline, stdin=None):
+        self._cmd = cmd
+        self._process = process
+        self._params = params
+        self._deadline = deadline
+        self._stdin = stdin
+        self._iterated = False
+        self._piped = False
+        self._stdout = Stream(process.stdout, _get_output_encodings(params)[0],
+                              _is_param_set(params, _PARAM_PRINT_STDOUT) or config.PRINT_STDOUT_ALWAYS)
+        self._stderr_reader = _PipeReader(process.stderr, _STREAM_STDERR_LIMIT)
+        self._stderr_reader.start()
+        self.returncode = None
+        self.pipestatus = None
+
+    def __iter__(self):
+        if self._piped:
+            raise ShellpyError('Stdout of the command \'{0}\' is connected to another command'.format(self._cmd))
+        self._iterated = True
+
+        completed = False
+        try:
+            for line in self._stdout:
+                yield line
+
+            completed = True
+        finally:
+            self._finish(terminate=not completed)
+
+        if self._deadline.expired:
+            raise CommandTimeoutError(self._cmd, self._deadline.timeout, self._create_stderr_result())
+
+        if self.returncode != 0 and not _is_param_set(self._params, _PARAM_NO_THROW):
+            raise NonZeroReturnCodeError(self._cmd, self._create_stderr_result())
+
+    def close(self):
+        """Terminates the command and the processes it started if it is still running
+        """
+        self._finish(terminate=True)
+
+    def _finish(self, terminate):
+        if self.returncode is not None:
+            return
+
+        self._process.stdout.close()
+        if terminate:
+            # processes started by the command keep stderr open even if the command itself is finished, so they
+            # are terminated as well and the command is finished only when stderr is closed
+            _terminate_process_group(self._process, self._is_finished)
+
+        returncode = self._process.wait()
+        self._deadline.cancel()
+        self.pipestatus = _get_pipestatus(self._stdin, returncode, terminate)
+        self.returncode = _get_pipefail_returncode(self.pipestatus)
+        self._stderr_reader.join()
+
+        if _is_param_set(self._params, _PARAM_PRINT_STDERR) or config.PRINT_STDERR_ALWAYS:
+            _print_stderr_text(self._create_stderr_result().stderr)
+
+    def _is_finished(self):
+        return self._process.poll() is not None and not self._stderr_reader.is_alive()
+
+    def _create_stderr_result(self):
+        result = Result(b'', self._stderr_reader.data, *_get_output_encodings(self._params))
+        result.returncode = self.returncode
+        result._pipestatus = self.pipestatus
+        return result
+
+    def _pipe_stdout(self):
+        """Gives stdout of the command to be connected to stdin of another command, see _PipelineStdin
+
+        :return: the pipe of stdout
+        """
+        if self._iterated or self._piped:
+            raise ShellpyError('Stdout of the command \'{0}\' is already read'.format(self._cmd))
+
+        self._piped = True
+        return self._process.stdout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class Job(object):
+    """Handle of a shell command running in background, e.g. started with b`rsync -a src dst`
+
+    The command is started and the execution of the script continues without waiting for it. Stdout and stderr
+    of the command are read in background, so it never blocks on a full pipe. The command runs in its own process
+    group, so Job.kill() kills it together with all the processes it started. Commands that are still running
+    when python exits are killed as well.
+
+    Use Job.poll() to check whether the command is finished and Job.wait() to wait for it. Job.result() returns
+    the Result of the command or throws NonZeroReturnCodeError as usual. To wait for several jobs use
+    wait_all(jobs) or iterate over them in the order they finish with as_completed(jobs)
+    """
+    def __init__(self, cmd, process, params, deadline, stdin=None):
+        self.cmd = cmd
+        self._process = process
+        self._params = params
+        self._deadline = deadline
+        self._stdin = stdin
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._done_callbacks = []
+        self._result = None
+        self._error = None
+        self._finished = False
+
+        collector = threading.Thread(target=self._collect)
+        collector.daemon = True
+        collector.start()
+
+    def _collect(self):
+        try:
+            stdout_data, stderr_data = _drain(self._process, config.OUTPUT_SPILL_THRESHOLD)
+            self._process.wait()
+            self._deadline.cancel()
+            pipestatus = _get_pipestatus(self._stdin, self._process.returncode)
+
+            self._result = Result(stdout_data, stderr_data, *_get_output_encodings(self._params))
+            self._result.returncode = _get_pipefail_returncode(pipestatus)
+            self._result._pipestatus = pipestatus
+        except Exception as e:
+            self._error = e
+
+        with self._lock:
+            self._done.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+    def _add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._done_callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def poll(self):
+        """Checks whether the command is finished
+
+        :return: the return code of the command or None if it is still running
+        """
+        return self.returncode if self._done.is_set() else None
+
+    def wait(self, timeout=None):
+        """Waits for the command to finish
+
+        :param timeout: the maximum time to wait in seconds, if None it waits until the command is finished
+        :return: the return code of the command or None if it is still running after the timeout
+        """
+        self._wait(timeout)
+        return self.poll()
+
+    @property
+    def returncode(self):
+        """Return code of the command or None if it is still running
+        """
+        if not self._done.is_set():
+            return None
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result.returncode
+
+    def result(self):
+        """Waits for the command to finish and returns its Result
+
+        :return: the Result of the command
+        :raises NonZeroReturnCodeError: if the command did not return 0 and no throw parameter is not set
+        :raises CommandTimeoutError: if the command was killed because its timeout passed
+        """
+        self._wait()
+
+        if self._error is not None:
+            raise self._error
+
+        if not self._finished:
+            self._finished = True
+            try:
+                _finish_result(self.cmd, self._params, self._result, self._deadline)
+            except ShellpyError as e:
+                self._error = e
+                raise
+
+        return self._result
+
+    def _wait(self, timeout=None):
+        try:
+            self._done.wait(timeout)
+        except BaseException:
+            # e.g. KeyboardInterrupt, the command is not left running without anybody waiting for it
+            self.kill()
+            raise
+
+    def kill(self):
+        """Kills the command together with all the processes it started if it is still running
+        """
+        if not self._done.is_set():
+            _kill_process_group(self._process)
+
+
+def wait_all(jobs):
+    """Waits for all the jobs to finish
+
+    :param jobs: the jobs to wait for
+    :return: list of Results of the jobs in the same order as jobs
+    :raises NonZeroReturnCodeError: of the first failed job, it is thrown only after all the jobs are finished
+    """
+    jobs = list(jobs)
+    for job in jobs:
+        job.wait()
+
+    return [job.result() for job in jobs]
+
+
+def as_completed(jobs):
+    """Iterates over jobs in the order they finish, e.g.
+
+    for job in as_completed([b`make -C lib1`, b`make -C lib2`]):
+        print(job.result())
+
+    :param jobs: the jobs to wait for
+    :return: iterator over the jobs that yields every job as soon as it is finished
+    """
+    jobs = list(jobs)
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    finished = queue.Queue()
+
+    for job in jobs:
+        job._add_done_callback(finished.put)
+
+    for _ in jobs:
+        yield finished.get()
+
+
+def _get_encoding(stream):
+    """Returns the encoding of output of commands and text sent to them, see config.ENCODING
+
+    :param stream: stdout, stderr or stdin of python, its encoding is used unless the encoding is set in config
+    :return: the encoding
+    """
+    encoding = config.ENCODING or getattr(stream, 'encoding', None)
+    if not encoding:
+        import locale
+        encoding = locale.getpreferredencoding(False) or 'utf-8'
+
+    return encoding
+
+
+def _get_output_encodings(params):
+    """Returns encodings of stdout and stderr of the command
+
+    :param params: parameters of the command
+    :return: tuple of encodings of stdout and stderr, the encoding of stdout is None in raw mode
+    """
+    stdout_encoding = None if _is_param_set(params, _PARAM_RAW) else _get_encoding(sys.stdout)
+    return stdout_encoding, _get_encoding(sys.stderr)
+
+
+def _decode(data, encoding):
+    if encoding is not None and sys.version_info[0] == 3:
+        data = data.decode(encoding)
+
+    return data
+
+
+def _get_bytes(data):
+    """Returns captured output as bytes without copying it
+
+    :param data: the output as it was read from the pipe or mapped file if the output was spilled to disk
+    :return: the bytes or memoryview of the mapped file, in python 2 the mapped file is copied to bytes
+    """
+    if isinstance(data, bytes):
+        return data
+
+    return memoryview(data) if sys.version_info[0] == 3 else data[:]
+
+
+def _printable(text):
+    """Returns text that can be printed. Raw output is decoded replacing the bytes that cannot be decoded
+
+    :param text: the text or raw output
+    :return: the text
+    """
+    if isinstance(text, bytes) and sys.version_info[0] == 3:
+        return text.decode(_get_encoding(sys.stdout), 'replace')
+
+    return text
 
-    for line in p.stderr.readlines():
-        if sys.version_info[0] == 3:
-            line = line.decode(sys.stderr.encoding)
 
-        result._add_stderr_line(line)
+def _split_lines(data, encoding):
+    """Splits captured output of a process to lines without line separators
 
-    p.wait()
+    :param data: the output as it was read from the pipe or mapped file if the output was spilled to disk
+    :param encoding: encoding used to decode the output in python 3, if None the lines are bytes
+    :return: list of lines or _MappedLines for the mapped file
+    """
+    if not isinstance(data, bytes):
+        return _MappedLines(data, encoding)
+
+    text = _decode(data, encoding)
+    if not text:
+        return []
+
+    lines = text.split('\n' if encoding is not None else b'\n')
+    if not lines[-1]:
+        lines.pop()
+
+    if os.linesep != '\n' and encoding is not None:
+        lines = [line.rstrip(os.linesep) for line in lines]
+
+    return lines
+
+
+def _join_lines(data, encoding, get_lines):
+    """Returns captured output of a process as text where lines are joined with os.linesep. In case os.linesep
+    is the same as the separator of lines in the output the text is taken as it is without splitting it to lines
+
+    :param data: the output as it was read from the pipe or mapped file if the output was spilled to disk
+    :param encoding: encoding used to decode the output in python 3, if None the output is returned as it is
+    :param get_lines: function that returns lines of the output, used only if the lines need to be joined
+    :return: the text of the output
+    """
+    if encoding is None:
+        return data if isinstance(data, bytes) else data[:]
+
+    if os.linesep != '\n':
+        return os.linesep.join(get_lines())
+
+    text = _decode(data if isinstance(data, bytes) else data[:], encoding)
+    if text.endswith('\n'):
+        text = text[:-1]
+
+    return text
+
+
+def _read_pipe(file, limit=None, spill_threshold=None):
+    """Reads a pipe to the end in big chunks
+
+    :param file: the pipe to read, it is closed when the end is reached
+    :param limit: if set, only this amount of the last bytes read from the pipe is kept
+    :param spill_threshold: if set and more data is read, the data is written to a temporary file instead of memory
+    :return: all the data read from the pipe or the mapped temporary file if the data was spilled to it
+    """
+    fd = file.fileno()
+    chunks = []
+    size = 0
+    spill_file = None
+
+    while True:
+        chunk = os.read(fd, _PIPE_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        if spill_file is not None:
+            spill_file.write(chunk)
+            continue
+
+        chunks.append(chunk)
+        size += len(chunk)
+
+        if limit is not None:
+            while size - len(chunks[0]) >= limit:
+                size -= len(chunks.pop(0))
+        elif spill_threshold is not None and size > spill_threshold:
+            spill_file = _create_spill_file(chunks)
+            chunks = []
+
+    file.close()
+
+    if spill_file is not None:
+        return _map_spill_file(spill_file)
+
+    data = b''.join(chunks)
+    if limit is not None:
+        data = data[-limit:]
+
+    return data
+
+
+class _PipeReader(threading.Thread):
+    """Reads a pipe in background thread, so that several pipes of one process can be drained at the same time
+    """
+    def __init__(self, file, limit=None, spill_threshold=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.data = b''
+        self.error = None
+        self._file = file
+        self._limit = limit
+        self._spill_threshold = spill_threshold
+
+    def run(self):
+        try:
+            self.data = _read_pipe(self._file, self._limit, self._spill_threshold)
+        except Exception as e:
+            self.error = e
+
+
+def _create_spill_file(chunks):
+    """Creates a temporary file for output that is too big to be kept in memory. The file is unlinked at once on unix,
+    so it is removed when it is closed and unmapped, even if the process is killed
+
+    :param chunks: the output read so far, it is written to the file
+    :return: the file
+    """
+    import tempfile
+
+    spill_file = tempfile.TemporaryFile()
+    spill_file.writelines(chunks)
+    return spill_file
+
+
+def _map_spill_file(spill_file):
+    """Maps the temporary file with output to memory read only and closes it
+
+    :param spill_file: the file created by _create_spill_file
+    :return: the mmap object of the file
+    """
+    import mmap
+
+    spill_file.flush()
+    try:
+        return mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        spill_file.close()
+
+
+class _MappedLines(object):
+    """Lines of output spilled to a temporary file, see config.OUTPUT_SPILL_THRESHOLD. Lines are decoded only when they
+    are accessed. Iteration reads the file sequentially, while len, indexing and slicing build an index of offsets
+    of lines once, which takes 8 bytes per line. The output is split to lines as bytes, so the encoding must be
+    compatible with ascii, e.g. utf-8
+    """
+    __slots__ = ('_data', '_encoding', '_offsets')
+
+    def __init__(self, data, encoding):
+        self._data = data
+        self._encoding = encoding
+        self._offsets = None
+
+    def _get_offsets(self):
+        """Returns offsets of the starts of all lines followed by the offset of the end of the last line
+        """
+        if self._offsets is None:
+            import array
+
+            offsets = array.array(_OFFSET_TYPECODE, [0])
+            data = self._data
+            end = data.find(b'\n')
+            while end != -1:
+                offsets.append(end + 1)
+                end = data.find(b'\n', end + 1)
+
+            if offsets[-1] != len(data):
+                offsets.append(len(data) + 1)
+
+            self._offsets = offsets
+
+        return self._offsets
+
+    def _get_line(self, start, end):
+        line = _decode(self._data[start:end], self._encoding)
+        return line.rstrip(os.linesep) if os.linesep != '\n' and self._encoding is not None else line
+
+    def __len__(self):
+        return len(self._get_offsets()) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        offsets = self._get_offsets()
+        if index < 0:
+            index += len(offsets) - 1
+        if not 0 <= index < len(offsets) - 1:
+            raise IndexError('line index out of range')
+
+        return self._get_line(offsets[index], offsets[index + 1] - 1)
+
+    def __iter__(self):
+        data = self._data
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start)
+            if end == -1:
+                end = len(data)
+
+            yield self._get_line(start, end)
+            start = end + 1
+
+
+def _drain(process, spill_threshold=None):
+    """Reads stdout and stderr of the process concurrently. Reading of pipes one after another leads
+    to a deadlock when a process fills the buffer of the pipe that is not being read
+
+    :param process: the process with stdout and stderr pipes
+    :param spill_threshold: size of output above which it is written to a temporary file, see _read_pipe
+    :return: tuple of data read from stdout and stderr
+    """
+    stderr_reader = _PipeReader(process.stderr, spill_threshold=spill_threshold)
+    stderr_reader.start()
+
+    stdout_data = _read_pipe(process.stdout, spill_threshold=spill_threshold)
+
+    stderr_reader.join()
+    if stderr_reader.error is not None:
+        raise stderr_reader.error
+
+    return stdout_data, stderr_reader.data
+
+
+def _split_simple_command(cmd):
+    """Splits a command to arguments if it can be executed without shell, i.e. it does not use any shell syntax
+    and it is not a shell builtin
+
+    :param cmd: the command to split
+    :return: list of arguments of the command or None if the command needs shell
+    """
+    if sys.platform == 'win32' or _SHELL_SYNTAX_PATTERN.search(cmd):
+        return None
+
+    try:
+        import shlex
+        args = shlex.split(cmd)
+    except ValueError:
+        return None
+
+    if not args or args[0] in _SHELL_BUILTINS or args[0].find('=') != -1:
+        return None
+
+    return args
+
+
+def _get_deadline(timeout):
+    """
+    :param timeout: timeout in seconds or None
+    :return: the time when the timeout is over or None if there is no timeout
+    """
+    return None if timeout is None else time.time() + timeout
+
+
+def _get_remaining_time(deadline):
+    """
+    :param deadline: the time returned by _get_deadline
+    :return: seconds left until the deadline, 0 if it is over, None if there is no deadline
+    """
+    return None if deadline is None else max(0, deadline - time.time())
+
+
+class _Deadline(object):
+    """Kills the process group of a command when its timeout passes unless the deadline is cancelled before that.
+    The deadline without timeout never expires
+    """
+    def __init__(self, process, timeout):
+        self.timeout = timeout
+        self.expired = False
+        self._process = process
+        self._lock = threading.Lock()
+        self._timer = None
+
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            # the process may be waited for right before the deadline is cancelled, then it finished in time and
+            # its process group must not be killed as its id may be already reused
+            if self._timer is not None and self._process.returncode is None:
+                self.expired = True
+                _kill_process_group(self._process)
+
+    def cancel(self):
+        """Cancels the deadline, it must be called right after the process is waited for
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+def _kill_process_group(process):
+    """Kills the process together with all the processes it started if it is started in its own process group,
+    see _popen. Otherwise and on windows only the process itself is killed
+
+    :param process: the process to kill, either subprocess.Popen or asyncio subprocess
+    """
+    try:
+        if process in _process_group_leaders:
+            os.killpg(process.pid, signal.SIGKILL)
+        elif process.returncode is None:
+            process.kill()
+    except OSError:
+        # the process group has already finished
+        pass
+
+
+def _terminate_process_group(process, is_finished, grace_period=_TERMINATE_GRACE_PERIOD):
+    """Terminates the process together with all the processes it started, so that they can clean up. If they are
+    still running after the grace period, they are killed, see _kill_process_group
+
+    :param process: the process to terminate
+    :param is_finished: function that shows whether the process and the processes it started are finished
+    :param grace_period: seconds the processes have to finish
+    """
+    try:
+        if process in _process_group_leaders:
+            os.killpg(process.pid, signal.SIGTERM)
+        elif process.poll() is None:
+            process.terminate()
+    except OSError:
+        # the process group has already finished
+        return
+
+    deadline = time.time() + grace_period
+    while not is_finished():
+        if time.time() >= deadline:
+            _kill_process_group(process)
+            return
+        time.sleep(0.01)
+
+
+def _kill_process_groups():
+    """Kills the process groups of the commands that are still running, it is called when python exits
+    """
+    for process in list(_process_group_leaders):
+        if process.returncode is None:
+            _kill_process_group(process)
+
+
+def _get_process_kwargs(new_process_group, rlimits):
+    """Creates arguments of subprocess.Popen that prepare the child process before the command is executed in it
+
+    :param new_process_group: whether the command is started in its own process group, it is ignored on windows
+    :param rlimits: resource limits of the command, see config.COMMAND_RLIMITS
+    :return: dict of the arguments
+    """
+    kwargs = {}
+
+    new_process_group = new_process_group and sys.platform != 'win32'
+    if new_process_group and sys.version_info[0] == 3:
+        # unlike preexec_fn it is safe to use when other threads are running
+        kwargs['start_new_session'] = True
+        new_process_group = False
+
+    preexec_fn = _get_preexec_fn(new_process_group, rlimits)
+    if preexec_fn is not None:
+        kwargs['preexec_fn'] = preexec_fn
+
+    return kwargs
+
+
+def _register_process_group(process):
+    """Remembers the process started in its own process group, see _process_group_leaders
+
+    :param process: the process, either subprocess.Popen or asyncio subprocess
+    """
+    if not _process_group_leaders:
+        import atexit
+        atexit.register(_kill_process_groups)
+
+    _process_group_leaders.add(process)
 
+
+def _get_preexec_fn(new_process_group, rlimits):
+    """Creates the function that prepares the child process before the command is executed in it. It is needed for
+    resource limits and for the process group in python 2 that does not have start_new_session
+
+    :param new_process_group: whether the command is started in its own process group
+    :param rlimits: resource limits of the command, see config.COMMAND_RLIMITS
+    :return: the function or None if nothing has to be prepared
+    """
+    if not rlimits and not new_process_group:
+        return None
+
+    try:
+        import resource
+    except ImportError:
+        raise ShellpyError('Resource limits of commands are supported only on unix')
+
+    limits = []
+    for name, value in rlimits.items() if rlimits else ():
+        resource_id = getattr(resource, 'RLIMIT_' + name.upper(), None)
+        if resource_id is None:
+            raise ShellpyError('Unknown resource limit \'{0}\''.format(name))
+        limits.append((resource_id, value if isinstance(value, tuple) else (value, value)))
+
+    def preexec_fn():
+        if new_process_group:
+            os.setsid()
+
+        for resource_id, limit in limits:
+            resource.setrlimit(resource_id, limit)
+
+    return preexec_fn
+
+
+def _popen(cmd, params, timeout=None, rlimits=None, stdin_source=None, new_process_group=False, **kwargs):
+    """Starts the command. It is executed with shell unless the direct mode is set or the command is simple enough
+    to be executed without shell and config.DIRECT_EXECUTION is enabled
+
+    :param cmd: the command to start
+    :param params: parameters of the command
+    :param timeout: timeout of the command, if set the command is started in its own process group
+    :param rlimits: resource limits of the command, see config.COMMAND_RLIMITS
+    :param stdin_source: the source of stdin as returned by _get_stdin
+    :param new_process_group: whether the command is started in its own process group even without timeout, so
+        that all the processes started by it can be killed together
+    :param kwargs: arguments passed to subprocess.Popen
+    :return: the started process
+    """
+    new_process_group = (new_process_group or timeout is not None) and sys.platform != 'win32'
+    kwargs.update(_get_process_kwargs(new_process_group, rlimits))
+
+    if stdin_source is not None:
+        kwargs['stdin'] = stdin_source.get_popen_stdin()
+
+    process = None
+
+    if _is_param_set(params, _PARAM_DIRECT):
+        import shlex
+        process = subprocess.Popen(shlex.split(cmd), env=os.environ, **kwargs)
+
+    elif config.DIRECT_EXECUTION:
+        args = _split_simple_command(cmd)
+        if args is not None:
+            try:
+                process = subprocess.Popen(args, env=os.environ, **kwargs)
+            except OSError:
+                # e.g. the program is not found, so it is left to shell to report the error as it always does
+                pass
+
+    if process is None:
+        process = subprocess.Popen(cmd, shell=True, env=os.environ, **kwargs)
+
+    if new_process_group:
+        _register_process_group(process)
+
+    if stdin_source is not None:
+        stdin_source.start(process)
+
+    return process
+
+
+class _PipelineStdin(object):
+    """Stdin of a command connected to stdout of a command executed in streaming mode. The output goes from one
+    process to another through the pipe of the operating system and it is never read by python
+    """
+    def __init__(self, upstream):
+        self._upstream = upstream
+        self._pipe = upstream._pipe_stdout()
+        self.cmd = upstream._cmd
+
+    def get_popen_stdin(self):
+        return self._pipe
+
+    def start(self, process):
+        # the pipe is kept open only by the processes, so the previous command gets SIGPIPE if the next one exits
+        self._pipe.close()
+
+    def wait(self, terminate=False):
+        """Waits for the previous commands of the pipeline to finish
+
+        :param terminate: whether the previous commands are terminated if they are still running
+        :return: list of return codes of the previous commands
+        """
+        self._upstream._finish(terminate)
+        return self._upstream.pipestatus
+
+
+def _get_stdin(stdin):
+    """Creates the object that connects the source of stdin passed to exe to the process of the command. Such object
+    gives stdin argument of subprocess.Popen with get_popen_stdin(), is notified with start(process) when the process
+    is started and returns return codes of the previous commands of pipeline from wait(terminate)
+
+    :param stdin: the source of stdin, see exe
+    :return: the object or None if stdin is not connected
+    """
+    if stdin is None:
+        return None
+
+    if isinstance(stdin, StreamingResult):
+        return _PipelineStdin(stdin)
+
+    encoding = _get_encoding(sys.stdin)
+
+    if isinstance(stdin, Result):
+        return _WriterStdin([stdin.stdout_bytes])
+
+    if isinstance(stdin, (bytes, bytearray, memoryview)):
+        return _WriterStdin([stdin])
+
+    if isinstance(stdin, type(u'')):
+        return _WriterStdin([stdin.encode(encoding)])
+
+    if isinstance(stdin, int):
+        return _FileStdin(stdin)
+
+    if hasattr(stdin, 'fileno'):
+        try:
+            return _FileStdin(stdin.fileno())
+        except (AttributeError, ValueError, EnvironmentError):
+            # e.g. io.BytesIO does not have a descriptor, it is read by the thread below
+            pass
+
+    if hasattr(stdin, 'read'):
+        return _WriterStdin(_read_chunks(stdin, encoding))
+
+    if hasattr(stdin, '__iter__'):
+        return _WriterStdin(_encode_lines(stdin, encoding, b'\n'))
+
+    raise TypeError('Unsupported stdin of a command: {0}'.format(type(stdin).__name__))
+
+
+class _FileStdin(object):
+    """Stdin of a command read by the process directly from a file descriptor, python does not copy the data
+    """
+    def __init__(self, fd):
+        self._fd = fd
+
+    def get_popen_stdin(self):
+        return self._fd
+
+    def start(self, process):
+        pass
+
+    def wait(self, terminate=False):
+        return []
+
+
+class _WriterStdin(object):
+    """Stdin of a command written by a background thread, so that the output of the command is read at the same time
+    and neither python nor the command waits for the other one forever on a full pipe. Small chunks are joined to big
+    ones to make less system calls. If the command exits without reading all the data, the rest is dropped
+    """
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._thread = None
+        self._error = None
+
+    def get_popen_stdin(self):
+        return subprocess.PIPE
+
+    def start(self, process):
+        self._thread = threading.Thread(target=self._write, args=(process.stdin,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self, file):
+        fd = file.fileno()
+        try:
+            for batch in _join_to_batches(self._chunks):
+                view = memoryview(batch)
+                while len(view) > 0:
+                    view = view[os.write(fd, view):]
+        except EnvironmentError as e:
+            # the command is finished or closed its stdin, windows reports it as EINVAL
+            if e.errno not in (errno.EPIPE, errno.EINVAL):
+                self._error = e
+        except Exception as e:
+            self._error = e
+        finally:
+            try:
+                file.close()
+            except EnvironmentError:
+                pass
+
+    def wait(self, terminate=False):
+        """Waits until all the data is written
+
+        :param terminate: part of interface of stdin sources, the thread finishes when the process is terminated
+        :return: empty list as there are no previous commands of pipeline
+        :raises Exception: the error of iteration over the source of the data
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+        return []
+
+
+def _encode_lines(lines, encoding, linesep):
+    """Encodes lines and adds line separators to them
+
+    :param lines: iterable of lines as text or bytes without line separators
+    :param encoding: encoding of the text
+    :param linesep: line separator as bytes
+    :return: iterator of chunks of bytes
+    """
+    for line in lines:
+        yield line if isinstance(line, bytes) else line.encode(encoding)
+        yield linesep
+
+
+def _read_chunks(file, encoding):
+    """Reads a file-like object in big chunks
+
+    :param file: the file opened in binary or text mode
+    :param encoding: encoding of the text
+    :return: iterator of chunks of bytes
+    """
+    while True:
+        chunk = file.read(_PIPE_CHUNK_SIZE)
+        if not chunk:
+            return
+
+        yield chunk if isinstance(chunk, bytes) else chunk.encode(encoding)
+
+
+def _join_to_batches(chunks):
+    """Joins small chunks to batches of about _PIPE_CHUNK_SIZE bytes, big chunks are left as they are
+
+    :param chunks: iterable of chunks of bytes
+    :return: iterator of batches
+    """
+    batch = []
+    size = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        size += len(chunk)
+
+        if size >= _PIPE_CHUNK_SIZE:
+            yield batch[0] if len(batch) == 1 else b''.join(batch)
+            batch = []
+            size = 0
+
+    if batch:
+        yield batch[0] if len(batch) == 1 else b''.join(batch)
+
+
+def _get_pipeline_cmd(cmd, stdin):
+    """Returns the description of the pipeline for messages, e.g. 'zcat huge.gz | sort -u'
+    """
+    if isinstance(stdin, _PipelineStdin):
+        return stdin.cmd + ' | ' + cmd
+
+    return cmd
+
+
+def _get_pipestatus(stdin, returncode, terminate=False):
+    """Waits for the previous commands of the pipeline and returns their return codes
+
+    :param stdin: the source of stdin of the command
+    :param returncode: return code of the command
+    :param terminate: whether the previous commands are terminated if they are still running
+    :return: list of return codes of all the commands of the pipeline, the last one is of the command itself
+    """
+    if stdin is None:
+        return [returncode]
+
+    return stdin.wait(terminate) + [returncode]
+
+
+def _get_pipefail_returncode(pipestatus):
+    """Returns the return code of the pipeline the same way as bash does with pipefail option
+
+    :param pipestatus: return codes of all the commands of the pipeline
+    :return: the return code of the last failed command or 0 if all of them succeeded
+    """
+    for returncode in reversed(pipestatus):
+        if returncode != 0:
+            return returncode
+
+    return 0
+
+
+def _is_session_execution(params, timeout, rlimits):
+    """Shows whether the command may be executed in the bash session of the current thread
+
+    :param params: parameters of the command
+    :param timeout: timeout of the command
+    :param rlimits: resource limits of the command
+    :return: True if config.SESSION_EXECUTION is enabled and nothing requires a separate process for the command
+    """
+    return (config.SESSION_EXECUTION and timeout is None and not rlimits and sys.platform != 'win32' and
+            not _is_param_set(params, _PARAM_DIRECT))
+
+
+def _create_result(cmd, params, timeout=None, rlimits=None, stdin=None):
+    if stdin is None and _is_session_execution(params, timeout, rlimits):
+        from shellpython import session
+        stdout_data, stderr_data, returncode = session.get_session().execute(cmd)
+
+        result = Result(stdout_data, stderr_data, *_get_output_encodings(params))
+        result.returncode = returncode
+
+        return _finish_result(cmd, params, result)
+
+    p = _popen(cmd, params, timeout, rlimits, stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    deadline = _Deadline(p, timeout)
+
+    try:
+        stdout_data, stderr_data = _drain(p, config.OUTPUT_SPILL_THRESHOLD)
+        p.wait()
+    except BaseException:
+        # e.g. KeyboardInterrupt that does not reach the command started in its own process group
+        _kill_process_group(p)
+        raise
+    finally:
+        deadline.cancel()
+
+    pipestatus = _get_pipestatus(stdin, p.returncode)
+
+    result = Result(stdout_data, stderr_data, *_get_output_encodings(params))
+    result.returncode = _get_pipefail_returncode(pipestatus)
+    result._pipestatus = pipestatus
+
+    return _finish_result(_get_pipeline_cmd(cmd, stdin), params, result, deadline)
+
+
+def _finish_result(cmd, params, result, deadline=None):
+    """Prints output of the finished command if it is required and checks its return code
+
+    :param cmd: the command that was executed
+    :param params: parameters of the command
+    :param result: Result of the command
+    :param deadline: deadline of the command, if it is expired CommandTimeoutError is thrown
+    :return: the result if it does not have to be thrown with NonZeroReturnCodeError or CommandTimeoutError
+    """
     if (_is_param_set(params, _PARAM_PRINT_STDOUT) or config.PRINT_STDOUT_ALWAYS) and len(result.stdout) > 0:
-        _print_stdout(result.stdout)
+        _print_stdout(_printable(result.stdout))
 
-    if (_is_param_set(params, _PARAM_PRINT_STDERR) or config.PRINT_STDERR_ALWAYS) and len(result.stderr) > 0:
-        if _is_colorama_enabled():
-            _print_stderr(Fore.RED + result.stderr + Style.RESET_ALL)
-        else:
-            _print_stderr(result.stderr)
+    if _is_param_set(params, _PARAM_PRINT_STDERR) or config.PRINT_STDERR_ALWAYS:
+        _print_stderr_text(result.stderr)
 
-    result.returncode = p.returncode
+    if deadline is not None and deadline.expired:
+        raise CommandTimeoutError(cmd, deadline.timeout, result)
 
-    if p.returncode != 0 and not _is_param_set(params, _PARAM_NO_THROW):
+    if result.returncode != 0 and not _is_param_set(params, _PARAM_NO_THROW):
         raise NonZeroReturnCodeError(cmd, result)
 
     return result
 
 
-def _create_interactive_result(cmd, params):
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+def _print_stderr_text(text):
+    if len(text) > 0:
+        if _is_colorama_enabled():
+            _print_stderr(_colorama.Fore.RED + text + _colorama.Style.RESET_ALL)
+        else:
+            _print_stderr(text)
+
+
+def _create_interactive_result(cmd, params, timeout=None, rlimits=None):
+    p = _popen(cmd, params, timeout, rlimits, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
 
-    result = InteractiveResult(p, params)
+    result = InteractiveResult(p, params, _Deadline(p, timeout))
 
     return result
+
+
+def _create_streaming_result(cmd, params, timeout=None, rlimits=None, stdin=None):
+    p = _popen(cmd, params, timeout, rlimits, stdin, new_process_group=True, stdout=subprocess.PIPE,
+               stderr=subprocess.PIPE)
+
+    return StreamingResult(_get_pipeline_cmd(cmd, stdin), p, params, _Deadline(p, timeout), stdin)
+
+
+def _create_job(cmd, params, timeout=None, rlimits=None, stdin=None):
+    p = _popen(cmd, params, timeout, rlimits, stdin, new_process_group=True, stdout=subprocess.PIPE,
+               stderr=subprocess.PIPE)
+
+    return Job(_get_pipeline_cmd(cmd, stdin), p, params, _Deadline(p, timeout), stdin)
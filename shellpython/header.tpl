@@ -1,4 +1,3 @@
 #shellpy-encoding
-#shellpy-meta:{meta}
-from shellpython.core import exe, NonZeroReturnCodeError
+from shellpython.core import exe, aexe, NonZeroReturnCodeError
 
@@ -1,12 +1,11 @@
 #shellpy-python-executable
 #shellpy-encoding
-#shellpy-meta:{meta}
 
 import os
 import shellpython
 import shellpython.config
 from shellpython.constants import *
-from shellpython.core import exe, NonZeroReturnCodeError, _print_stderr as shellpy_print_stderr
+from shellpython.core import exe, aexe, NonZeroReturnCodeError, _print_stderr as shellpy_print_stderr
 
 if __name__ == '__main__':
     shellpython.init()
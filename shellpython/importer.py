@@ -1,86 +1,161 @@
 import os
 import sys
-from importlib import import_module
 from shellpython import locator
-from shellpython import preprocessor
+
+try:
+    from importlib.machinery import ModuleSpec, SourceFileLoader
+except ImportError:
+    # python 2 supports only the legacy interface of PEP-0302
+    import imp
+    ModuleSpec = None
+    SourceFileLoader = None
 
 
 class PreprocessorImporter(object):
     """
     Every import of shellpy code requires first preprocessing of shellpy script into a usual python script
     and then import of it. To make it we need a hook for every import with standard python hooks.
-    See PEP-0302 https://www.python.org/dev/peps/pep-0302/ for more details
-
-    When an import occurs the find module function will be called first. It tries to find a shell python module or
-    file using the Locator class. If the search is successful and there is actually shellpy module or file with
-    the name specified, the find_module function will return self as Loader. If nothing is found, None will be
-    returned and the import mechanism of python will not be affected in any other way.
-    So if something was found then loader will preprocess file or module and import it with standard python
-    import
+    See PEP-0451 https://www.python.org/dev/peps/pep-0451/ for more details
+
+    When an import occurs the find_spec function is called first. It tries to find a shellpy module or file using
+    the locator. If there is actually shellpy module or file with the name specified, a module spec with ShellpyLoader
+    is returned. If nothing is found, None is returned and the import mechanism of python is not affected in any
+    other way. The loader then preprocesses the file and executes the code in the new module.
+
+    Neither sys.path nor sys.meta_path is changed during imports, so imports from several threads are safe. Python 2
+    does not support find_spec, so the legacy find_module and load_module of PEP-0302 are implemented as well
     """
 
-    def find_module(self, module_name, package_path):
-        """This function is part of interface defined in import hooks PEP-0302
-        Given the name of the module its goal is to locate it. If shellpy module with the name was found,
-        self is returned as Loader for this module. Otherwise None is returned and standard python import
-        works as expected
+    def find_spec(self, module_name, package_path, target=None):
+        """This function is part of interface defined in import hooks PEP-0451
+        Given the name of the module its goal is to locate it.
 
-        :param module_name: the module to locate
-        :param package_path: part of interface, not used, see PEP-0302
-        :return: self if shellpy module was found, None if not
+        :param module_name: the full dotted name of the module to locate
+        :param package_path: __path__ of the parent package for submodules, None for top level modules
+        :param target: part of interface, not used, see PEP-0451
+        :return: module spec if shellpy module was found, None if not
         """
-        if module_name.find('.') == -1:
-            root_module_name = module_name
-        else:
-            root_module_name = module_name.split('.')[0]
+        loader = self._find_loader(module_name, package_path)
+        if loader is None:
+            return None
+
+        spec = ModuleSpec(module_name, loader, origin=loader.path, is_package=loader.is_package(module_name))
+        if spec.submodule_search_locations is not None:
+            spec.submodule_search_locations.append(os.path.dirname(loader.path))
+        spec.has_location = True
+
+        return spec
 
-        spy_module_path = locator.locate_spy_module(root_module_name)
-        spy_file_path = locator.locate_spy_file(root_module_name)
+    def find_module(self, module_name, package_path=None):
+        """This function is part of legacy interface defined in import hooks PEP-0302, it is used only in python 2
+
+        :param module_name: the full dotted name of the module to locate
+        :param package_path: __path__ of the parent package for submodules, None for top level modules
+        :return: loader if shellpy module was found, None if not
+        """
+        return self._find_loader(module_name, package_path)
+
+    def invalidate_caches(self):
+        """This function is part of interface defined in import hooks PEP-0451. It is called by
+        importlib.invalidate_caches and clears the caches of the locator
+        """
+        locator.invalidate_caches()
+
+    def _find_loader(self, module_name, package_path):
+        if package_path is None:
+            spy_file_path = locator.locate_spy(module_name)
+            if spy_file_path is not None:
+                return ShellpyLoader(module_name, spy_file_path)
 
-        if spy_module_path is not None or spy_file_path is not None:
-            return self
         else:
-            return None
+            submodule_name = module_name.rpartition('.')[2]
+            for path in package_path:
+                spy_file_path = locator.locate_spy_submodule(path, submodule_name)
+                if spy_file_path is not None:
+                    return ShellpyLoader(module_name, spy_file_path)
 
-    def load_module(self, module_name):
-        """If the module was located it then is loaded by this function. It is also a part of PEP-0302 interface
-        Loading means first preprocessing of shell python code if it is not processed already and the addition
-        to system path and import.
+        return None
+
+
+class ShellpyLoader(object):
+    """Loader of a single shellpy file. The file is preprocessed with the cache of processed files on the temp
+    filesystem and then compiled with bytecode cache of python. If the cache cannot be written, the code is
+    preprocessed and compiled in memory
+    """
 
-        :param module_name: the name of the module to load
-        :return: the module imported. This function assumes that it will import a module anyway since find_module
-        already found the module
+    def __init__(self, module_name, path):
         """
-        sys.meta_path.remove(self)
+        :param module_name: the full dotted name of the module
+        :param path: the path of shellpy file of the module, __init__.spy for packages
+        """
+        self.name = module_name
+        self.path = path
 
-        if module_name.find('.') == -1:
-            spy_module_path = locator.locate_spy_module(module_name)
-            spy_file_path = locator.locate_spy_file(module_name)
+    def is_package(self, module_name):
+        return os.path.basename(self.path) == '__init__.spy'
 
-            if spy_module_path is not None:
-                new_module_path = preprocessor.preprocess_module(spy_module_path)
-                new_module_pythonpath = os.path.split(new_module_path)[0]
+    def get_filename(self, module_name):
+        return self.path
 
-                if new_module_pythonpath not in sys.path:
-                    sys.path.append(new_module_pythonpath)
+    def get_code(self, module_name):
+        """Returns the code object of the module
 
-                module = import_module(module_name)
+        :param module_name: the full dotted name of the module
+        :return: the code object
+        """
+        # the preprocessor is imported only when shellpy code is imported, to keep import of shellpython fast
+        from shellpython import preprocessor
 
-            elif spy_file_path is not None:
-                new_module_path = preprocessor.preprocess_file(spy_file_path, is_root_script=False)
-                new_module_pythonpath = os.path.split(new_module_path)[0]
+        try:
+            processed_path = preprocessor.preprocess_file(self.path, is_root_script=False)
+        except (IOError, OSError):
+            code = preprocessor.preprocess_source(self.path, is_root_script=False)
+            return compile(code, self.path, 'exec', dont_inherit=True)
 
-                if new_module_pythonpath not in sys.path:
-                    sys.path.append(new_module_pythonpath)
+        if SourceFileLoader is not None:
+            return SourceFileLoader(module_name, processed_path).get_code(module_name)
 
-                module = import_module(module_name)
+        with open(processed_path, 'r') as f:
+            return compile(f.read(), processed_path, 'exec', dont_inherit=True)
 
-            else:
-                raise ImportError("Unexpected error occured in importer. Neither shellpy module not file was found")
+    def create_module(self, spec):
+        """This function is part of interface defined in import hooks PEP-0451. None means the default module creation
+        """
+        return None
 
+    def exec_module(self, module):
+        """This function is part of interface defined in import hooks PEP-0451. It executes the code of the module
+        in its namespace
+
+        :param module: the module created by the import system
+        """
+        code = self.get_code(module.__name__)
+        exec(code, module.__dict__)
+
+    def load_module(self, module_name):
+        """This function is part of legacy interface defined in import hooks PEP-0302, it is used only in python 2
+
+        :param module_name: the full dotted name of the module
+        :return: the loaded module
+        """
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+
+        module = imp.new_module(module_name)
+        module.__file__ = self.path
+        module.__loader__ = self
+        if self.is_package(module_name):
+            module.__path__ = [os.path.dirname(self.path)]
+            module.__package__ = module_name
         else:
-            module = import_module(module_name)
+            module.__package__ = module_name.rpartition('.')[0]
 
-        sys.meta_path.insert(0, self)
+        sys.modules[module_name] = module
+        try:
+            code = self.get_code(module_name)
+            exec(code, module.__dict__)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
 
-        return module
+        return sys.modules[module_name]
@@ -1,6 +1,50 @@
 import sys
 import os.path
 
+# listings of directories in the form {path: (modification time, set of entries)}, see _get_directory_entries
+_directory_entries = {}
+
+# keys of lookups that found nothing and the sys.path they were made with, see _is_not_found
+_not_found = set()
+_not_found_sys_path = []
+
+
+def invalidate_caches():
+    """Clears all the caches of the locator. Lookups that found nothing are cached until sys.path changes or this
+    function is called, so it must be called if shellpy files are created while the program is running. It is called
+    by importlib.invalidate_caches through the import hook
+    """
+    _directory_entries.clear()
+    _not_found.clear()
+
+
+def locate_spy(name):
+    """Tries to find either shellpy module or shellpy file on filesystem in one pass over pythonpath, so that every
+    directory of it is checked only once. A module is preferred to a file in the same directory, the same way as
+    python prefers packages to modules
+
+    :param name: Name of module or filename without extension
+    :return: Path to __init__.spy of the module or to shellpy file, None if not found
+    """
+    key = ('any', name)
+    if _is_not_found(key):
+        return None
+
+    file_name = name + '.spy'
+    for python_path in sys.path:
+        entries = _get_directory_entries(python_path)
+
+        if name in entries:
+            possible_module_path = os.path.join(python_path, name)
+            if '__init__.spy' in _get_directory_entries(possible_module_path):
+                return os.path.join(possible_module_path, '__init__.spy')
+
+        if file_name in entries:
+            return os.path.join(python_path, file_name)
+
+    _not_found.add(key)
+    return None
+
 
 def locate_spy_module(module_name):
     """Tries to find shellpy module on filesystem. Given a module name it tries to locate it in pythonpath. It looks
@@ -9,13 +53,18 @@ def locate_spy_module(module_name):
     :param module_name: Filename without extension
     :return: Path to shellpy file or None if not found
     """
+    key = ('module', module_name)
+    if _is_not_found(key):
+        return None
+
     for python_path in sys.path:
 
-        possible_module_path = os.path.join(python_path, module_name)
-        if os.path.exists(possible_module_path):
-            if os.path.exists(os.path.join(possible_module_path, '__init__.spy')):
+        if module_name in _get_directory_entries(python_path):
+            possible_module_path = os.path.join(python_path, module_name)
+            if '__init__.spy' in _get_directory_entries(possible_module_path):
                 return possible_module_path
 
+    _not_found.add(key)
     return None
 
 
@@ -26,10 +75,95 @@ def locate_spy_file(file_name):
     :param file_name: Filename without extension
     :return: Path to shellpy file or None if not found
     """
+    key = ('file', file_name)
+    if _is_not_found(key):
+        return None
+
     for python_path in sys.path:
 
-        possible_file_path = os.path.join(python_path, file_name + '.spy')
-        if os.path.exists(possible_file_path):
-            return possible_file_path
+        if file_name + '.spy' in _get_directory_entries(python_path):
+            return os.path.join(python_path, file_name + '.spy')
 
+    _not_found.add(key)
     return None
+
+
+def locate_spy_submodule(module_path, submodule_name):
+    """Tries to find shellpy file of a submodule inside of shellpy module. The submodule may be either a shellpy file
+    or a shellpy module with __init__.spy inside of it
+
+    :param module_path: Path to shellpy module as returned by locate_spy_module
+    :param submodule_name: Dotted name of the submodule relative to the module, e.g. 'package.file'
+    :return: Path to shellpy file or None if not found
+    """
+    key = ('submodule', module_path, submodule_name)
+    if _is_not_found(key):
+        return None
+
+    parent_names = submodule_name.split('.')
+    name = parent_names.pop()
+
+    parent_path = module_path
+    for parent_name in parent_names:
+        if parent_name not in _get_directory_entries(parent_path):
+            _not_found.add(key)
+            return None
+        parent_path = os.path.join(parent_path, parent_name)
+
+    entries = _get_directory_entries(parent_path)
+
+    if name + '.spy' in entries:
+        return os.path.join(parent_path, name + '.spy')
+
+    if name in entries:
+        possible_module_path = os.path.join(parent_path, name)
+        if '__init__.spy' in _get_directory_entries(possible_module_path):
+            return os.path.join(possible_module_path, '__init__.spy')
+
+    _not_found.add(key)
+    return None
+
+
+def _is_not_found(key):
+    """Shows whether the lookup was already made and found nothing. All such lookups are forgotten when
+    sys.path changes
+
+    :param key: the key of the lookup
+    :return: True if the lookup found nothing before
+    """
+    global _not_found_sys_path
+
+    if sys.path != _not_found_sys_path:
+        _not_found.clear()
+        _not_found_sys_path = list(sys.path)
+        return False
+
+    return key in _not_found
+
+
+def _get_directory_entries(path):
+    """Returns names of files and directories in the directory. The listing is cached and made again only when
+    modification time of the directory changes, the same way as FileFinder of importlib does it
+
+    :param path: the path of directory, empty string means current directory as in sys.path
+    :return: set of names, empty if the directory does not exist
+    """
+    if not path:
+        path = os.getcwd()
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except (OSError, TypeError, ValueError):
+        return frozenset()
+
+    cached = _directory_entries.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        entries = frozenset(os.listdir(path))
+    except OSError:
+        entries = frozenset()
+
+    _directory_entries[path] = (mtime, entries)
+    return entries
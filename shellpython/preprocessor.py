@@ -1,29 +1,69 @@
 #!/usr/bin/env python
 import os
+import sys
 import stat
-import tempfile
+import string
+import keyword
 import re
-import getpass
-import json
+import time
+import threading
+from shellpython.constants import SHELLPY_VERSION, SHELLPY_CACHE_DIR
+
+try:
+    from importlib.machinery import SourceFileLoader
+    from importlib.util import cache_from_source
+except ImportError:
+    # python 2 writes bytecode next to the source file
+    SourceFileLoader = None
+
+    def cache_from_source(path):
+        return path + 'c'
 
 spy_file_pattern = re.compile(r'(.*)\.spy$')
-shellpy_meta_pattern = re.compile(r'#shellpy-meta:(.*)')
 shellpy_encoding_pattern = '#shellpy-encoding'
 
+# the key of the header of processed modules, see _get_header_key
+_MODULE_HEADER_KEY = 'module'
+
+# modification time of a file is trusted only if the file was modified before the entry of the cache manifest
+# was recorded at least by this value. Some filesystems store the time with resolution of up to two seconds
+_MTIME_RESOLUTION_NS = 2 * 1000000000
+
+# the manifest of the cache of processed files loaded by this process, see _load_manifest
+_manifest = None
+_manifest_path = None
+_changed_manifest_entries = set()
+
+# processed files and the manifest may be changed by imports from several threads
+_cache_lock = threading.RLock()
+
+# the parameter of asynchronous execution, the same as core._PARAM_ASYNC
+_PARAM_ASYNC = 'a'
+
+code_special_symbol_pattern = re.compile(r'[#\'"`]')
+string_end_patterns = {
+    '\'': re.compile(r"\\.|'|\n", re.DOTALL),
+    '"': re.compile(r'\\.|"|\n', re.DOTALL)
+}
+triple_quoted_string_end_patterns = {
+    '\'': re.compile(r"\\.|'''", re.DOTALL),
+    '"': re.compile(r'\\.|"""', re.DOTALL)
+}
+multiline_closing_pattern = re.compile(r'`[^\S\n]*$', re.MULTILINE)
+multiline_line_break_pattern = re.compile(r'([^\n]*?)(\r?\n)')
+identifier_pattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+format_field_root_pattern = re.compile(r'[^.\[]*')
+_formatter = string.Formatter()
+
 
 def preprocess_module(module_path):
-    """The function compiles a module in shellpy to a python module, walking through all the shellpy files inside of
-    the module and compiling all of them to python
+    """The function compiles a module in shellpy to a python module. Only __init__.spy of the module is compiled here,
+    its submodules are compiled one by one when they are imported, see importer
 
     :param module_path: The path of module
     :return: The path of processed module
     """
-    for item in os.walk(module_path):
-        path, dirs, files = item
-        for file in files:
-            if spy_file_pattern.match(file):
-                filepath = os.path.join(path, file)
-                preprocess_file(filepath, is_root_script=False)
+    preprocess_file(os.path.join(module_path, '__init__.spy'), is_root_script=False)
 
     return _translate_to_temp_path(module_path)
 
@@ -37,30 +77,44 @@ def preprocess_file(in_filepath, is_root_script, python_version=None):
     :param python_version: version of python, needed to set correct header for root scripts
     :return: The path of python file that was created of shellpy script
     """
-
-    new_filepath = spy_file_pattern.sub(r"\1.py", in_filepath)
-    out_filename = _translate_to_temp_path(new_filepath)
-    out_folder_path = os.path.dirname(out_filename)
-
-    if not is_root_script and not _is_compilation_needed(in_filepath, out_filename):
-        # TODO: cache root also
-        # TODO: if you don't compile but it's root, you need to change to exec
+    with _cache_lock:
+        out_filename = _preprocess_file(in_filepath, is_root_script, python_version)
+        _save_manifest()
         return out_filename
 
-    if not os.path.exists(out_folder_path):
-        os.makedirs(out_folder_path, mode=0o700)
 
-    header_data = _get_header(in_filepath, is_root_script, python_version)
+def preprocess_source(in_filepath, is_root_script, python_version=None):
+    """Coverts a single shellpy file to python code without writing it anywhere
+
+    :param in_filepath: The path of shellpy file to be processed
+    :param is_root_script: Shows whether the file being processed is a root file, which means the one
+            that user executed
+    :param python_version: version of python, needed to set correct header for root scripts
+    :return: The python code
+    """
+    header_data = _get_header(is_root_script, python_version)
 
     with open(in_filepath, 'r') as f:
         code = f.read()
 
-        out_file_data = _add_encoding_to_header(header_data, code)
+    return _add_encoding_to_header(header_data, code) + _preprocess_code(code)
+
 
-        intermediate = _preprocess_code_to_intermediate(code)
-        processed_code = _intermediate_to_final(intermediate)
+def _preprocess_file(in_filepath, is_root_script, python_version):
+    """Coverts a single shellpy file to python if it is not in the cache already. The manifest is updated only
+    in memory and must be saved after with _save_manifest
+    """
+    new_filepath = spy_file_pattern.sub(r"\1.py", in_filepath)
+    out_filename = _translate_to_temp_path(new_filepath)
+    out_folder_path = os.path.dirname(out_filename)
+
+    header_key = _get_header_key(is_root_script, python_version)
+    if not _is_compilation_needed(in_filepath, out_filename, header_key):
+        return out_filename
+
+    _make_private_dirs(out_folder_path)
 
-        out_file_data += processed_code
+    out_file_data = preprocess_source(in_filepath, is_root_script, python_version)
 
     with open(out_filename, 'w') as f:
         f.write(out_file_data)
@@ -71,15 +125,86 @@ def preprocess_file(in_filepath, is_root_script, python_version=None):
     if is_root_script:
         os.chmod(out_filename, in_file_stat.st_mode | stat.S_IEXEC)
 
+    compile_bytecode(out_filename, is_source_changed=True)
+
+    _update_manifest_entry(in_filepath, header_key, in_file_stat, _hash_file(in_filepath))
+
     return out_filename
 
 
+def compile_bytecode(filepath, is_source_changed=False):
+    """Compiles processed python file to bytecode in the cache format of importlib, so that neither import of
+    the file nor its execution as a root script need to compile it again. The bytecode is written only if it is
+    missing or stale
+
+    :param filepath: The path of processed python file
+    :param is_source_changed: Shows whether the processed file was just written. Then the bytecode is always written
+            again, as bytecode validated by modification time and size of the source would still look valid if
+            the source is changed within the same second and keeps its size
+    :return: The path of bytecode file or None if the bytecode could not be written
+    """
+    bytecode_path = cache_from_source(filepath)
+
+    try:
+        if is_source_changed:
+            return _rewrite_bytecode(filepath, bytecode_path)
+        elif SourceFileLoader is not None:
+            # the loader validates existing bytecode against the source and writes it again if needed
+            loader = SourceFileLoader(os.path.splitext(os.path.basename(filepath))[0], filepath)
+            loader.get_code(loader.name)
+        elif not sys.dont_write_bytecode and _is_bytecode_stale(filepath, bytecode_path):
+            import py_compile
+            try:
+                py_compile.compile(filepath, cfile=bytecode_path, doraise=True)
+            except py_compile.PyCompileError:
+                return None
+    except (SyntaxError, IOError, OSError):
+        return None
+
+    return bytecode_path if os.path.exists(bytecode_path) else None
+
+
+def _rewrite_bytecode(filepath, bytecode_path):
+    """Replaces the bytecode of the processed file. The bytecode is validated by the hash of the source where
+    python supports it, so it is never taken for bytecode of another version of the source
+
+    :return: The path of bytecode file or None if the bytecode could not be written
+    """
+    # bytecode of the previous version of the source must not be left if the new one cannot be written
+    if os.path.exists(bytecode_path):
+        os.remove(bytecode_path)
+
+    if sys.dont_write_bytecode:
+        return None
+
+    import py_compile
+    kwargs = {}
+    if hasattr(py_compile, 'PycInvalidationMode'):
+        kwargs['invalidation_mode'] = py_compile.PycInvalidationMode.CHECKED_HASH
+
+    try:
+        py_compile.compile(filepath, cfile=bytecode_path, doraise=True, **kwargs)
+    except py_compile.PyCompileError:
+        return None
+
+    return bytecode_path
+
+
+def _is_bytecode_stale(filepath, bytecode_path):
+    if not os.path.exists(bytecode_path):
+        return True
+
+    return os.path.getmtime(bytecode_path) < os.path.getmtime(filepath)
+
+
 def _get_username():
     """Returns the name of current user. The function is used in construction of the path for processed shellpy files on
     temp file system
 
     :return: The name of current user
     """
+    import getpass
+
     try:
         n = getpass.getuser()
         return n
@@ -87,6 +212,42 @@ def _get_username():
         return 'no_username_found'
 
 
+def _get_cache_root():
+    """Returns the directory where all the processed shellpy files of current user are stored. It may be set with
+    SHELLPY_CACHE_DIR environment variable, e.g. to use a cache prepared with shellpy compile
+
+    :return: The path of the directory
+    """
+    cache_dir = os.environ.get(SHELLPY_CACHE_DIR)
+    if cache_dir:
+        return os.path.abspath(cache_dir)
+
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), 'shellpy_' + _get_username())
+
+
+def _make_private_dirs(path):
+    """Creates the directory in the cache together with all the missing parent directories, every created directory
+    is accessible only by the user. Unlike this function, os.makedirs of python 3.7 and above applies the mode
+    only to the last directory
+
+    :param path: The path of the directory
+    """
+    if os.path.isdir(path):
+        return
+
+    parent_path = os.path.dirname(path)
+    if parent_path != path:
+        _make_private_dirs(parent_path)
+
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        # the directory may be created by another process meanwhile
+        if not os.path.isdir(path):
+            raise
+
+
 def _translate_to_temp_path(path):
     """Compiled shellpy files are stored on temp filesystem on path like this /{tmp}/{user}/{real_path_of_file_on_fs}
     Every user will have its own copy of compiled shellpy files. Since we store them somewhere else relative to
@@ -100,41 +261,182 @@ def _translate_to_temp_path(path):
     relative_path = os.path.relpath(absolute_path, os.path.abspath(os.sep))
     # TODO: this will not work in win where root is C:\ and absolute_in_path
     # is on D:\
-    translated_path = os.path.join(tempfile.gettempdir(), 'shellpy_' + _get_username(), relative_path)
+    translated_path = os.path.join(_get_cache_root(), relative_path)
     return translated_path
 
 
-def _is_compilation_needed(in_filepath, out_filepath):
-    """Shows whether compilation of input file is required. It may be not required if the output file did not change
+def _get_header_key(is_root_script, python_version):
+    """Root scripts and modules get different headers and the header of root script also depends on the version
+    of python. The key identifies the header, so that the processed file is compiled again if another header
+    is required
+
+    :param is_root_script: Shows whether the file being processed is a root file
+    :param python_version: version of python, used only for root scripts
+    :return: the key of the header
+    """
+    return 'root{0}'.format(python_version) if is_root_script else _MODULE_HEADER_KEY
+
+
+def _is_compilation_needed(in_filepath, out_filepath, header_key=_MODULE_HEADER_KEY):
+    """Shows whether compilation of input file is required. It is not required if the manifest of the cache has
+    an entry for the input file made by the same version of shellpy with the same header and the content of the
+    file did not change since then.
+
+    The content is considered unchanged without reading the file if its size and modification time match the entry.
+    If only the modification time differs, e.g. after git checkout, the content hash is compared. The modification
+    time is not trusted also if the file could be modified within the time resolution of filesystem after the entry
+    was recorded
 
     :param in_filepath: The path of shellpy file to be processed
     :param out_filepath: The path of the processed python file. It may exist or not.
+    :param header_key: The key of the header the output file must have, see _get_header_key
     :return: True if compilation is needed, False otherwise
     """
     if not os.path.exists(out_filepath):
         return True
 
-    in_mtime = os.path.getmtime(in_filepath)
+    entry = _load_manifest().get(os.path.abspath(in_filepath))
+    if entry is None or entry['version'] != SHELLPY_VERSION or entry['header'] != header_key:
+        return True
+
+    in_file_stat = os.stat(in_filepath)
+    if in_file_stat.st_size != entry['size']:
+        return True
+
+    mtime_ns = _get_mtime_ns(in_file_stat)
+    if mtime_ns == entry['mtime_ns'] and mtime_ns + _MTIME_RESOLUTION_NS < entry['recorded_ns']:
+        return False
+
+    sha1 = _hash_file(in_filepath)
+    if sha1 != entry['sha1']:
+        return True
+
+    _update_manifest_entry(in_filepath, header_key, in_file_stat, sha1)
+    return False
+
+
+def _get_mtime_ns(file_stat):
+    try:
+        return file_stat.st_mtime_ns
+    except AttributeError:
+        # python 2 has only float modification time
+        return int(file_stat.st_mtime * 1000000000)
+
+
+def _hash_file(filepath):
+    import hashlib
+
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _get_manifest_path():
+    return os.path.join(_get_cache_root(), 'manifest.json')
 
-    with open(out_filepath, 'r') as f:
-        for i in range(0, 3):  # scan only for three first lines
-            line = f.readline()
-            line_result = shellpy_meta_pattern.search(line)
-            if line_result:
-                meta = line_result.group(1)
-                meta = json.loads(meta)
-                if str(in_mtime) == meta['mtime']:
-                    return False
 
-    return True
+def _load_manifest():
+    """Loads the manifest of the cache of processed files. It is read once per process and all the following
+    changes are made in memory until _save_manifest is called
+
+    :return: dictionary where keys are absolute paths of shellpy files and values are entries describing
+            the state of the file when it was processed
+    """
+    global _manifest, _manifest_path
+
+    # the cache root may be changed with SHELLPY_CACHE_DIR while the process is running
+    manifest_path = _get_manifest_path()
+    if _manifest is None or manifest_path != _manifest_path:
+        _manifest = _read_manifest()
+        _manifest_path = manifest_path
+        _changed_manifest_entries.clear()
+
+    return _manifest
+
+
+def _read_manifest():
+    import json
+
+    try:
+        with open(_get_manifest_path(), 'r') as f:
+            return json.load(f)['files']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _update_manifest_entry(in_filepath, header_key, in_file_stat, sha1):
+    absolute_path = os.path.abspath(in_filepath)
+    _load_manifest()[absolute_path] = {
+        'size': in_file_stat.st_size,
+        'mtime_ns': _get_mtime_ns(in_file_stat),
+        'sha1': sha1,
+        'version': SHELLPY_VERSION,
+        'header': header_key,
+        'recorded_ns': int(time.time() * 1000000000)
+    }
+    _changed_manifest_entries.add(absolute_path)
+
+
+def _save_manifest():
+    """Writes the changed entries of the manifest to disk. Other processes may have changed the manifest meanwhile,
+    so it is read again and only the entries changed by this process are replaced. The file is written to a temporary
+    file first and then renamed, so that other processes never see it partially written
+    """
+    if not _changed_manifest_entries:
+        return
+
+    manifest = _read_manifest()
+    for path in _changed_manifest_entries:
+        manifest[path] = _manifest[path]
+
+    import json
+    import tempfile
+
+    manifest_path = _get_manifest_path()
+    manifest_folder_path = os.path.dirname(manifest_path)
+    temp_path = None
+    try:
+        _make_private_dirs(manifest_folder_path)
+
+        fd, temp_path = tempfile.mkstemp(prefix='manifest', dir=manifest_folder_path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'files': manifest}, f)
+        _replace_file(temp_path, manifest_path)
+    except (IOError, OSError):
+        # the manifest is only a cache, if it could not be written files will be processed again next time
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+
+    _changed_manifest_entries.clear()
+
+
+def _add_manifest_entries(entries):
+    """Adds entries of the manifest recorded by other processes and saves the manifest. Processes that process files
+    in parallel send their entries to one process, so that they do not overwrite the manifest of each other
+
+    :param entries: dictionary of entries in the format of the manifest
+    """
+    with _cache_lock:
+        manifest = _load_manifest()
+        for path, entry in entries.items():
+            manifest[path] = entry
+            _changed_manifest_entries.add(path)
+
+        _save_manifest()
 
 
-def _get_header(filepath, is_root_script, python_version):
+def _replace_file(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # python 2 has no os.replace, rename does the same on posix
+        os.rename(src, dst)
+
+
+def _get_header(is_root_script, python_version):
     """To execute converted shellpy file we need to add a header to it. The header contains needed imports and
     required code
 
-    :param filepath: A shellpy file that is being converted. It is needed to get modification time of it and save it
-    to the created python file. Then this modification time will be used to find out whether recompilation is needed
     :param is_root_script: Shows whether the file being processed is a root file, which means the one
             that user executed
     :param python_version: version of python, needed to set correct header for root scripts
@@ -145,10 +447,6 @@ def _get_header(filepath, is_root_script, python_version):
 
     with open(header_filename, 'r') as f:
         header_data = f.read()
-        mod_time = os.path.getmtime(filepath)
-        meta = {'mtime': str(mod_time)}
-
-        header_data = header_data.replace('{meta}', json.dumps(meta))
 
         if is_root_script:
             executables = {
@@ -160,122 +458,260 @@ def _get_header(filepath, is_root_script, python_version):
         return header_data
 
 
+def _preprocess_code(code):
+    """Converts shellpy code to python code in a single pass
+
+    :param code: code to convert
+    :return: python code
+    """
+    return _scan(code, _expression_to_final)
+
+
 def _preprocess_code_to_intermediate(code):
-    """Before compiling to actual python code all expressions are converted to universal intermediate form
-    It is very convenient as it is possible to perform common operations for all expressions
-    The intermediate form looks like this:
+    """Converts all the expressions to universal intermediate form that looks like this:
     longline_shexe(echo 1)shexe(p)shexe
+    The form shows how every expression was recognized
 
     :param code: code to convert to intermediate form
     :return: converted code
     """
-    processed_code = _process_multilines(code)
-    processed_code = _process_long_lines(processed_code)
-    processed_code = _process_code_both(processed_code)
-    processed_code = _process_code_start(processed_code)
+    return _scan(code, _expression_to_intermediate)
+
+
+def _expression_to_intermediate(kind, cmd, params):
+    return '{kind}_shexe({cmd})shexe({params})shexe'.format(kind=kind, cmd=cmd, params=params)
 
-    return _escape(processed_code)
 
+def _scan(code, convert_expression):
+    """Scans the code once and converts every shellpy expression found in it. Python strings and comments are
+    skipped, so that ` symbol inside of them is left as it is. There are four kinds of expressions:
 
-def _process_multilines(script_data):
-    """Converts a pyshell multiline expression to one line pyshell expression, each line of which is separated
-    by semicolon. An example would be:
+    multiline, when ` is the last symbol on the line and the expression ends with ` on its own line:
     f = `
     echo 1 > test.txt
     ls -l
     `
 
-    :param script_data: the string of the whole script
-    :return: the shellpy script with multiline expressions converted to intermediate form
+    longline, when the line ends with backslash and the expression continues on the next lines:
+    f = `echo The string \
+        on several \
+        lines
+
+    both, when ` symbol is both in the beginning and in the end of expression: f = `echo 1`
+
+    start, when ` symbol is only in the beginning and the expression takes the rest of the line: f = `echo 1
+
+    :param code: the string of the whole script
+    :param convert_expression: function that receives the kind of expression, the command escaped to be put into
+            python string literal and the parameters of the command and returns the code to replace the expression
+    :return: the converted code
     """
-    code_multiline_pattern = re.compile(r'^([^`\n\r]*?)([a-z]*)`\s*?$[\n\r]{1,2}(.*?)`\s*?$', re.MULTILINE | re.DOTALL)
+    pieces = []
+    copied_until = 0
+    last_expression_end = -1
+    index = 0
+
+    while True:
+        match = code_special_symbol_pattern.search(code, index)
+        if match is None:
+            break
 
-    script_data = code_multiline_pattern.sub(r'\1multiline_shexe(\3)shexe(\2)shexe', script_data)
+        index = match.start()
+        symbol = code[index]
 
-    pattern = re.compile(r'multiline_shexe.*?shexe', re.DOTALL)
+        if symbol == '#':
+            index = _find_line_end(code, index)
+        elif symbol != '`':
+            index = _find_string_end(code, index)
+        else:
+            line_start = code.rfind('\n', 0, index) + 1
+            expression = _match_expression(code, index, last_expression_end < line_start)
+            if expression is None:
+                index += 1
+                continue
 
-    new_script_data = script_data
-    for match in pattern.finditer(script_data):
-        original_str = script_data[match.start():match.end()]
-        processed_str = re.sub(r'([\r\n]{1,2})', r'; \\\1', original_str)
+            kind, cmd, end = expression
 
-        new_script_data = new_script_data.replace(
-            original_str, processed_str)
+            params_start = index
+            while params_start > copied_until and code[params_start - 1] in string.ascii_lowercase:
+                params_start -= 1
 
-    return new_script_data
+            pieces.append(code[copied_until:params_start])
+            pieces.append(convert_expression(kind, cmd.replace('\'', '\\\''), code[params_start:index]))
 
+            copied_until = last_expression_end = index = end
 
-def _process_long_lines(script_data):
-    """Converts to python a pyshell expression that takes more than one line. An example would be:
-    f = `echo The string \
-        on several \
-        lines
+    pieces.append(code[copied_until:])
+    return ''.join(pieces)
 
-    :param script_data: the string of the whole script
-    :return: the shellpy script converted to intermediate form
-    """
-    code_long_line_pattern = re.compile(r'([a-z]*)`(((.*?\\\s*?$)[\n\r]{1,2})+(.*$))', re.MULTILINE)
-    new_script_data = code_long_line_pattern.sub(r'longline_shexe(\2)shexe(\1)shexe', script_data)
-    return new_script_data
 
+def _find_line_end(code, index):
+    line_end = code.find('\n', index)
+    return len(code) if line_end == -1 else line_end
 
-def _process_code_both(script_data):
-    """Converts to python a pyshell script that has ` symbol both in the beginning of expression and in the end.
-    An example would be:
-    f = `echo 1`
 
-    :param script_data: the string of the whole script
-    :return: the shellpy script converted to intermediate form
+def _find_string_end(code, index):
+    """Finds the end of python string literal. A string that is not closed on the line where it starts
+    is considered to end on this line, unless it is triple quoted
+
+    :param code: the string of the whole script
+    :param index: the position of the opening quote
+    :return: the position after the closing quote
     """
-    code_both_pattern = re.compile(r'([a-z]*)`(.*?)`')
-    new_script_data = code_both_pattern.sub(r'both_shexe(\2)shexe(\1)shexe', script_data)
-    return new_script_data
+    quote = code[index]
+    if code.startswith(quote * 3, index):
+        pattern = triple_quoted_string_end_patterns[quote]
+        start = index + 3
+    else:
+        pattern = string_end_patterns[quote]
+        start = index + 1
 
+    match = pattern.search(code, start)
+    while match is not None and match.group(0).startswith('\\'):
+        match = pattern.search(code, match.end())
 
-def _process_code_start(script_data):
-    """Converts to python a pyshell script that has ` symbol only in the beginning. An example would be:
-    f = `echo 1
+    if match is None:
+        return len(code)
 
-    :param script_data: the string of the whole script
-    :return: the shellpy script converted to intermediate form
-    """
-    code_start_pattern = re.compile(r'^([^\n\r`]*?)([a-z]*)`([^`\n\r]+)$', re.MULTILINE)
-    new_script_data = code_start_pattern.sub(r'\1start_shexe(\3)shexe(\2)shexe', script_data)
-    return new_script_data
+    return match.end() if match.group(0) != '\n' else match.start()
 
 
-def _escape(script_data):
-    """Escapes shell commands
+def _match_expression(code, index, is_first_on_line):
+    """Recognizes the shellpy expression that starts with ` symbol
 
-    :param script_data: the string of the whole script
-    :return: escaped script
+    :param code: the string of the whole script
+    :param index: the position of ` symbol
+    :param is_first_on_line: shows whether there is no other expression before on the same line, only such
+            expressions may be multiline
+    :return: tuple of the kind of expression, the command and the position after the expression or None if it is
+            not an expression
     """
-    pattern = re.compile(r'[a-z]*_shexe.*?shexe', re.DOTALL)
+    length = len(code)
+    line_end = _find_line_end(code, index)
+    rest_of_line = code[index + 1:line_end]
+
+    if is_first_on_line and not rest_of_line.strip() and line_end < length:
+        closing = multiline_closing_pattern.search(code, line_end + 1)
+        if closing is not None:
+            cmd = multiline_line_break_pattern.sub(_join_multiline_lines, code[line_end + 1:closing.start()])
+            return 'multiline', cmd, closing.start() + 1
 
-    new_script_data = script_data
-    for match in pattern.finditer(script_data):
-        original_str = script_data[match.start():match.end()]
-        if original_str.find('\'') != -1:
-            processed_str = original_str.replace('\'', '\\\'')
+    if rest_of_line.rstrip().endswith('\\') and line_end < length:
+        end = line_end
+        while True:
+            next_line_end = _find_line_end(code, end + 1)
+            is_continued = code[end + 1:next_line_end].rstrip().endswith('\\')
+            end = next_line_end
+            if not is_continued or end == length:
+                break
 
-            new_script_data = new_script_data.replace(
-                original_str, processed_str)
+        return 'longline', code[index + 1:end], end
 
-    return new_script_data
+    closing = code.find('`', index + 1, line_end)
+    if closing != -1:
+        return 'both', code[index + 1:closing], closing + 1
+
+    if rest_of_line.endswith('\r'):
+        rest_of_line = rest_of_line[:-1]
+
+    if rest_of_line:
+        return 'start', rest_of_line, index + 1 + len(rest_of_line)
+
+    return None
+
+
+def _join_multiline_lines(match):
+    """Lines of multiline expression are joined with semicolons to a single line command. Every line break
+    is escaped with backslash and empty lines are skipped
+
+    :param match: the match of a line with its line break
+    :return: the line with a semicolon and escaped line break
+    """
+    line, line_break = match.group(1), match.group(2)
+    if not line.strip():
+        return line + '\\' + line_break
+
+    return line + '; \\' + line_break
 
 
 def _intermediate_to_final(script_data):
-    """All shell blocks are first compiled to intermediate form. This part of code converts the intermediate
-    to final python code
+    """Converts code in intermediate form to final python code, the same that _preprocess_code produces
 
     :param script_data: the string of the whole script
     :return: python script ready to be executed
     """
-    intermediate_pattern = re.compile(r'[a-z]*_shexe\((.*?)\)shexe\((.*?)\)shexe', re.MULTILINE | re.DOTALL)
-    final_script = intermediate_pattern.sub(r"exe('\1'.format(**dict(locals(), **globals())),'\2')", script_data)
+    intermediate_pattern = re.compile(r'([a-z]*)_shexe\((.*?)\)shexe\((.*?)\)shexe', re.MULTILINE | re.DOTALL)
+    final_script = intermediate_pattern.sub(lambda match: _expression_to_final(*match.groups()), script_data)
     return final_script
 
 
+def _expression_to_final(kind, cmd, params):
+    """Converts a single expression to the call of exe. Expressions with the async parameter are converted to aexe
+    calls that return awaitables
+
+    Variables used in the command like {name} are passed to format by name, so that only they are looked up when
+    the command is executed. If the variables cannot be found at compile time, all the local and global variables
+    are passed to format instead
+
+    :param kind: the kind of expression, the call does not depend on it
+    :param cmd: the command escaped to be put into python string literal
+    :param params: the parameters of the command
+    :return: the python code of the call
+    """
+    function = 'aexe' if params.find(_PARAM_ASYNC) != -1 else 'exe'
+
+    names = _get_format_names(cmd)
+    if names is None:
+        format_call = '.format(**dict(locals(), **globals()))'
+    elif names:
+        format_call = '.format({0})'.format(', '.join('{0}={0}'.format(name) for name in names))
+    elif cmd.find('{') != -1 or cmd.find('}') != -1:
+        format_call = '.format()'
+    else:
+        format_call = ''
+
+    return "{function}('{cmd}'{format_call},'{params}')".format(
+        function=function, cmd=cmd, format_call=format_call, params=params)
+
+
+def _get_format_names(cmd):
+    """Finds names of variables used in format fields of a command, e.g. x and y in 'echo {x} {y.name}'
+
+    :param cmd: the command as it is written inside of python string literal
+    :return: sorted list of the names or None if some field does not refer to a variable by name or the command
+            is not a valid format string
+    """
+    import ast
+
+    try:
+        format_string = ast.literal_eval("'" + cmd + "'")
+    except (ValueError, SyntaxError):
+        return None
+
+    names = set()
+    try:
+        _add_format_names(format_string, names)
+    except ValueError:
+        return None
+
+    return sorted(names)
+
+
+def _add_format_names(format_string, names):
+    for literal_text, field_name, format_spec, conversion in _formatter.parse(format_string):
+        if field_name is None:
+            continue
+
+        name = format_field_root_pattern.match(field_name).group(0)
+        if not identifier_pattern.match(name) or keyword.iskeyword(name):
+            raise ValueError('Field {0} does not refer to a variable'.format(field_name))
+
+        names.add(name)
+
+        if format_spec:
+            _add_format_names(format_spec, names)
+
+
 def _add_encoding_to_header(header_data, script_data):
     """PEP-0263 defines a way to specify python file encoding. If this encoding is present in first
     two lines of a shellpy script it will then be moved to the top generated output file
@@ -0,0 +1,318 @@
+"""Server that keeps python warm with shellpython imported and executes shellpy scripts in forked processes, so that
+scripts do not pay for the start of python interpreter. Available only on unix with python 3.3 and above
+
+The server is started with shellpy --server and scripts are sent to it with shellpy-client. The client sends the
+script, its arguments, the config of shellpy, the environment, sys.path and the current directory, together with its
+stdin, stdout and stderr file descriptors. The server forks a child for every script, which replaces its own stdio
+with the descriptors of the client and executes the script. The child sends its pid to the client, so that the client
+can forward signals to it, and then the exit code of the script.
+
+The socket is created in the cache directory of the user, which is accessible only by the user. The socket itself
+is accessible only by the user as well and requests of clients run by other users are rejected
+"""
+from __future__ import print_function
+import io
+import os
+import sys
+import json
+import array
+import errno
+import socket
+import signal
+import struct
+import traceback
+from shellpython import config
+from shellpython import preprocessor
+
+# the format of the length of request that precedes it
+_LENGTH_FORMAT = '!I'
+
+# number of file descriptors sent with the request: stdin, stdout and stderr
+_FD_COUNT = 3
+
+# the socket option of bsd and macos that gives credentials of the peer, python does not define it
+_SOL_LOCAL = 0
+_LOCAL_PEERCRED = 1
+_XUCRED_SIZE = 76
+
+
+def get_default_socket_path():
+    """Returns the path of the server socket used if no other path is specified
+
+    :return: the path of the socket
+    """
+    return os.path.join(preprocessor._get_cache_root(), 'server.sock')
+
+
+def is_supported():
+    """Shows whether the server and the client may work on this platform
+
+    :return: True if they are supported
+    """
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+
+def serve(socket_path=None):
+    """Starts the server and serves requests until it is interrupted
+
+    :param socket_path: the path of unix socket to listen on, the default one if None
+    :return: exit code of the server
+    """
+    if not is_supported():
+        print('shellpy server requires unix and python 3.3 or above', file=sys.stderr)
+        return 1
+
+    socket_path = socket_path or get_default_socket_path()
+    server_socket = _create_server_socket(socket_path)
+    if server_socket is None:
+        print('shellpy server is already running on ' + socket_path, file=sys.stderr)
+        return 1
+
+    # children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    # everything needed to execute scripts is imported once, so that forked children do not import it again
+    from shellpython import shellpy, core
+
+    print('shellpy server is listening on ' + socket_path)
+    sys.stdout.flush()
+
+    try:
+        while True:
+            try:
+                connection, _ = server_socket.accept()
+            except InterruptedError:
+                continue
+
+            # the client sends code to execute, so only the user of the server may use it
+            if _get_peer_uid(connection) != os.getuid():
+                _reject(connection)
+                continue
+
+            if os.fork() == 0:
+                # the child must never return to the loop of the server
+                exit_code = 1
+                try:
+                    server_socket.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    exit_code = _handle_connection(connection)
+                finally:
+                    os._exit(exit_code)
+
+            connection.close()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server_socket.close()
+        os.remove(socket_path)
+
+
+def run_script(filename, script_args, python_version, socket_path=None):
+    """Sends the script to the server and waits for it to finish. Signals received by the current process are
+    forwarded to the process that executes the script
+
+    :param filename: the path of shellpy file
+    :param script_args: arguments of the script
+    :param python_version: version of python the script is for
+    :param socket_path: the path of unix socket of the server, the default one if None
+    :return: exit code of the script or None if the server is not available or cannot execute the script
+    """
+    if not is_supported():
+        return None
+
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client_socket.connect(socket_path or get_default_socket_path())
+    except (IOError, OSError):
+        client_socket.close()
+        return None
+
+    request = json.dumps({
+        'script': os.path.abspath(filename),
+        'args': list(script_args),
+        'python_version': python_version,
+        'config': config.dumps(),
+        'env': dict(os.environ),
+        'cwd': os.getcwd(),
+        'path': sys.path
+    }).encode('utf-8')
+
+    with client_socket:
+        fds = array.array('i', [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        client_socket.sendmsg([struct.pack(_LENGTH_FORMAT, len(request)) + request],
+                              [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+
+        responses = client_socket.makefile('r')
+        response = responses.readline().split()
+        if not response or response[0] != 'pid':
+            return None
+
+        pid = int(response[1])
+        for signal_number in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signal_number, lambda signal_number, frame: _forward_signal(pid, signal_number))
+
+        response = responses.readline().split()
+        if not response or response[0] != 'exit':
+            # the process was killed before it could send the exit code
+            return 1
+
+        return int(response[1])
+
+
+def _reject(connection):
+    try:
+        connection.sendall(b'error permission denied\n')
+    except OSError:
+        pass
+    connection.close()
+
+
+def _forward_signal(pid, signal_number):
+    try:
+        os.kill(pid, signal_number)
+    except OSError:
+        pass
+
+
+def _create_server_socket(socket_path):
+    """Creates the socket of the server. If the socket file already exists but nobody listens on it, it is replaced
+
+    :param socket_path: the path of unix socket
+    :return: the socket or None if another server listens on the path
+    """
+    preprocessor._make_private_dirs(os.path.dirname(socket_path))
+
+    if os.path.exists(socket_path):
+        probe_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe_socket.connect(socket_path)
+            return None
+        except (IOError, OSError):
+            os.remove(socket_path)
+        finally:
+            probe_socket.close()
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket may be in any directory, so it is made accessible only by the user from the very start
+    umask = os.umask(0o177)
+    try:
+        server_socket.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+
+    server_socket.listen(socket.SOMAXCONN)
+    return server_socket
+
+
+def _get_peer_uid(connection):
+    """Returns the id of the user that runs the client
+
+    :param connection: the connection to the client
+    :return: the user id or None if it is not known
+    """
+    try:
+        if hasattr(socket, 'SO_PEERCRED'):
+            # struct ucred of linux with pid, uid and gid
+            credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            return struct.unpack('3i', credentials)[1]
+
+        # struct xucred of bsd and macos that starts with its version and uid
+        credentials = connection.getsockopt(_SOL_LOCAL, _LOCAL_PEERCRED, _XUCRED_SIZE)
+        return struct.unpack('2I', credentials[:struct.calcsize('2I')])[1]
+    except (OSError, struct.error):
+        return None
+
+
+def _handle_connection(connection):
+    """Executes the script sent by the client. It is called in the forked child of the server
+
+    :param connection: the connection to the client
+    :return: exit code of the child process
+    """
+    try:
+        request = _receive_request(connection)
+    except (IOError, OSError, ValueError):
+        traceback.print_exc()
+        return 1
+
+    if request['python_version'] != sys.version_info[0]:
+        connection.sendall(b'error python version is not supported\n')
+        return 1
+
+    _reopen_stdio()
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    # modules are imported from the path of the client, which depends on its PYTHONPATH among other things
+    sys.path[:] = request['path']
+    config.loads(request['config'])
+
+    connection.sendall('pid {0}\n'.format(os.getpid()).encode('utf-8'))
+
+    from shellpython import shellpy
+
+    try:
+        exit_code = shellpy._execute_in_process(request['script'], request['args'], request['python_version'])
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    connection.sendall('exit {0}\n'.format(exit_code).encode('utf-8'))
+    return exit_code
+
+
+def _reopen_stdio():
+    """Creates new sys.stdin, sys.stdout and sys.stderr for the descriptors received from the client, so that
+    buffering is chosen for them and not for the descriptors of the server
+    """
+    for name, fd, mode in (('stdin', 0, 'r'), ('stdout', 1, 'w'), ('stderr', 2, 'w')):
+        stream = getattr(sys, name)
+        is_line_buffered = fd == 2 or (mode == 'w' and os.isatty(fd))
+        setattr(sys, name, io.open(fd, mode, buffering=1 if is_line_buffered else -1, encoding=stream.encoding,
+                                   errors=stream.errors, closefd=False))
+
+
+def _receive_request(connection):
+    """Receives the request of the client and replaces stdin, stdout and stderr of the current process
+    with the descriptors of the client
+
+    :param connection: the connection to the client
+    :return: the request
+    """
+    fds = array.array('i')
+    data, ancillary_data, _, _ = connection.recvmsg(4096, socket.CMSG_SPACE(_FD_COUNT * fds.itemsize))
+
+    for level, message_type, message_data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == socket.SCM_RIGHTS:
+            fds.frombytes(message_data[:len(message_data) - (len(message_data) % fds.itemsize)])
+
+    if len(fds) != _FD_COUNT:
+        raise ValueError('stdin, stdout and stderr were not received')
+
+    for target_fd, fd in enumerate(fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+
+    length_size = struct.calcsize(_LENGTH_FORMAT)
+    while len(data) < length_size:
+        data += _receive(connection)
+
+    length = struct.unpack(_LENGTH_FORMAT, data[:length_size])[0]
+    data = data[length_size:]
+    while len(data) < length:
+        data += _receive(connection)
+
+    return json.loads(data.decode('utf-8'))
+
+
+def _receive(connection):
+    data = connection.recv(65536)
+    if not data:
+        raise IOError(errno.ECONNRESET, 'connection closed by client')
+    return data
@@ -0,0 +1,181 @@
+"""Execution of commands in a long-lived bash process instead of starting a new shell for every command. Every thread
+has its own bash session, it is started with the first command of the thread. Available only on unix with bash
+
+A command is sent to bash together with commands that print a unique sentinel and the exit code of the command to
+stdout and the sentinel to stderr, so that the end of the output of the command is found without waiting for the pipes
+to be closed. Commands are executed with eval in the session, so cd, export and variables persist between commands the
+same way as they do in a shell script. Changes of the current directory and environment made in python with
+os.chdir and os.environ are passed to the session before the next command.
+
+Stdin of commands is /dev/null. Processes started in background with & must not write to stdout or stderr after
+the command is finished, otherwise their output gets into the result of the next command
+"""
+import os
+import re
+import sys
+import select
+import binascii
+import subprocess
+import threading
+
+# size of a single read from stdout or stderr of the session
+_CHUNK_SIZE = 64 * 1024
+
+# sessions of threads, see get_session
+_local = threading.local()
+
+# only variables with such names can be exported to the session
+_VARIABLE_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def get_session():
+    """Returns the session of the current thread and starts it if the thread does not have one or it is finished
+
+    :return: the session
+    """
+    session = getattr(_local, 'session', None)
+    if session is None or not session.is_alive():
+        session = Session()
+        _local.session = session
+
+    return session
+
+
+def close_session():
+    """Finishes the session of the current thread if it is started. The next command starts a new session
+    """
+    session = getattr(_local, 'session', None)
+    if session is not None:
+        _local.session = None
+        session.close()
+
+
+class Session(object):
+    """A bash process that executes commands one by one
+    """
+    def __init__(self):
+        self._pid = os.getpid()
+        self._sentinel = b'__shellpy_' + binascii.hexlify(os.urandom(16)) + b'__'
+        self._cwd = os.getcwd()
+        self._environ = dict(os.environ)
+        self._process = subprocess.Popen(['bash', '--noprofile', '--norc'], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._environ)
+
+    def is_alive(self):
+        """Shows whether the session may execute commands. The session of the parent process is not used in forked
+        children as they would share its pipes
+
+        :return: True if the session is running and belongs to the current process
+        """
+        return self._pid == os.getpid() and self._process.poll() is None
+
+    def close(self):
+        """Finishes the bash process of the session
+        """
+        if self._pid != os.getpid():
+            return
+
+        for file in (self._process.stdin, self._process.stdout, self._process.stderr):
+            file.close()
+        self._process.wait()
+
+    def execute(self, cmd):
+        """Executes the command in the session
+
+        :param cmd: the command to execute
+        :return: tuple of stdout, stderr and exit code of the command
+        """
+        script = self._sync() + "eval {0} </dev/null\nprintf '\\n%s %d\\n' {1} $?\nprintf '\\n%s\\n' {1} >&2\n".format(
+            _quote(cmd), self._sentinel.decode('ascii'))
+
+        self._process.stdin.write(os.fsencode(script) if sys.version_info[0] == 3 else script)
+        self._process.stdin.flush()
+
+        return self._read_output()
+
+    def _sync(self):
+        """Creates commands that pass the changes of current directory and environment made in python since the last
+        command to the session. Changes made by commands in the session are not overwritten unless the same variable
+        is changed in python
+
+        :return: the commands to execute before the next command
+        """
+        commands = []
+
+        cwd = os.getcwd()
+        if cwd != self._cwd:
+            commands.append('cd -- {0} 2>/dev/null'.format(_quote(cwd)))
+            self._cwd = cwd
+
+        if os.environ != self._environ:
+            environ = dict(os.environ)
+            for name in self._environ:
+                if name not in environ and _VARIABLE_NAME_PATTERN.match(name):
+                    commands.append('unset {0} 2>/dev/null'.format(name))
+            for name, value in environ.items():
+                if self._environ.get(name) != value and _VARIABLE_NAME_PATTERN.match(name):
+                    commands.append('export {0}={1} 2>/dev/null'.format(name, _quote(value)))
+            self._environ = environ
+
+        return ''.join(command + '\n' for command in commands)
+
+    def _read_output(self):
+        """Reads stdout and stderr of the session until the sentinels of the command are found in both of them
+
+        :return: tuple of stdout, stderr and exit code of the command
+        """
+        stdout_fd = self._process.stdout.fileno()
+        stderr_fd = self._process.stderr.fileno()
+        buffers = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+        markers = {stdout_fd: b'\n' + self._sentinel + b' ', stderr_fd: b'\n' + self._sentinel + b'\n'}
+        # positions of the sentinels in the buffers and descriptors read to the end of the command
+        ends = {}
+        finished = set()
+
+        while len(finished) < 2:
+            ready, _, _ = select.select([fd for fd in buffers if fd not in finished], [], [])
+            for fd in ready:
+                chunk = os.read(fd, _CHUNK_SIZE)
+                if not chunk:
+                    # the session is finished, e.g. with exit command
+                    return self._finish_output(buffers)
+
+                buffer = buffers[fd]
+                search_start = max(0, len(buffer) - len(markers[fd]))
+                buffer += chunk
+
+                if fd not in ends:
+                    end = buffer.find(markers[fd], search_start)
+                    if end != -1:
+                        ends[fd] = end
+
+                # the exit code follows the sentinel in stdout, so it is read up to the end of the line
+                if fd in ends and (fd == stderr_fd or buffer.endswith(b'\n')):
+                    finished.add(fd)
+
+        stdout = buffers[stdout_fd]
+        returncode = int(bytes(stdout[ends[stdout_fd] + len(markers[stdout_fd]):]))
+
+        return bytes(stdout[:ends[stdout_fd]]), bytes(buffers[stderr_fd][:ends[stderr_fd]]), returncode
+
+    def _finish_output(self, buffers):
+        """Reads the rest of the output of the finished session
+
+        :param buffers: the output read so far by descriptors of the pipes
+        :return: tuple of stdout, stderr and exit code of the session
+        """
+        for fd, buffer in buffers.items():
+            chunk = os.read(fd, _CHUNK_SIZE)
+            while chunk:
+                buffer += chunk
+                chunk = os.read(fd, _CHUNK_SIZE)
+
+        stdout = bytes(buffers[self._process.stdout.fileno()])
+        stderr = bytes(buffers[self._process.stderr.fileno()])
+        self.close()
+
+        return stdout, stderr, self._process.returncode
+
+
+def _quote(text):
+    return "'" + text.replace("'", "'\\''") + "'"
@@ -1,14 +1,27 @@
 #!/usr/bin/env python
+from __future__ import print_function
 import sys
 import os
 import re
-import subprocess
+import time
 import shellpython.config as config
-from shellpython.preprocessor import preprocess_file
-from argparse import ArgumentParser
+from shellpython import preprocessor
+from shellpython.preprocessor import preprocess_file, compile_bytecode
 from shellpython.constants import *
 
 
+class _DefaultArguments(object):
+    """Arguments of shellpy when none are given on the command line. They are used instead of parsing, so that
+    argparse is not imported in the most common case. The values must match defaults of the parser
+    """
+    verbose = False
+    vv = False
+    direct_execution = False
+    session = False
+    server = False
+    socket = None
+
+
 def main2():
     main(python_version=2)
 
@@ -18,20 +31,55 @@ def main3():
 
 
 def main(python_version):
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        exit(compile_main(sys.argv[2:], python_version))
+
+    shellpy_args, filename, script_args = _parse_arguments(sys.argv)
+
+    if shellpy_args.server:
+        from shellpython import server
+        exit(server.serve(shellpy_args.socket))
+
+    if filename is None:
+        exit('No *.spy file was specified. Only *.spy files are supported by the tool.')
+
+    _apply_arguments(shellpy_args)
+
+    exit(_execute_script(filename, script_args, python_version))
+
+
+def _parse_arguments(argv):
+    """Parses command line of shellpy. Arguments before shellpy file belong to shellpy and the ones after it
+    belong to the script
+
+    :param argv: command line arguments, as in sys.argv
+    :return: tuple of parsed arguments of shellpy, the path of shellpy file or None if it was not specified and
+            the list of arguments of the script
+    """
     custom_usage = '''%(prog)s [SHELLPY ARGS] file [SCRIPT ARGS]
+       %(prog)s compile [COMPILE ARGS] path [path ...]
+       %(prog)s --server [--socket SOCKET]
 
 For arguments help use:
     %(prog)s --help
+    %(prog)s compile --help
     '''
     custom_epilog = '''github : github.com/lamerman/shellpy'''
 
     try:
-        spy_file_index = next(index for index, arg in enumerate(sys.argv) if re.match('.+\.spy$', arg))
-        shellpy_args = sys.argv[1:spy_file_index]
-        script_args = sys.argv[spy_file_index + 1:]
+        spy_file_index = next(index for index, arg in enumerate(argv) if re.match(r'.+\.spy$', arg))
+        shellpy_args = argv[1:spy_file_index]
+        script_args = argv[spy_file_index + 1:]
+        filename = argv[spy_file_index]
     except StopIteration:
-        shellpy_args = sys.argv[1:]
-        spy_file_index = None
+        shellpy_args = argv[1:]
+        script_args = []
+        filename = None
+
+    if not shellpy_args and filename is not None:
+        return _DefaultArguments(), filename, script_args
+
+    from argparse import ArgumentParser
 
     parser = ArgumentParser(description='A tool for convenient shell scripting in python',
                             usage=custom_usage, epilog=custom_epilog)
@@ -39,12 +87,21 @@ For arguments help use:
                         action="store_true")
     parser.add_argument('-vv', help='even bigger output verbosity. All stdout and stderr of executed commands is '
                                     'printed', action="store_true")
+    parser.add_argument('--direct-execution', help='execute simple commands that do not use shell syntax directly '
+                                                   'without shell', action="store_true")
+    parser.add_argument('--session', help='execute commands in one long-lived bash process, so that cd and export '
+                                          'persist between commands', action="store_true")
+    parser.add_argument('--server', help='start a server that keeps python warm and executes scripts sent by '
+                                         'shellpy-client in forked processes', action="store_true")
+    parser.add_argument('--socket', help='unix socket of the server, by default it is in the cache directory of '
+                                         'the user')
 
     shellpy_args, _ = parser.parse_known_args(shellpy_args)
 
-    if spy_file_index is None:
-        exit('No *.spy file was specified. Only *.spy files are supported by the tool.')
+    return shellpy_args, filename, script_args
+
 
+def _apply_arguments(shellpy_args):
     if shellpy_args.verbose or shellpy_args.vv:
         config.PRINT_ALL_COMMANDS = True
 
@@ -52,8 +109,37 @@ For arguments help use:
         config.PRINT_STDOUT_ALWAYS = True
         config.PRINT_STDERR_ALWAYS = True
 
-    filename = sys.argv[spy_file_index]
+    if shellpy_args.direct_execution:
+        config.DIRECT_EXECUTION = True
 
+    if shellpy_args.session:
+        config.SESSION_EXECUTION = True
+
+
+def _execute_script(filename, script_args, python_version):
+    """Executes the root script in the current python process if it is for the current version of python and in
+    a new python process otherwise
+
+    :param filename: the path of shellpy file
+    :param script_args: arguments of the script
+    :param python_version: version of python to execute the script with
+    :return: exit code of the script
+    """
+    if python_version == sys.version_info[0]:
+        return _execute_in_process(filename, script_args, python_version)
+
+    return _execute(filename, script_args, python_version)
+
+
+def _execute(filename, script_args, python_version):
+    """Executes the root script in a new python process. It is needed if the script is for another version of python
+    than the current one
+
+    :param filename: the path of shellpy file
+    :param script_args: arguments of the script
+    :param python_version: version of python to execute the script with
+    :return: exit code of the script
+    """
     processed_file = preprocess_file(filename, is_root_script=True, python_version=python_version)
 
     # include directory of the script to pythonpath
@@ -61,11 +147,158 @@ For arguments help use:
     new_env['PYTHONPATH'] = new_env.get("PYTHONPATH", '') + os.pathsep + os.path.dirname(filename)
     new_env[SHELLPY_PARAMS] = config.dumps()
 
-    root_command = processed_file
-    if sys.platform == "win32":
-        root_command = "python " + root_command
-    retcode = subprocess.call(root_command + ' ' + ' '.join(script_args), shell=True, env=new_env)
-    exit(retcode)
+    # bytecode is compiled by the current interpreter, so it may be used only if the script needs the same version
+    bytecode_file = compile_bytecode(processed_file) if python_version == sys.version_info[0] else None
+
+    if bytecode_file is not None:
+        root_command = [sys.executable, bytecode_file]
+    else:
+        root_command = [processed_file]
+        if sys.platform == "win32":
+            root_command = ["python"] + root_command
+    import subprocess
+    return subprocess.call(root_command + list(script_args), env=new_env)
+
+
+def _execute_in_process(filename, script_args, python_version):
+    """Executes the root script in the current python process as __main__ module, the same way as runpy does it.
+    The config must be already applied to the current process
+
+    :param filename: the path of shellpy file
+    :param script_args: arguments of the script
+    :param python_version: version of python the script is for, it must be the version of current process
+    :return: exit code of the script. Exceptions raised by the script are not caught
+    """
+    processed_file = preprocess_file(filename, is_root_script=True, python_version=python_version)
+    code_file = compile_bytecode(processed_file) or processed_file
+
+    sys.argv = [filename] + list(script_args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(filename)))
+    # the header of the script loads the config from the environment, which may be inherited from another process
+    os.environ[SHELLPY_PARAMS] = config.dumps()
+
+    import runpy
+
+    try:
+        runpy.run_path(code_file, run_name='__main__')
+    except SystemExit as e:
+        return _get_exit_code(e)
+
+    return 0
+
+
+def _get_exit_code(system_exit):
+    """Converts SystemExit to exit code the same way as python interpreter does it
+
+    :param system_exit: the exception
+    :return: exit code
+    """
+    if system_exit.code is None:
+        return 0
+
+    if isinstance(system_exit.code, int):
+        return system_exit.code
+
+    print(system_exit.code, file=sys.stderr)
+    return 1
+
+
+def compile_main(args, python_version):
+    """Preprocesses all the shellpy files in the given directories ahead of time, so that scripts and modules do not
+    need to be preprocessed when they are executed. Files are processed in parallel by a pool of processes
+
+    :param args: command line arguments after the compile command
+    :param python_version: version of python of shellpy command, used for the header of root scripts
+    :return: exit code, 0 if all the files were processed successfully, 1 otherwise
+    """
+    import multiprocessing
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog=os.path.basename(sys.argv[0]) + ' compile',
+                            description='Preprocess shellpy files into the cache ahead of time')
+    parser.add_argument('paths', nargs='+', metavar='path', help='shellpy file or directory to walk for shellpy files')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes, 0 means the number of CPUs. Default is 1')
+    parser.add_argument('--cache-dir', help='directory to write the cache to. Scripts use it if the directory is set '
+                                            'in ' + SHELLPY_CACHE_DIR + ' environment variable. Sources must be on '
+                                            'the same paths when the cache is used')
+    parser.add_argument('--root', help='process the files as root scripts, which are executed with shellpy command, '
+                                       'instead of modules', action='store_true')
+
+    compile_args = parser.parse_args(args)
+
+    if compile_args.cache_dir is not None:
+        # worker processes inherit the environment
+        os.environ[SHELLPY_CACHE_DIR] = os.path.abspath(compile_args.cache_dir)
+
+    tasks = [(filepath, compile_args.root, python_version) for filepath in _find_spy_files(compile_args.paths)]
+
+    jobs = compile_args.jobs if compile_args.jobs > 0 else multiprocessing.cpu_count()
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.imap_unordered(_compile_file, tasks)
+            success, entries = _report_compile_results(results)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        success, entries = _report_compile_results(map(_compile_file, tasks))
+
+    preprocessor._add_manifest_entries(entries)
+
+    return 0 if success else 1
+
+
+def _find_spy_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith('.spy'):
+                    yield os.path.join(dir_path, file_name)
+
+
+def _compile_file(task):
+    """Preprocesses one shellpy file in a worker process. The manifest is not saved by workers, their entries
+    are saved by the main process
+
+    :param task: tuple of the path of shellpy file, whether it is a root script and the version of python
+    :return: tuple of the path, the time of processing, the error message or None and the entry of the manifest
+    """
+    filepath, is_root_script, python_version = task
+    start = time.time()
+
+    try:
+        out_filename = preprocessor._preprocess_file(filepath, is_root_script, python_version)
+        if preprocessor.compile_bytecode(out_filename) is None:
+            # the bytecode may be not written because of syntax error, compile to get it reported
+            with open(out_filename, 'r') as f:
+                compile(f.read(), out_filename, 'exec', dont_inherit=True)
+    except Exception as e:
+        return filepath, time.time() - start, '{0}: {1}'.format(type(e).__name__, e), None
+
+    entry = preprocessor._load_manifest().get(os.path.abspath(filepath))
+    return filepath, time.time() - start, None, entry
+
+
+def _report_compile_results(results):
+    success = True
+    entries = {}
+
+    for filepath, elapsed, error, entry in results:
+        if error is None:
+            print('Compiled {0} in {1:.3f} s'.format(filepath, elapsed))
+            entries[os.path.abspath(filepath)] = entry
+        else:
+            print('Failed to compile {0}: {1}'.format(filepath, error), file=sys.stderr)
+            success = False
+
+    return success, entries
 
 
 if __name__ == '__main__':
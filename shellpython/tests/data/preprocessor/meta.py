@@ -1,3 +0,0 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-#shellpy-meta:{"mtime": "1111111111.11"}
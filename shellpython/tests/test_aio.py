@@ -0,0 +1,111 @@
+import sys
+import unittest
+
+from shellpython import core
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from shellpython import aio
+
+
+def _run(awaitable):
+    # the child watcher of python 3.7 and below works only with the loop set for the current thread
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class StreamMock:
+
+    def __init__(self):
+        self.lines = []
+
+    def mocked_print(self, text):
+        self.lines.append(text)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio execution requires python 3.5')
+class TestAsyncExecute(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout_mock = StreamMock()
+        self.stderr_mock = StreamMock()
+        core._print_stdout = self.stdout_mock.mocked_print
+        core._print_stderr = self.stderr_mock.mocked_print
+
+    def test_simple_echo_success(self):
+        result = _run(core.aexe('echo 1', 'a'))
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, '1')
+        self.assertEqual(result.stderr, '')
+
+    def test_simple_echo_failure(self):
+        with self.assertRaises(core.NonZeroReturnCodeError) as cm:
+            _run(core.aexe('cat non_existent_file', 'a'))
+
+        self.assertNotEqual(cm.exception.result.returncode, 0)
+        self.assertGreater(len(cm.exception.result.stderr), 0)
+
+    def test_param_p(self):
+        _run(core.aexe('echo 1', 'ap'))
+
+        self.assertEqual(self.stdout_mock.lines, ['1'])
+
+    def test_concurrent(self):
+        commands = [core.aexe('sleep 0.5; echo {}'.format(i), 'a') for i in range(20)]
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            start = loop.time()
+            results = loop.run_until_complete(asyncio.gather(*commands))
+            elapsed = loop.time() - start
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        self.assertEqual([str(result) for result in results], [str(i) for i in range(20)])
+        self.assertLess(elapsed, 5)
+
+    def test_interactive(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            result = loop.run_until_complete(aio.aexe('read name; echo "hello $name"', 'ai'))
+            loop.run_until_complete(result.swriteline('world'))
+
+            self.assertEqual(loop.run_until_complete(result.sreadline()), 'hello world')
+            self.assertRaises(StopAsyncIteration, loop.run_until_complete, result.sreadline())
+            self.assertEqual(loop.run_until_complete(result.wait()), 0)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_timeout(self):
+        with self.assertRaises(core.CommandTimeoutError) as cm:
+            _run(core.aexe('echo 1; sleep 10', 'a', timeout=0.3))
+
+        self.assertEqual(cm.exception.result.stdout, '1')
+
+    def test_rlimits(self):
+        result = _run(core.aexe('ulimit -t', 'a', rlimits={'cpu': 5}))
+
+        self.assertEqual(result.stdout, '5')
+
+    def test_interactive_raw(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            result = loop.run_until_complete(aio.aexe('printf "\\377\\n2"', 'air'))
+
+            self.assertEqual(loop.run_until_complete(result.sreadline()), b'\xff')
+            self.assertEqual(loop.run_until_complete(result.sreadline()), b'2')
+            self.assertEqual(loop.run_until_complete(result.wait()), 0)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
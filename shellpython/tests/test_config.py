@@ -0,0 +1,20 @@
+import unittest
+import mock
+
+from shellpython import config
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_dumps_loads(self):
+        with mock.patch('shellpython.config.PRINT_ALL_COMMANDS', True), \
+                mock.patch('shellpython.config.DIRECT_EXECUTION', True):
+            data = config.dumps()
+
+        with mock.patch('shellpython.config.PRINT_ALL_COMMANDS', False), \
+                mock.patch('shellpython.config.DIRECT_EXECUTION', False):
+            config.loads(data)
+
+            self.assertTrue(config.PRINT_ALL_COMMANDS)
+            self.assertTrue(config.DIRECT_EXECUTION)
+            self.assertFalse(config.PRINT_STDOUT_ALWAYS)
@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# modules that must not be imported by import of shellpython and its core, they are imported only when needed
+DEFERRED_MODULES = ('colorama', 'json', 'getpass', 'tempfile', 'pickle', 'base64', 'argparse', 'ast', 'hashlib',
+                    'py_compile', 'multiprocessing', 'shellpython.preprocessor')
+
+# modules of the standard library imported by shellpython and its core. They are imported before shellpython, so that
+# modules they import themselves are not counted, e.g. pickle imported by subprocess of python 2. The time of their
+# import is the reference for the time of import of shellpython
+STDLIB_MODULES = 'errno, os, re, signal, subprocess, sys, threading, time, weakref'
+
+# the time import of shellpython and its core may take at most, relative to the import of STDLIB_MODULES on the same
+# machine. It is well above the real ratio to not fail on slow machines, but it fails if heavy imports come back
+IMPORT_TIME_RATIO = 4
+
+IMPORT_CODE = '''
+import time
+start = time.time()
+import {stdlib_modules}
+reference = time.time() - start
+modules_before = set(sys.modules)
+start = time.time()
+import shellpython, shellpython.core
+print(time.time() - start)
+print(reference)
+print(' '.join(sorted(set(sys.modules) - modules_before)))
+'''.format(stdlib_modules=STDLIB_MODULES)
+
+
+class TestImportTime(unittest.TestCase):
+
+    def _import(self):
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE], env=env).decode('utf-8')
+        elapsed, reference, modules = output.splitlines()
+        return float(elapsed), float(reference), modules.split()
+
+    def test_deferred_modules(self):
+        _, _, modules = self._import()
+
+        self.assertEqual([module for module in DEFERRED_MODULES if module in modules], [])
+
+    def test_import_time(self):
+        # the first import may also write bytecode
+        imports = [self._import() for _ in range(3)]
+        elapsed = min(elapsed for elapsed, _, _ in imports)
+        reference = min(reference for _, reference, _ in imports)
+
+        self.assertLess(elapsed, IMPORT_TIME_RATIO * reference)
@@ -0,0 +1,112 @@
+import os
+import sys
+import shutil
+import threading
+import tempfile
+import unittest
+import importlib
+import mock
+import shellpython
+from shellpython import locator, preprocessor
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        self.spy_dir = tempfile.mkdtemp()
+        self.cache_root = tempfile.mkdtemp()
+
+        package_path = os.path.join(self.spy_dir, 'spypackage')
+        os.makedirs(os.path.join(package_path, 'subpackage'))
+        files = {
+            '__init__.spy': 'x = `echo init`\n',
+            'first.spy': 'x = `echo first`\n',
+            'second.spy': 'x = `echo second`\n',
+            os.path.join('subpackage', '__init__.spy'): '',
+            os.path.join('subpackage', 'third.spy'): 'x = `echo third`\n',
+        }
+        for name, code in files.items():
+            with open(os.path.join(package_path, name), 'w') as f:
+                f.write(code)
+
+        patchers = [mock.patch.object(preprocessor, '_get_cache_root', return_value=self.cache_root),
+                    mock.patch.object(preprocessor, '_manifest', None),
+                    mock.patch.object(preprocessor, '_changed_manifest_entries', set()),
+                    mock.patch.object(sys, 'path', sys.path + [self.spy_dir])]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        shellpython.init()
+
+    def tearDown(self):
+        shellpython.uninit()
+
+        for name in list(sys.modules):
+            if name.split('.')[0] == 'spypackage':
+                del sys.modules[name]
+
+        shutil.rmtree(self.spy_dir)
+        shutil.rmtree(self.cache_root)
+
+    def _is_processed(self, *path):
+        processed_package_path = preprocessor._translate_to_temp_path(os.path.join(self.spy_dir, 'spypackage'))
+        return os.path.exists(os.path.join(processed_package_path, *path))
+
+    def test_only_imported_submodules_are_processed(self):
+        import spypackage.first
+        self.assertEqual(str(spypackage.x), 'init')
+        self.assertEqual(str(spypackage.first.x), 'first')
+
+        self.assertTrue(self._is_processed('first.py'))
+        self.assertFalse(self._is_processed('second.py'))
+        self.assertFalse(self._is_processed('subpackage', '__init__.py'))
+
+    def test_subpackage(self):
+        import spypackage.subpackage.third
+        self.assertEqual(str(spypackage.subpackage.third.x), 'third')
+
+        self.assertFalse(self._is_processed('first.py'))
+
+    def test_module_attributes(self):
+        path_before = list(sys.path)
+        import spypackage.first
+
+        self.assertEqual(sys.path, path_before)
+        self.assertEqual(spypackage.__file__, os.path.join(self.spy_dir, 'spypackage', '__init__.spy'))
+        self.assertEqual(spypackage.__path__, [os.path.join(self.spy_dir, 'spypackage')])
+        self.assertEqual(spypackage.first.__file__, os.path.join(self.spy_dir, 'spypackage', 'first.spy'))
+        self.assertEqual(spypackage.first.__package__, 'spypackage')
+
+    def test_cache_not_writable(self):
+        with mock.patch.object(preprocessor, 'preprocess_file', side_effect=OSError):
+            import spypackage.first
+
+        self.assertEqual(str(spypackage.first.x), 'first')
+        self.assertFalse(self._is_processed('first.py'))
+
+    def test_concurrent_imports(self):
+        errors = []
+
+        def import_modules():
+            try:
+                import spypackage.first
+                import spypackage.second
+                import spypackage.subpackage.third
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=import_modules) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(str(sys.modules['spypackage.subpackage.third'].x), 'third')
+
+    @unittest.skipIf(sys.version_info < (3, 3), 'importlib.invalidate_caches is available only in python 3.3+')
+    def test_invalidate_caches(self):
+        with mock.patch.object(locator, 'invalidate_caches') as invalidate_caches_mock:
+            importlib.invalidate_caches()
+
+        self.assertTrue(invalidate_caches_mock.called)
@@ -1,6 +1,9 @@
 import os
 import sys
+import shutil
+import tempfile
 import unittest
+import mock
 from shellpython import locator
 
 
@@ -26,3 +29,74 @@ class TestLocateModule(unittest.TestCase):
         self.assertIsNone(locator.locate_spy_module('testmoduleempty'))
         self.assertIsNone(locator.locate_spy_module('testfilepy'))
         self.assertIsNone(locator.locate_spy_module('non_existent_file'))
+
+    def test_modules_and_files(self):
+        self.assertEqual(locator.locate_spy('testfilespy'), os.path.join(self.test_dir, 'testfilespy.spy'))
+        self.assertEqual(locator.locate_spy('testmodulespy'),
+                         os.path.join(self.test_dir, 'testmodulespy', '__init__.spy'))
+        self.assertIsNone(locator.locate_spy('testmoduleempty'))
+        self.assertIsNone(locator.locate_spy('testfilepy'))
+
+    def test_submodules(self):
+        module_path = locator.locate_spy_module('testmodulespy')
+        self.assertEqual(locator.locate_spy_submodule(module_path, 'submodulespy'),
+                         os.path.join(module_path, 'submodulespy.spy'))
+        self.assertEqual(locator.locate_spy_submodule(module_path, 'subpackagespy'),
+                         os.path.join(module_path, 'subpackagespy', '__init__.spy'))
+        self.assertIsNone(locator.locate_spy_submodule(module_path, 'non_existent_file'))
+        self.assertIsNone(locator.locate_spy_submodule(module_path, 'subpackagespy.non_existent_file'))
+
+
+class TestLocatorCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        sys.path.append(self.test_dir)
+        locator.invalidate_caches()
+
+    def tearDown(self):
+        sys.path.remove(self.test_dir)
+        shutil.rmtree(self.test_dir)
+
+    def _create_file(self, name):
+        with open(os.path.join(self.test_dir, name), 'w') as f:
+            f.write('')
+
+    def test_not_found_is_cached(self):
+        self.assertIsNone(locator.locate_spy_file('cachedfilespy'))
+        self.assertIsNone(locator.locate_spy_module('cachedfilespy'))
+
+        with mock.patch('os.stat') as stat_mock, mock.patch('os.listdir') as listdir_mock:
+            self.assertIsNone(locator.locate_spy_file('cachedfilespy'))
+            self.assertIsNone(locator.locate_spy_module('cachedfilespy'))
+
+            self.assertEqual(stat_mock.call_count, 0)
+            self.assertEqual(listdir_mock.call_count, 0)
+
+    def test_one_stat_per_directory(self):
+        locator.invalidate_caches()
+
+        with mock.patch('os.stat', wraps=os.stat) as stat_mock:
+            self.assertIsNone(locator.locate_spy('uncachedfilespy'))
+
+        self.assertEqual(stat_mock.call_count, len(sys.path))
+
+    def test_invalidate_caches(self):
+        self.assertIsNone(locator.locate_spy_file('cachedfilespy'))
+        self._create_file('cachedfilespy.spy')
+        self.assertIsNone(locator.locate_spy_file('cachedfilespy'))
+
+        locator.invalidate_caches()
+        self.assertEqual(locator.locate_spy_file('cachedfilespy'), os.path.join(self.test_dir, 'cachedfilespy.spy'))
+
+    def test_sys_path_change(self):
+        self.assertIsNone(locator.locate_spy_file('cachedfilespy'))
+        self._create_file('cachedfilespy.spy')
+        # the directory listing is made again if modification time of the directory changes
+        os.utime(self.test_dir, (0, 0))
+
+        sys.path.append(self.test_dir)
+        try:
+            self.assertEqual(locator.locate_spy_file('cachedfilespy'),
+                             os.path.join(self.test_dir, 'cachedfilespy.spy'))
+        finally:
+            sys.path.pop()
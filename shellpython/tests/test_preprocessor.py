@@ -1,141 +1,208 @@
 import unittest
 import getpass
 import tempfile
+import shutil
+import json
 import os.path
+import runpy
 import mock
-from shellpython import preprocessor
+from shellpython import importer, preprocessor
+from shellpython.constants import SHELLPY_VERSION
 
 
 class TestCodeStart(unittest.TestCase):
     def test_simple(self):
         cmd = 'x = `echo 1'
-        intermediate = preprocessor._process_code_start(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe()shexe')
 
     def test_very_simple(self):
         cmd = '`echo 1'
-        intermediate = preprocessor._process_code_start(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'start_shexe(echo 1)shexe()shexe')
 
     def test_with_param(self):
         cmd = 'x = p`echo 1'
-        intermediate = preprocessor._process_code_start(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe(p)shexe')
 
     def test_multiline(self):
         cmd = 'i = 1\nx = `echo 1\ni = 2'
-        intermediate = preprocessor._process_code_start(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'i = 1\nx = start_shexe(echo 1)shexe()shexe\ni = 2')
 
     def test_no_false_positive_both(self):
         cmd = 'x = `echo 1`'
-        intermediate = preprocessor._process_code_start(cmd)
-        self.assertEqual(intermediate, 'x = `echo 1`')
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = both_shexe(echo 1)shexe()shexe')
 
 
 class TestCodeBoth(unittest.TestCase):
     def test_simple(self):
         cmd = 'x = `echo 1`'
-        intermediate = preprocessor._process_code_both(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = both_shexe(echo 1)shexe()shexe')
 
     def test_very_simple(self):
         cmd = '`echo 1`'
-        intermediate = preprocessor._process_code_both(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'both_shexe(echo 1)shexe()shexe')
 
     def test_with_param(self):
         cmd = 'x = p`echo 1`'
-        intermediate = preprocessor._process_code_both(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = both_shexe(echo 1)shexe(p)shexe')
 
     def test_multiline(self):
         cmd = 'i = 1\nx = `echo 1`\ni = 2'
-        intermediate = preprocessor._process_code_both(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'i = 1\nx = both_shexe(echo 1)shexe()shexe\ni = 2')
 
     def test_no_false_positive_start(self):
         cmd = 'x = `echo 1'
-        intermediate = preprocessor._process_code_both(cmd)
-        self.assertEqual(intermediate, 'x = `echo 1')
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe()shexe')
 
 
 class TestLongLines(unittest.TestCase):
     def test_simple_two_lines(self):
         cmd = 'x = `echo Very \\\n long line'
-        intermediate = preprocessor._process_long_lines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = longline_shexe(echo Very \\\n long line)shexe()shexe')
 
     def test_very_simple_two_lines(self):
         cmd = '`echo Very \\\n long line'
-        intermediate = preprocessor._process_long_lines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'longline_shexe(echo Very \\\n long line)shexe()shexe')
 
     def test_simple_three_lines(self):
         cmd = 'x = `echo Very \\\n long \\\n line'
-        intermediate = preprocessor._process_long_lines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = longline_shexe(echo Very \\\n long \\\n line)shexe()shexe')
 
     def test_simple_two_lines_with_param(self):
         cmd = 'x = p`echo Very \\\n long line'
-        intermediate = preprocessor._process_long_lines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = longline_shexe(echo Very \\\n long line)shexe(p)shexe')
 
     def test_no_false_positive_start(self):
         cmd = 'x = `echo 1'
-        intermediate = preprocessor._process_long_lines(cmd)
-        self.assertEqual(intermediate, 'x = `echo 1')
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe()shexe')
 
 
 class TestMultiline(unittest.TestCase):
     def test_simple_one_line(self):
         cmd = 'x = `\necho 1\n`'
-        intermediate = preprocessor._process_multilines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = multiline_shexe(echo 1; \\\n)shexe()shexe')
 
     def test_simple_one_line_with_param(self):
         cmd = 'x = p`\necho 1\n`'
-        intermediate = preprocessor._process_multilines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = multiline_shexe(echo 1; \\\n)shexe(p)shexe')
 
     def test_very_simple_one_line(self):
         cmd = '`\necho 1\n`'
-        intermediate = preprocessor._process_multilines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'multiline_shexe(echo 1; \\\n)shexe()shexe')
 
     def test_simple_two_lines(self):
         cmd = 'x = `\necho 1\necho 2\n`'
-        intermediate = preprocessor._process_multilines(cmd)
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
         self.assertEqual(intermediate, 'x = multiline_shexe(echo 1; \\\necho 2; \\\n)shexe()shexe')
 
     def test_no_false_positive_start(self):
         cmd = 'x = `echo 1'
-        intermediate = preprocessor._process_multilines(cmd)
-        self.assertEqual(intermediate, 'x = `echo 1')
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe()shexe')
 
     def test_no_false_positive_both(self):
         cmd = 'x = `echo 1`'
-        intermediate = preprocessor._process_multilines(cmd)
-        self.assertEqual(intermediate, 'x = `echo 1`')
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = both_shexe(echo 1)shexe()shexe')
 
 
 class TestEscape(unittest.TestCase):
     def test_escape_nothing(self):
-        intermediate = 'x = start_shexe(echo 1)shexe()shexe'
-        escaped = preprocessor._escape(intermediate)
-        self.assertEqual(escaped, intermediate)
+        intermediate = preprocessor._preprocess_code_to_intermediate('x = `echo 1')
+        self.assertEqual(intermediate, 'x = start_shexe(echo 1)shexe()shexe')
 
     def test_escape_quote(self):
-        intermediate = 'x = start_shexe(echo \'1\')shexe()shexe'
-        escaped = preprocessor._escape(intermediate)
-        self.assertEqual(escaped, 'x = start_shexe(echo \\\'1\\\')shexe()shexe')
+        intermediate = preprocessor._preprocess_code_to_intermediate('x = `echo \'1\'')
+        self.assertEqual(intermediate, 'x = start_shexe(echo \\\'1\\\')shexe()shexe')
+
+
+class TestScan(unittest.TestCase):
+    def test_strings_and_comments(self):
+        code = 'x = "`echo 1`" + \'`echo 2\'  # `echo 3`\ny = """\n`echo 4`\n""" + `echo 5`\n'
+        intermediate = preprocessor._preprocess_code_to_intermediate(code)
+        self.assertEqual(intermediate, 'x = "`echo 1`" + \'`echo 2\'  # `echo 3`\n'
+                                       'y = """\n`echo 4`\n""" + both_shexe(echo 5)shexe()shexe\n')
+
+    def test_escaped_quote_in_string(self):
+        code = 'x = \'it\\\'s `echo 1`\' + `echo 2`'
+        intermediate = preprocessor._preprocess_code_to_intermediate(code)
+        self.assertEqual(intermediate, 'x = \'it\\\'s `echo 1`\' + both_shexe(echo 2)shexe()shexe')
+
+    def test_same_expressions(self):
+        cmd = 'x = `echo \'1\'`\ny = `echo \'1\'`'
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = both_shexe(echo \\\'1\\\')shexe()shexe\n'
+                                       'y = both_shexe(echo \\\'1\\\')shexe()shexe')
+
+    def test_multiline_empty_line(self):
+        cmd = 'x = `\necho 1\n\necho 2\n`'
+        intermediate = preprocessor._preprocess_code_to_intermediate(cmd)
+        self.assertEqual(intermediate, 'x = multiline_shexe(echo 1; \\\n\\\necho 2; \\\n)shexe()shexe')
+
+    def test_final_same_as_intermediate(self):
+        cur_dir = os.path.split(__file__)[0]
+        with open(os.path.join(cur_dir, 'data', 'preprocessor', 'test.spy')) as f:
+            code = f.read()
+
+        intermediate = preprocessor._preprocess_code_to_intermediate(code)
+        self.assertEqual(preprocessor._preprocess_code(code), preprocessor._intermediate_to_final(intermediate))
 
 
 class TestIntermediateToFinal(unittest.TestCase):
     def test_common(self):
-        intermediate = 'x = int_shexe(expr)shexe(param)shexe'
+        intermediate = 'x = int_shexe(expr)shexe(pe)shexe'
+        final = preprocessor._intermediate_to_final(intermediate)
+        self.assertEqual(final, "x = exe('expr','pe')")
+
+    def test_async(self):
+        intermediate = 'x = await int_shexe(expr)shexe(ap)shexe'
         final = preprocessor._intermediate_to_final(intermediate)
-        self.assertEqual(final, "x = exe('expr'.format(**dict(locals(), **globals())),'param')")
+        self.assertEqual(final, "x = await aexe('expr','ap')")
+
+    def test_variables(self):
+        intermediate = 'x = int_shexe(echo {b} {a.name} {c[0]:>{width}} {b!r})shexe()shexe'
+        final = preprocessor._intermediate_to_final(intermediate)
+        self.assertEqual(final, "x = exe('echo {b} {a.name} {c[0]:>{width}} {b!r}'.format(a=a, b=b, c=c, "
+                                "width=width),'')")
+
+    def test_escaped_braces(self):
+        intermediate = 'x = int_shexe(echo {{b}})shexe()shexe'
+        final = preprocessor._intermediate_to_final(intermediate)
+        self.assertEqual(final, "x = exe('echo {{b}}'.format(),'')")
+
+    def test_escaped_quote(self):
+        intermediate = "x = int_shexe(echo \\'{b}\\')shexe()shexe"
+        final = preprocessor._intermediate_to_final(intermediate)
+        self.assertEqual(final, "x = exe('echo \\'{b}\\''.format(b=b),'')")
+
+    def test_not_variables(self):
+        for cmd in ['echo {}', 'echo {0}', 'echo {if}', "awk '{print $1}'", 'echo }']:
+            intermediate = 'x = int_shexe(' + cmd + ')shexe()shexe'
+            final = preprocessor._intermediate_to_final(intermediate)
+            self.assertEqual(final, "x = exe('" + cmd + "'.format(**dict(locals(), **globals())),'')")
+
+    def test_execution(self):
+        final = preprocessor._intermediate_to_final('int_shexe({b} {a.real} {{c}})shexe()shexe')
+        a, b = 1, 'text'
+        exe = lambda cmd, params: cmd
+        self.assertEqual(eval(final), 'text 1 {c}')
 
 
 class TestFileOperations(unittest.TestCase):
@@ -148,35 +215,157 @@ class TestFileOperations(unittest.TestCase):
         self.assertEqual(translated_path, expected_path)
 
 
-class TestMeta(unittest.TestCase):
+class CacheTestCase(unittest.TestCase):
+    """Base class for tests that process files, it isolates the cache of processed files in a temporary directory
+    """
     def setUp(self):
-        cur_dir = os.path.split(__file__)[0]
-        self.test_dir = os.path.join(cur_dir, 'data', 'preprocessor')
-
-    @mock.patch('os.path.getmtime', return_value=1111111111.11)
-    def test_is_compilation_needed_time_match(self, getmtime_mock_arg):
-        compilation_needed = preprocessor._is_compilation_needed('mocked_spy_file',
-                                                                 os.path.join(self.test_dir, 'meta.py'))
-        self.assertFalse(compilation_needed)
-
-    @mock.patch('os.path.getmtime', return_value=0)
-    def test_is_compilation_needed_time_not_match(self, getmtime_mock_arg):
-        compilation_needed = preprocessor._is_compilation_needed('mocked_spy_file',
-                                                                 os.path.join(self.test_dir, 'meta.py'))
-        self.assertTrue(compilation_needed)
+        self.spy_dir = tempfile.mkdtemp()
+        self.cache_root = tempfile.mkdtemp()
+        self.spy_file = os.path.join(self.spy_dir, 'script.spy')
+        with open(self.spy_file, 'w') as f:
+            f.write('x = `echo 1\n')
+
+        patchers = [mock.patch.object(preprocessor, '_get_cache_root', return_value=self.cache_root),
+                    mock.patch.object(preprocessor, '_manifest', None),
+                    mock.patch.object(preprocessor, '_changed_manifest_entries', set())]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
+    def tearDown(self):
+        shutil.rmtree(self.spy_dir)
+        shutil.rmtree(self.cache_root)
+
+    def _reset_manifest(self):
+        preprocessor._manifest = None
+
+    def _preprocess(self, is_root_script, python_version=None):
+        with mock.patch.object(preprocessor, '_preprocess_code', wraps=preprocessor._preprocess_code) as m:
+            preprocessor.preprocess_file(self.spy_file, is_root_script, python_version)
+            return m.called
+
+
+class TestManifest(CacheTestCase):
     def test_is_compilation_needed_out_does_not_exist(self):
-        compilation_needed = preprocessor._is_compilation_needed('mocked_spy_file',
-                                                                 'non_existing_py_file')
+        compilation_needed = preprocessor._is_compilation_needed(self.spy_file, 'non_existing_py_file')
         self.assertTrue(compilation_needed)
 
+    def test_manifest_is_saved(self):
+        self.assertTrue(self._preprocess(False))
+        self._reset_manifest()
+        self.assertFalse(self._preprocess(False))
+
+        with open(os.path.join(self.cache_root, 'manifest.json')) as f:
+            entry = json.load(f)['files'][os.path.abspath(self.spy_file)]
+
+        self.assertEqual(entry['size'], os.path.getsize(self.spy_file))
+        self.assertEqual(entry['version'], SHELLPY_VERSION)
+        self.assertEqual(entry['header'], 'module')
+
+    def test_content_changed(self):
+        self.assertTrue(self._preprocess(False))
+        with open(self.spy_file, 'w') as f:
+            f.write('x = `echo 2\n')
+
+        self.assertTrue(self._preprocess(False))
+
+    def test_mtime_changed_content_same(self):
+        self.assertTrue(self._preprocess(False))
+        os.utime(self.spy_file, (0, 0))
+
+        self.assertFalse(self._preprocess(False))
+
+    def test_mtime_same_content_changed(self):
+        self.assertTrue(self._preprocess(False))
+        mtime = os.path.getmtime(self.spy_file)
+        with open(self.spy_file, 'w') as f:
+            f.write('x = `echo 2\n')
+        os.utime(self.spy_file, (mtime, mtime))
+
+        self.assertTrue(self._preprocess(False))
+
+    def test_version_changed(self):
+        self.assertTrue(self._preprocess(False))
+
+        with mock.patch.object(preprocessor, 'SHELLPY_VERSION', 'other'):
+            self.assertTrue(self._preprocess(False))
+
+    def test_manifest_merged_with_other_process(self):
+        other_spy_file = os.path.join(self.spy_dir, 'other.spy')
+        with open(other_spy_file, 'w') as f:
+            f.write('x = `echo 1\n')
+
+        preprocessor._load_manifest()
+        preprocessor.preprocess_file(other_spy_file, is_root_script=False)
+
+        # the manifest was loaded before the other file was processed, as if it was processed by another process
+        preprocessor._manifest = {}
+        self.assertTrue(self._preprocess(False))
+
+        self._reset_manifest()
+        self.assertIn(os.path.abspath(other_spy_file), preprocessor._load_manifest())
+        self.assertIn(os.path.abspath(self.spy_file), preprocessor._load_manifest())
+
+
+class TestPreprocessFile(CacheTestCase):
+    def test_cache_dirs_are_private(self):
+        path = os.path.join(self.cache_root, 'parent', 'child')
+        preprocessor._make_private_dirs(path)
+        preprocessor._make_private_dirs(path)
+
+        for created_path in (path, os.path.dirname(path)):
+            self.assertEqual(os.stat(created_path).st_mode & 0o777, 0o700)
+
+    def test_root_script_is_cached(self):
+        self.assertTrue(self._preprocess(True, 3))
+        self.assertFalse(self._preprocess(True, 3))
+
+    def test_header_change_recompiles(self):
+        self.assertTrue(self._preprocess(True, 3))
+        self.assertTrue(self._preprocess(True, 2))
+        self.assertTrue(self._preprocess(False))
+        self.assertFalse(self._preprocess(False))
+        self.assertTrue(self._preprocess(True, 2))
+
+    @mock.patch('sys.dont_write_bytecode', False)
+    def test_bytecode_is_written(self):
+        out_filename = preprocessor.preprocess_file(self.spy_file, is_root_script=False)
+        bytecode_path = preprocessor.cache_from_source(out_filename)
+
+        self.assertTrue(os.path.exists(bytecode_path))
+        self.assertEqual(preprocessor.compile_bytecode(out_filename), bytecode_path)
+
+    @mock.patch('sys.dont_write_bytecode', False)
+    def test_bytecode_of_changed_source(self):
+        # the new source has the same size and most likely the same modification time in seconds
+        for value in ('A', 'B'):
+            with open(self.spy_file, 'w') as f:
+                f.write('x = "{0}"\n'.format(value))
+
+            out_filename = preprocessor.preprocess_file(self.spy_file, is_root_script=False)
+
+        bytecode_path = preprocessor.compile_bytecode(out_filename)
+        namespace = {}
+        exec(importer.ShellpyLoader('script', self.spy_file).get_code('script'), namespace)
+
+        self.assertEqual(namespace['x'], 'B')
+        # root scripts are executed from the bytecode file directly
+        self.assertEqual(runpy.run_path(bytecode_path)['x'], 'B')
+
+    @mock.patch('sys.dont_write_bytecode', False)
+    def test_bytecode_of_invalid_code(self):
+        with open(self.spy_file, 'w') as f:
+            f.write('x = (\n')
+
+        out_filename = preprocessor.preprocess_file(self.spy_file, is_root_script=False)
+        self.assertIsNone(preprocessor.compile_bytecode(out_filename))
+
 
 class TestEncoding(unittest.TestCase):
 
     def setUp(self):
         self.header_text = '''#!/usr/bin/env python
 #shellpy-encoding
-#shellpy-meta:{meta}
 
 import sys
 import os
@@ -184,7 +373,6 @@ import os
 
         self.header_text_with_encoding = '''#!/usr/bin/env python
 # -*- coding: utf-8 -*-
-#shellpy-meta:{meta}
 
 import sys
 import os
@@ -0,0 +1,94 @@
+import os
+import sys
+import stat
+import shutil
+import signal
+import socket
+import tempfile
+import subprocess
+import unittest
+from shellpython import server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@unittest.skipIf(not server.is_supported(), 'shellpy server requires unix and python 3.3+')
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.work_dir, 'server.sock')
+
+        self.env = os.environ.copy()
+        self.env['PYTHONPATH'] = REPO_ROOT
+        self.env['SHELLPY_CACHE_DIR'] = os.path.join(self.work_dir, 'cache')
+
+        self.script = os.path.join(self.work_dir, 'script.spy')
+        with open(self.script, 'w') as f:
+            f.write('import os, sys\n'
+                    'print(sys.argv[1:])\n'
+                    'print(os.getcwd())\n'
+                    'print(os.environ["SHELLPY_TEST_VARIABLE"])\n'
+                    'print(`echo from shell`)\n'
+                    'sys.exit(3)\n')
+
+        self.server = subprocess.Popen([sys.executable, '-c', 'from shellpython import server; '
+                                                              'server.serve({0!r})'.format(self.socket_path)],
+                                       env=self.env, stdout=subprocess.PIPE)
+        # the server prints the line when it is ready
+        self.server.stdout.readline()
+
+    def tearDown(self):
+        self.server.send_signal(signal.SIGINT)
+        self.server.wait()
+        self.server.stdout.close()
+        shutil.rmtree(self.work_dir)
+
+    def _run_client(self, *args, **env_variables):
+        env = dict(self.env, SHELLPY_TEST_VARIABLE='client value', **env_variables)
+        code = 'import sys; sys.argv = sys.argv[1:]; from shellpython import client; client.main3()'
+        process = subprocess.Popen([sys.executable, '-c', code, 'shellpy3-client'] + list(args),
+                                   env=env, cwd=self.work_dir, stdout=subprocess.PIPE)
+        stdout, _ = process.communicate()
+        return process.returncode, stdout.decode('utf-8').splitlines()
+
+    def test_script_is_executed_by_server(self):
+        returncode, lines = self._run_client('--socket', self.socket_path, self.script, 'a b', 'c')
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(lines, ["['a b', 'c']", os.path.realpath(self.work_dir), 'client value', 'from shell'])
+
+    def test_client_python_path(self):
+        library_dir = os.path.join(self.work_dir, 'library')
+        os.mkdir(library_dir)
+        with open(os.path.join(library_dir, 'client_module.py'), 'w') as f:
+            f.write('VALUE = "from client path"\n')
+
+        script = os.path.join(self.work_dir, 'import_script.spy')
+        with open(script, 'w') as f:
+            f.write('import client_module\n'
+                    'print(client_module.VALUE)\n')
+
+        # the library is not in the path of the server, only in the path of the client
+        returncode, lines = self._run_client('--socket', self.socket_path, script,
+                                             PYTHONPATH=REPO_ROOT + os.pathsep + library_dir)
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(lines, ['from client path'])
+
+    def test_fallback_without_server(self):
+        missing_socket_path = os.path.join(self.work_dir, 'missing.sock')
+        returncode, lines = self._run_client('--socket', missing_socket_path, self.script, 'a', 'c')
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(lines[2:], ['client value', 'from shell'])
+
+    def test_socket_is_private(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_peer_uid(self):
+        first, second = socket.socketpair()
+        try:
+            self.assertEqual(server._get_peer_uid(first), os.getuid())
+        finally:
+            first.close()
+            second.close()
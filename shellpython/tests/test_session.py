@@ -0,0 +1,85 @@
+import os
+import threading
+import unittest
+import mock
+
+from shellpython import core, session
+
+
+@mock.patch('shellpython.config.SESSION_EXECUTION', True)
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        self.addCleanup(session.close_session)
+
+    def test_result(self):
+        result = core.exe('echo 1; echo 2; printf err 1>&2', '')
+
+        self.assertEqual(result.stdout_lines, ['1', '2'])
+        self.assertEqual(result.stderr, 'err')
+        self.assertEqual(result.returncode, 0)
+
+    def test_output_without_line_separator(self):
+        self.assertEqual(core.exe('printf 1', '').stdout, '1')
+        self.assertEqual(core.exe('true', '').stdout_lines, [])
+
+    def test_failure(self):
+        with self.assertRaises(core.NonZeroReturnCodeError) as cm:
+            core.exe('cat non_existent_file', '')
+
+        self.assertNotEqual(cm.exception.result.returncode, 0)
+        self.assertEqual(core.exe('echo "unclosed', 'n').returncode, 2)
+
+    def test_state_persists(self):
+        core.exe('cd /; export SHELLPY_TEST=1; x="a b"', '')
+
+        self.assertEqual(core.exe('pwd; echo $SHELLPY_TEST; echo $x', '').stdout_lines, ['/', '1', 'a b'])
+        self.assertNotIn('SHELLPY_TEST', os.environ)
+
+    def test_python_changes_are_passed(self):
+        core.exe('true', '')
+
+        os.chdir('/')
+        os.environ['SHELLPY_TEST'] = "it's"
+
+        self.assertEqual(core.exe('pwd; echo "$SHELLPY_TEST"', '').stdout_lines, ['/', "it's"])
+
+    def test_exit(self):
+        result = core.exe('echo 1; exit 3', 'n')
+
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.stdout, '1')
+        self.assertEqual(core.exe('echo 2', '').stdout, '2')
+
+    def test_stdin(self):
+        self.assertEqual(core.exe('cat; echo 1', '').stdout, '1')
+
+    def test_big_output(self):
+        # errors of yes about the closed pipe are dropped, children of python 2 ignore SIGPIPE
+        result = core.exe('yes out 2>/dev/null | head -n 400000; yes err 2>/dev/null | head -n 400000 1>&2', '')
+
+        self.assertEqual(len(result.stdout_lines), 400000)
+        self.assertEqual(len(result.stderr_lines), 400000)
+
+    def test_thread_sessions(self):
+        core.exe('x=main', '')
+        results = []
+
+        thread = threading.Thread(target=lambda: results.append(core.exe('echo "[$x]"', '').stdout))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(results, ['[]'])
+        self.assertEqual(core.exe('echo "[$x]"', '').stdout, '[main]')
+
+    def test_other_modes_use_new_process(self):
+        core.exe('x=1', '')
+
+        self.assertEqual(core.exe('echo "[$x]"', 'd').stdout, '[$x]')
+        self.assertEqual(list(core.exe('echo "[$x]"', 's')), ['[]'])
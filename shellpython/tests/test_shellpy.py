@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import mock
+from shellpython import config, preprocessor, shellpy
+from shellpython.constants import SHELLPY_CACHE_DIR, SHELLPY_PARAMS
+
+
+class TestCompile(unittest.TestCase):
+    def setUp(self):
+        self.spy_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+
+        os.makedirs(os.path.join(self.spy_dir, 'package'))
+        self.spy_files = [os.path.join(self.spy_dir, 'script.spy'),
+                          os.path.join(self.spy_dir, 'package', '__init__.spy'),
+                          os.path.join(self.spy_dir, 'package', 'module.spy')]
+        for spy_file in self.spy_files:
+            with open(spy_file, 'w') as f:
+                f.write('x = `echo 1\n')
+
+        patchers = [mock.patch.dict(os.environ),
+                    mock.patch.object(preprocessor, '_manifest', None),
+                    mock.patch.object(preprocessor, '_changed_manifest_entries', set())]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.spy_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def _read_manifest(self):
+        with open(os.path.join(self.cache_dir, 'manifest.json')) as f:
+            return json.load(f)['files']
+
+    def _compile(self, *args):
+        return shellpy.compile_main(['--cache-dir', self.cache_dir] + list(args) + [self.spy_dir], 3)
+
+    def test_compile(self):
+        self.assertEqual(self._compile(), 0)
+
+        self.assertEqual(os.environ[SHELLPY_CACHE_DIR], self.cache_dir)
+        manifest = self._read_manifest()
+        for spy_file in self.spy_files:
+            self.assertTrue(os.path.exists(preprocessor._translate_to_temp_path(spy_file[:-len('.spy')] + '.py')))
+            self.assertEqual(manifest[os.path.abspath(spy_file)]['header'], 'module')
+
+    def test_compile_parallel(self):
+        self.assertEqual(self._compile('-j', '2', '--root'), 0)
+
+        manifest = self._read_manifest()
+        self.assertEqual(sorted(manifest), sorted(os.path.abspath(spy_file) for spy_file in self.spy_files))
+        for entry in manifest.values():
+            self.assertEqual(entry['header'], 'root3')
+
+    def test_compile_failure(self):
+        with open(self.spy_files[0], 'w') as f:
+            f.write('x = (\n')
+
+        self.assertEqual(self._compile(), 1)
+        self.assertIn(os.path.abspath(self.spy_files[2]), self._read_manifest())
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.script = os.path.join(self.work_dir, 'script.spy')
+        with open(self.script, 'w') as f:
+            f.write('import sys\n'
+                    'from shellpython import config\n'
+                    'print(sys.argv[1:])\n'
+                    'print(config.PRINT_ALL_COMMANDS)\n'
+                    'sys.exit(3)\n')
+
+        self.env = os.environ.copy()
+        self.env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.env[SHELLPY_CACHE_DIR] = os.path.join(self.work_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _run(self, code, *args):
+        process = subprocess.Popen([sys.executable, '-c', code, 'shellpy'] + list(args), env=self.env,
+                                   stdout=subprocess.PIPE)
+        stdout, _ = process.communicate()
+        return process.returncode, stdout.decode('utf-8').splitlines()
+
+    def test_in_process(self):
+        code = 'import sys; sys.argv = sys.argv[1:]; from shellpython import shellpy; shellpy.main({0})'.format(
+            sys.version_info[0])
+        returncode, lines = self._run(code, '-v', self.script, 'a b', 'c')
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(lines, ["['a b', 'c']", 'True'])
+
+    def test_in_process_inherited_config(self):
+        # the config of a parent shellpy process must not override the arguments
+        self.env[SHELLPY_PARAMS] = config.dumps()
+        code = 'import sys; sys.argv = sys.argv[1:]; from shellpython import shellpy; shellpy.main({0})'.format(
+            sys.version_info[0])
+        returncode, lines = self._run(code, '-v', self.script)
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(lines, ['[]', 'True'])
+
+    def test_new_process(self):
+        code = 'import sys; from shellpython import shellpy; sys.exit(shellpy._execute(sys.argv[2], sys.argv[3:], {0}))'
+        returncode, lines = self._run(code.format(sys.version_info[0]), self.script, 'a b', 'c')
+
+        self.assertEqual(returncode, 3)
+        self.assertEqual(lines, ["['a b', 'c']", 'False'])
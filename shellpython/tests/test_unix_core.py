@@ -1,3 +1,10 @@
+import io
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import mock
 
@@ -82,6 +89,31 @@ class TestExecute(unittest.TestCase):
 
         self.assertEqual(len(self.stdout_mock.lines), 0)
 
+    def test_big_stdout_and_stderr(self):
+        # every stream gets much more data than a pipe buffer may hold and stderr is written while stdout is open.
+        # Children of python 2 ignore SIGPIPE, so yes reports the closed pipe to stderr, which is dropped
+        cmd = ('yes out 2>/dev/null | head -n 400000; yes err 2>/dev/null | head -n 400000 1>&2; '
+               'yes out 2>/dev/null | head -n 400000')
+        results = []
+
+        worker = threading.Thread(target=lambda: results.append(core._create_result(cmd, '')))
+        worker.daemon = True
+        worker.start()
+        worker.join(60)
+
+        self.assertFalse(worker.is_alive(), 'reading of stdout and stderr is deadlocked')
+
+        result = results[0]
+        self.assertEqual(len(result.stdout_lines), 800000)
+        self.assertEqual(len(result.stderr_lines), 400000)
+        self.assertEqual(result.stdout_lines[-1], 'out')
+        self.assertEqual(result.stderr_lines[0], 'err')
+
+    def test_line_split_over_chunks(self):
+        result = core._create_result('printf "%070000d\\n2\\n3"', '')
+
+        self.assertEqual(result.stdout_lines, ['0' * 70000, '2', '3'])
+
     def test_exe(self):
         result = core.exe('echo 1', '')
 
@@ -113,6 +145,159 @@ class TestExecute(unittest.TestCase):
 
         self.assertEqual(len(self.stderr_mock.lines), 0)
 
+    def test_stream(self):
+        result = core.exe('echo 1; echo 2', 's')
+
+        self.assertEqual(list(result), ['1', '2'])
+        self.assertEqual(result.returncode, 0)
+
+        self.assertEqual(len(self.stdout_mock.lines), 0)
+
+    def test_stream_param_p(self):
+        list(core.exe('echo 1; echo 2', 'sp'))
+
+        self.assertEqual(self.stdout_mock.lines, ['1', '2'])
+
+    def test_stream_failure(self):
+        result = core.exe('echo 1; cat non_existent_file', 's')
+
+        with self.assertRaises(core.NonZeroReturnCodeError) as cm:
+            for line in result:
+                self.assertEqual(line, '1')
+
+        self.assertNotEqual(cm.exception.result.returncode, 0)
+        self.assertGreater(len(cm.exception.result.stderr), 0)
+
+    def test_stream_failure_no_throw(self):
+        result = core.exe('echo 1; cat non_existent_file', 'sn')
+
+        self.assertEqual(list(result), ['1'])
+        self.assertNotEqual(result.returncode, 0)
+
+    def test_stream_stop_iteration_early(self):
+        result = core.exe('yes', 's')
+
+        for index, line in enumerate(result):
+            if index == 2:
+                break
+
+        self.assertIsNotNone(result.returncode)
+
+    def test_stream_stop_kills_children(self):
+        for cmd in ('echo first; sleep 10', 'echo first; sleep 10 | cat'):
+            start = time.time()
+            for _ in core.exe(cmd, 's'):
+                break
+
+            self.assertLess(time.time() - start, 5)
+
+    def test_stream_stop_terminates_cleanly(self):
+        marker_file = tempfile.NamedTemporaryFile(delete=False)
+        marker_file.close()
+        self.addCleanup(os.remove, marker_file.name)
+
+        cmd = 'trap "echo cleaned > {0}; exit 1" TERM; echo first; while true; do sleep 0.05; done'
+        for _ in core.exe(cmd.format(marker_file.name), 's'):
+            break
+
+        with open(marker_file.name) as f:
+            self.assertEqual(f.read(), 'cleaned\n')
+
+    def test_stream_stop_kills_after_grace_period(self):
+        start = time.time()
+        # SIGTERM is ignored by the shell and by sleep that inherits it
+        for _ in core.exe('trap "" TERM; echo first; sleep 10', 's'):
+            break
+
+        self.assertGreaterEqual(time.time() - start, core._TERMINATE_GRACE_PERIOD)
+        self.assertLess(time.time() - start, 5)
+
+    def test_background(self):
+        job = core.exe('sleep 0.3; echo 1', 'b')
+        self.assertIsNone(job.poll())
+
+        self.assertEqual(job.wait(), 0)
+        self.assertEqual(job.poll(), 0)
+        self.assertEqual(job.result().stdout, '1')
+
+    def test_background_concurrent(self):
+        start = time.time()
+        jobs = [core.exe('sleep 0.5; echo {}'.format(i), 'b') for i in range(10)]
+
+        results = core.wait_all(jobs)
+
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual([str(result) for result in results], [str(i) for i in range(10)])
+
+    def test_background_failure(self):
+        job = core.exe('cat non_existent_file', 'b')
+
+        self.assertNotEqual(job.wait(), 0)
+        with self.assertRaises(core.NonZeroReturnCodeError):
+            job.result()
+
+        self.assertNotEqual(core.exe('cat non_existent_file', 'bn').result().returncode, 0)
+
+    def test_background_big_output(self):
+        # errors of yes about the closed pipe are dropped, children of python 2 ignore SIGPIPE
+        job = core.exe('yes 2>/dev/null | head -n 400000; yes 2>/dev/null | head -n 400000 1>&2', 'b')
+
+        self.assertEqual(job.wait(60), 0)
+        self.assertEqual(len(job.result().stderr_lines), 400000)
+
+    def test_background_wait_timeout(self):
+        job = core.exe('exec sleep 10', 'b')
+
+        self.assertIsNone(job.wait(0.1))
+
+        job.kill()
+        self.assertNotEqual(job.wait(), 0)
+
+    def test_background_kill_children(self):
+        for cmd in ('sleep 10; echo done', 'sleep 10 | cat'):
+            start = time.time()
+            job = core.exe(cmd, 'b')
+            job.kill()
+
+            self.assertNotEqual(job.wait(), 0)
+            self.assertLess(time.time() - start, 5)
+
+    def test_background_as_completed(self):
+        slow = core.exe('sleep 0.6', 'b')
+        fast = core.exe('sleep 0.1', 'b')
+
+        self.assertEqual(list(core.as_completed([slow, fast])), [fast, slow])
+
+    def test_direct(self):
+        result = core.exe("printf '%s|%s' a b", 'd')
+
+        self.assertEqual(result.stdout, 'a|b')
+
+    @mock.patch('shellpython.config.DIRECT_EXECUTION', True)
+    def test_direct_execution_config(self):
+        self.assertEqual(core.exe('printf "%s %s" 1 2', '').stdout, '1 2')
+        self.assertEqual(core.exe('printf 1 | cat', '').stdout, '1')
+
+    @mock.patch('shellpython.config.DIRECT_EXECUTION', True)
+    def test_direct_execution_config_not_found(self):
+        result = core.exe('non_existent_command', 'n')
+
+        self.assertEqual(result.returncode, 127)
+        self.assertGreater(len(result.stderr), 0)
+
+    def test_split_simple_command(self):
+        self.assertEqual(core._split_simple_command('ls -l "my dir"'), ['ls', '-l', 'my dir'])
+        self.assertEqual(core._split_simple_command('git log --format=%H'), ['git', 'log', '--format=%H'])
+
+        self.assertIsNone(core._split_simple_command('ls | grep x'))
+        self.assertIsNone(core._split_simple_command('ls $HOME'))
+        self.assertIsNone(core._split_simple_command('ls *.py'))
+        self.assertIsNone(core._split_simple_command('cd /tmp'))
+        self.assertIsNone(core._split_simple_command('echo 1'))
+        self.assertIsNone(core._split_simple_command('A=1 env'))
+        self.assertIsNone(core._split_simple_command('ls "unclosed'))
+        self.assertIsNone(core._split_simple_command(''))
+
     @mock.patch('shellpython.config.PRINT_ALL_COMMANDS', True)
     @mock.patch('shellpython.config.COLORAMA_ENABLED', False)
     def test_config_print_all(self):
@@ -121,3 +306,306 @@ class TestExecute(unittest.TestCase):
         self.assertEqual(len(self.stdout_mock.lines), 1)
         self.assertEqual(self.stdout_mock.lines[0], '>>> echo 1')
 
+    def test_timeout(self):
+        start = time.time()
+        with self.assertRaises(core.CommandTimeoutError) as cm:
+            core.exe('echo 1; sleep 10', '', timeout=0.3)
+
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(cm.exception.timeout, 0.3)
+        self.assertEqual(cm.exception.result.stdout, '1')
+        self.assertNotEqual(cm.exception.result.returncode, 0)
+
+    def test_timeout_kills_process_group(self):
+        pid_file = tempfile.NamedTemporaryFile(delete=False)
+        pid_file.close()
+        self.addCleanup(os.remove, pid_file.name)
+
+        # the background sleep is not a child of python and keeps stdout open after the shell is killed
+        with self.assertRaises(core.CommandTimeoutError):
+            core.exe('sleep 10 & echo $! > {0}; wait'.format(pid_file.name), '', timeout=0.3)
+
+        with open(pid_file.name) as f:
+            pid = int(f.read())
+        self.assertFalse(self._is_running(pid))
+
+    def test_interrupt_kills_process_group(self):
+        pid_file = tempfile.NamedTemporaryFile(delete=False)
+        pid_file.close()
+        self.addCleanup(os.remove, pid_file.name)
+
+        # the command is in its own process group because of the timeout, so SIGINT reaches only python
+        interrupt = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGINT))
+        interrupt.start()
+        with self.assertRaises(KeyboardInterrupt):
+            core.exe('sleep 10 & echo $! > {0}; wait'.format(pid_file.name), '', timeout=120)
+
+        with open(pid_file.name) as f:
+            pid = int(f.read())
+        self.assertFalse(self._is_running(pid))
+
+    @classmethod
+    def _is_running(cls, pid):
+        # the killed process may still be exiting for a moment, the killed orphan may stay a zombie if nobody reaps it
+        deadline = time.time() + 2
+        while cls._get_state(pid) not in (None, 'Z') and time.time() < deadline:
+            time.sleep(0.01)
+
+        return cls._get_state(pid) not in (None, 'Z')
+
+    @staticmethod
+    def _get_state(pid):
+        try:
+            with open('/proc/{0}/stat'.format(pid)) as f:
+                return f.read().rpartition(')')[2].split()[0]
+        except IOError:
+            return None
+
+    def test_timeout_after_process_is_waited(self):
+        # the timer fires after the process is waited for but before the deadline is cancelled
+        process = mock.Mock(pid=1, returncode=0)
+        deadline = core._Deadline(process, 60)
+        self.addCleanup(deadline.cancel)
+
+        with mock.patch('os.killpg') as killpg_mock:
+            deadline._expire()
+
+        self.assertFalse(deadline.expired)
+        self.assertEqual(killpg_mock.call_count, 0)
+        self.assertEqual(process.kill.call_count, 0)
+
+    def test_timeout_not_expired(self):
+        self.assertEqual(core.exe('echo 1', '', timeout=10).stdout, '1')
+
+    @mock.patch('shellpython.config.COMMAND_TIMEOUT', 0.3)
+    def test_timeout_config(self):
+        with self.assertRaises(core.CommandTimeoutError):
+            core.exe('sleep 10', 'n')
+
+        job = core.exe('sleep 10', 'b')
+        with self.assertRaises(core.CommandTimeoutError):
+            job.result()
+
+    def test_timeout_stream(self):
+        result = core.exe('echo 1; sleep 10', 's', timeout=0.3)
+
+        with self.assertRaises(core.CommandTimeoutError):
+            self.assertEqual(list(result), ['1'])
+
+    def test_timeout_interactive(self):
+        result = core.exe('sleep 10', 'i', timeout=0.3)
+
+        self.assertRaises(StopIteration, result.sreadline)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertTrue(result.timed_out)
+
+    @mock.patch('shellpython.config.OUTPUT_SPILL_THRESHOLD', 1000)
+    def test_spill_to_disk(self):
+        result = core.exe('seq 100000; printf last; seq 3 1>&2', '')
+
+        self.assertNotIsInstance(result.stdout_lines, list)
+        self.assertEqual(len(result.stdout_lines), 100001)
+        self.assertEqual(result.stdout_lines[0], '1')
+        self.assertEqual(result.stdout_lines[-1], 'last')
+        self.assertEqual(result.stdout_lines[9:12], ['10', '11', '12'])
+        self.assertRaises(IndexError, lambda: result.stdout_lines[100001])
+        self.assertEqual(list(result)[99998:], ['99999', '100000', 'last'])
+        self.assertTrue(result.stdout.endswith('100000\nlast'))
+        self.assertEqual(result.stderr_lines, ['1', '2', '3'])
+
+    @mock.patch('shellpython.config.OUTPUT_SPILL_THRESHOLD', 1000)
+    def test_spill_to_disk_background(self):
+        result = core.exe('seq 100000 1>&2', 'b').result()
+
+        self.assertEqual(len(result.stderr_lines), 100000)
+
+    def test_raw(self):
+        result = core.exe('printf "\\377\\n\\000\\n\\n"; echo err 1>&2', 'r')
+
+        self.assertEqual(result.stdout, b'\xff\n\x00\n\n')
+        self.assertEqual(result.stdout_bytes, b'\xff\n\x00\n\n')
+        self.assertEqual(result.stdout_lines, [b'\xff', b'\x00', b''])
+        self.assertEqual(result.stderr, 'err')
+
+    def test_raw_stream(self):
+        self.assertEqual(list(core.exe('printf "\\377\\n1"', 'sr')), [b'\xff', b'1'])
+
+    def test_bytes(self):
+        result = core.exe('printf "1\\n"; printf 2 1>&2', '')
+
+        self.assertEqual(result.stdout_bytes, b'1\n')
+        self.assertEqual(result.stderr_bytes, b'2')
+
+    @unittest.skipIf(sys.version_info[0] == 2, 'output is not decoded in python 2')
+    @mock.patch('shellpython.config.ENCODING', 'latin-1')
+    def test_encoding_config(self):
+        self.assertEqual(core.exe('printf "\\351"', '').stdout, u'\xe9')
+        self.assertEqual(list(core.exe('printf "\\351"', 's')), [u'\xe9'])
+
+    @unittest.skipIf(sys.version_info[0] == 2, 'output is not decoded in python 2')
+    def test_encoding_not_known(self):
+        with mock.patch('sys.stdout', mock.Mock(encoding=None)), \
+                mock.patch('locale.getpreferredencoding', return_value='latin-1'):
+            self.assertEqual(core.exe('printf "\\351"', '').stdout, u'\xe9')
+
+    @unittest.skipIf(sys.version_info[0] == 2, 'output is not decoded in python 2')
+    @mock.patch('shellpython.config.ENCODING', 'utf-8')
+    def test_interactive_character_split_between_reads(self):
+        result = core.exe('printf "\\303"; sleep 0.2; printf "\\251\\n2"', 'i')
+
+        self.assertEqual(list(result), [u'\xe9', '2'])
+
+    def test_pipeline(self):
+        result = core.exe('sort -u', '', stdin=core.exe('printf "b\\na\\nb\\n"', 's'))
+
+        self.assertEqual(result.stdout_lines, ['a', 'b'])
+        self.assertEqual(result.pipestatus, [0, 0])
+
+    def test_pipeline_of_three_commands(self):
+        first = core.exe('seq 100000', 's')
+        second = core.exe('grep 7', 's', stdin=first)
+        result = core.exe('wc -l', '', stdin=second)
+
+        self.assertEqual(result.stdout.strip(), '40951')
+        self.assertEqual(result.pipestatus, [0, 0, 0])
+
+    def test_pipeline_failure(self):
+        with self.assertRaises(core.NonZeroReturnCodeError) as cm:
+            core.exe('cat', '', stdin=core.exe('echo 1; exit 3', 's'))
+
+        self.assertEqual(cm.exception.result.returncode, 3)
+        self.assertEqual(cm.exception.result.pipestatus, [3, 0])
+        self.assertEqual(cm.exception.result.stdout, '1')
+        self.assertEqual(cm.exception.cmd, 'echo 1; exit 3 | cat')
+
+        result = core.exe('exit 4', 'n', stdin=core.exe('exit 3', 's'))
+        self.assertEqual(result.returncode, 4)
+        self.assertEqual(result.pipestatus, [3, 4])
+
+    def test_pipeline_stream_and_job(self):
+        lines = list(core.exe('tr a b', 's', stdin=core.exe('echo a', 's')))
+        self.assertEqual(lines, ['b'])
+
+        job = core.exe('tr a b', 'b', stdin=core.exe('echo a', 's'))
+        self.assertEqual(job.result().stdout, 'b')
+        self.assertEqual(job.result().pipestatus, [0, 0])
+
+    def test_pipeline_source_already_read(self):
+        source = core.exe('echo 1', 's')
+        core.exe('cat', '', stdin=source)
+
+        self.assertRaises(core.ShellpyError, list, source)
+        self.assertRaises(core.ShellpyError, core.exe, 'cat', '', stdin=source)
+        self.assertRaises(TypeError, core.exe, 'cat', '', stdin=1.5)
+
+    def test_stdin_bytes_and_text(self):
+        self.assertEqual(core.exe('cat', '', stdin=b'\xff').stdout_bytes, b'\xff')
+        self.assertEqual(core.exe('cat', '', stdin=u'1\n2').stdout_lines, ['1', '2'])
+        self.assertEqual(core.exe('wc -c', '', stdin=core.exe('echo 12', '')).stdout.strip(), '3')
+
+    def test_stdin_big(self):
+        # much more data than a pipe buffer may hold is written while the output is read
+        data = b'x' * (10 * 1024 * 1024)
+        result = core.exe('cat', 'r', stdin=data)
+
+        self.assertEqual(len(result.stdout_bytes), len(data))
+
+    def test_stdin_lines(self):
+        result = core.exe('sort -u', '', stdin=(str(i % 1000) for i in range(100000)))
+
+        self.assertEqual(len(result.stdout_lines), 1000)
+
+    def test_stdin_file(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'1\n2\n')
+            f.flush()
+            f.seek(0)
+
+            self.assertEqual(core.exe('cat', '', stdin=f).stdout_lines, ['1', '2'])
+
+        self.assertEqual(core.exe('cat', '', stdin=io.BytesIO(b'1\n2')).stdout_lines, ['1', '2'])
+
+    def test_stdin_not_read(self):
+        self.assertEqual(core.exe('head -n 1', '', stdin=('line' for _ in range(1000000))).stdout, 'line')
+
+    def test_stdin_error(self):
+        def lines():
+            yield 'line'
+            raise ValueError('no more lines')
+
+        self.assertRaises(ValueError, core.exe, 'cat', '', stdin=lines())
+
+    def test_interactive_swritelines(self):
+        result = core.exe('cat', 'i')
+        result.swritelines(['1', '2'])
+        result.stdin.close()
+
+        self.assertEqual(list(result), ['1', '2'])
+
+    def test_interactive_expect(self):
+        result = core.exe('echo start; printf "Password: "; read password; echo "got $password"', 'i')
+
+        self.assertEqual(result.expect(['denied', '[Pp]assword: $'], timeout=5), 1)
+        self.assertEqual(result.stdout.before, 'start\n')
+        result.swriteline('secret')
+
+        self.assertEqual(result.sreadline(timeout=5), 'got secret')
+        self.assertRaises(EOFError, result.expect, 'more', 5)
+        self.assertTrue(result.stdout.eof)
+
+    def test_interactive_read_timeout(self):
+        result = core.exe('printf 1; sleep 0.5; echo 2; echo 3', 'i')
+
+        with self.assertRaises(core.StreamTimeoutError) as cm:
+            result.sreadline(timeout=0.1)
+        self.assertEqual(cm.exception.data, '1')
+
+        self.assertEqual(result.sreadline(timeout=5), '12')
+        self.assertEqual(result.sreadline(), '3')
+        self.assertRaises(StopIteration, result.sreadline, 5)
+
+    def test_interactive_read_available(self):
+        result = core.exe('echo 1; printf 2; sleep 0.3; echo 3', 'i')
+
+        self.assertEqual(result.expect('2'), 0)
+        self.assertEqual(result.read_available(), '')
+        self.assertRaises(core.StreamTimeoutError, result.expect, '3', 0.05)
+        time.sleep(0.5)
+
+        self.assertEqual(result.read_available(), '3\n')
+        self.assertEqual(result.returncode, 0)
+
+    def test_rlimits(self):
+        result = core.exe('ulimit -t; ulimit -Hv', '', rlimits={'cpu': 5, 'as': (1024 ** 3, 2 * 1024 ** 3)})
+
+        self.assertEqual(result.stdout_lines, ['5', str(2 * 1024 ** 2)])
+
+    def test_rlimits_unknown(self):
+        self.assertRaises(core.ShellpyError, core.exe, 'echo 1', '', rlimits={'unknown': 1})
+
+
+class TestResult(unittest.TestCase):
+
+    def test_lines_and_text(self):
+        result = core.Result(b'1\n\n3\n', b'error\n', 'utf-8', 'utf-8')
+
+        self.assertEqual(result.stdout, '1\n\n3')
+        self.assertEqual(result.stdout_lines, ['1', '', '3'])
+        self.assertEqual(list(result), ['1', '', '3'])
+        self.assertEqual(result.stderr, 'error')
+        self.assertEqual(result.stderr_lines, ['error'])
+
+    def test_no_trailing_line_separator(self):
+        result = core.Result(b'1\n2', b'', 'utf-8', 'utf-8')
+
+        self.assertEqual(result.stdout, '1\n2')
+        self.assertEqual(result.stdout_lines, ['1', '2'])
+        self.assertEqual(result.stderr, '')
+        self.assertEqual(result.stderr_lines, [])
+
+    def test_equality(self):
+        self.assertEqual(core.Result(b'1\n', b'', 'utf-8', 'utf-8'), core.Result(b'1', b'x', 'utf-8', 'utf-8'))
+        self.assertTrue(core.Result(b'1\n', b'', 'utf-8', 'utf-8') == '1')
+
+    def test_compact(self):
+        self.assertFalse(hasattr(core.Result(), '__dict__'))